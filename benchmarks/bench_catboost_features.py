@@ -0,0 +1,109 @@
+"""CatBoost features: the columnar many-text builder vs the row-wise fill_values frame, and batched tagging.
+
+Checks that catboost_feature_frame() gives exactly the frame the row-wise
+training code built (values, element types and dtypes) on generated
+addresses, single tokens and free text, then times both builders and
+compares batched CatBoost tagging against one predict call per text.
+
+    python benchmarks/bench_catboost_features.py --texts 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catboost_tagger import catboost_feature_frame_many, catboost_pool, parse_many_catboost  # noqa: E402
+from explain import catboost_feature_frame  # noqa: E402
+from generator import generate_addresses  # noqa: E402
+from models import get_model  # noqa: E402
+from tagger import tokens_to_features  # noqa: E402
+
+
+def fill_values(row, value_columns):
+    for col in value_columns:
+        if pd.isna(row[col]):
+            if row['EOS']==1:
+                row[col] = 'EOS'
+            elif row['BOS'] == 1:
+                row[col] = 'BOS'
+    return row
+
+
+def reference_frame(tokens, columns=None):
+    """The row-wise frame catboost_feature_frame() built before the columnar builder."""
+    feature_matrix = [tokens_to_features(tokens, i) for i in range(len(tokens))]
+    feature_df = pd.DataFrame(feature_matrix)
+    if columns is not None:
+        absent = [col for col in columns if col not in feature_df.columns]
+        feature_df = feature_df.reindex(columns=columns)
+        feature_df[absent] = feature_df[absent].astype(object)
+    feature_df['BOS'] = feature_df['BOS'].apply(lambda x: 1 if x else 0)
+    feature_df['EOS'] = feature_df['EOS'].apply(lambda x: 1 if x else 0)
+    cat_features = feature_df.select_dtypes(include=['object']).columns.tolist()
+    return feature_df.apply(lambda row: fill_values(row, cat_features), axis=1)
+
+
+def assert_same(got, expected):
+    pd.testing.assert_frame_equal(got, expected, check_exact=True)
+    for col in expected.columns:
+        if expected[col].dtype == object:
+            assert [type(value) for value in got[col]] == [type(value) for value in expected[col]], col
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--texts", type=int, default=5_000)
+    args = parser.parse_args()
+
+    model = get_model("catboost")
+    columns = model.feature_names_
+    addresses, _ = generate_addresses(args.texts)
+    extra = ["กรุงเทพ", "10110", "ถนน สุขุมวิท 10110", "   ", "a b", "ซอย 5 ซอย 5 ซอย"]
+    token_lists = [text.split() for text in addresses + extra if text.split()]
+
+    for tokens in token_lists[:500] + token_lists[-len(extra):]:
+        assert_same(catboost_feature_frame(tokens), reference_frame(tokens))
+        assert_same(catboost_feature_frame(tokens, columns), reference_frame(tokens, columns))
+    expected = pd.concat([reference_frame(tokens, columns) for tokens in token_lists[:500]], ignore_index=True)
+    assert_same(catboost_feature_frame_many(token_lists[:500], columns), expected)
+    print("identical frames, element types and dtypes on addresses, single tokens and free text")
+
+    start = time.perf_counter()
+    for tokens in token_lists:
+        reference_frame(tokens, columns)
+    reference_time = time.perf_counter() - start
+    start = time.perf_counter()
+    feature_df = catboost_feature_frame_many(token_lists, columns)
+    columnar_time = time.perf_counter() - start
+    print(f"{len(token_lists):,} texts, {len(feature_df):,} tokens: row-wise {reference_time:.2f}s, "
+          f"columnar {columnar_time:.3f}s ({reference_time / columnar_time:.0f}x)")
+
+    texts = [" ".join(tokens) for tokens in token_lists]
+    subset = texts[:500]
+    start = time.perf_counter()
+    one_by_one = [model.predict(catboost_pool(reference_frame(text.split(), columns), model)).ravel().tolist()
+                  for text in subset]
+    single_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batched = parse_many_catboost(subset)
+    batched_time = time.perf_counter() - start
+    assert batched == one_by_one
+    print(f"{len(subset):,} texts tagged identically: one call per text {single_time:.2f}s, "
+          f"batched {batched_time:.3f}s ({single_time / batched_time:.0f}x)")
+
+    start = time.perf_counter()
+    tags = parse_many_catboost(texts)
+    elapsed = time.perf_counter() - start
+    n_tokens = sum(map(len, tags))
+    print(f"{len(texts):,} texts batched: {elapsed:.2f}s ({len(texts) / elapsed:,.0f} texts/s, "
+          f"{n_tokens / elapsed:,.0f} tokens/s)")
+    assert np.array_equal([len(t) for t in tags], [len(tokens) for tokens in token_lists])
+
+
+if __name__ == "__main__":
+    main()
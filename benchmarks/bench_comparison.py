@@ -0,0 +1,59 @@
+"""Model comparison: one shared feature pass for both models vs each model featurizing on its own.
+
+Checks that compare_models() gives each model exactly the confusion matrix
+it gets when tagged by itself (crfsuite for the CRF, parse_many_catboost()
+for CatBoost), then times the shared run against the two separate ones.
+
+    python benchmarks/bench_comparison.py --addresses 50000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catboost_tagger import parse_many_catboost  # noqa: E402
+from comparison import compare_models  # noqa: E402
+from evaluation import ConfusionAccumulator, evaluate_batches, generated_batches  # noqa: E402
+from viterbi import parse_many_numpy  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--addresses", type=int, default=50_000)
+    parser.add_argument("--batch-size", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    batches = list(generated_batches(args.addresses, batch_size=args.batch_size))
+    for decoder in ("crfsuite", "numpy"):
+        compared = compare_models(batches[:2], decoder)
+        crf = evaluate_batches(batches[:2], decoder="crfsuite")
+        catboost = ConfusionAccumulator()
+        for addresses, label_list in batches[:2]:
+            catboost.add(label_list, parse_many_catboost(addresses))
+        assert np.array_equal(compared.confusion("CRF").counts, crf.counts), decoder
+        assert np.array_equal(compared.confusion("CatBoost").counts, catboost.counts), decoder
+    print("shared-pass confusion matrices identical to each model tagged on its own")
+
+    # Interleaved and repeated, best of each: the first runs also fill the word feature caches
+    shared, separate = [], []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        accumulator = compare_models(batches)
+        shared.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for addresses, _ in batches:
+            parse_many_numpy(addresses)
+            parse_many_catboost(addresses)
+        separate.append(time.perf_counter() - start)
+    print(f"{args.addresses:,} addresses, {accumulator.total:,} tokens: both models from one feature pass "
+          f"{min(shared):.2f}s (scoring included), each on its own {min(separate):.2f}s")
+    print(accumulator.speed_frame().to_string(float_format="{:,.2f}".format))
+
+
+if __name__ == "__main__":
+    main()
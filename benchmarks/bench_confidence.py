@@ -0,0 +1,57 @@
+"""Token confidence: cost of tagging with marginals on top of plain batch tagging.
+
+Checks the tags match parse_many() and the confidences match
+predict_marginals() up to float16 rounding, then times both paths.
+
+    python benchmarks/bench_confidence.py --addresses 50000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator import generate_addresses  # noqa: E402
+from models import get_model  # noqa: E402
+from tagger import parse_many, parse_many_with_confidence, text_to_features  # noqa: E402
+
+
+def check_equivalence(texts):
+    tags_list, confidence_list = parse_many_with_confidence(texts)
+    assert tags_list == parse_many(texts)
+    marginals = get_model("crf").predict_marginals([text_to_features(text) for text in texts])
+    for tags, confidence, marginal in zip(tags_list, confidence_list, marginals):
+        expected = np.array([m[tag] for tag, m in zip(tags, marginal)])
+        np.testing.assert_allclose(confidence.astype(np.float64), expected, atol=1e-3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--addresses", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    texts, _ = generate_addresses(args.addresses)
+    check_equivalence(texts[:2000] + ["", "ผู้"])
+    print("tags identical, confidences match predict_marginals")
+
+    timings = {}
+    for name, fn in (("tags", parse_many), ("tags+confidence", parse_many_with_confidence)):
+        # Best of a few runs; single runs on a busy machine vary by more than the overhead
+        timings[name] = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = fn(texts)
+            timings[name] = min(timings[name], time.perf_counter() - start)
+        print(f"{name:>16}: {timings[name]:6.2f}s  {len(texts) / timings[name]:>10,.0f} addresses/s")
+    print(f"overhead: {timings['tags+confidence'] / timings['tags'] - 1:+.1%}")
+
+    confidence_bytes = sum(scores.nbytes for scores in result[1])
+    print(f"confidence storage: {confidence_bytes / 2**20:.1f} MiB as float16")
+
+
+if __name__ == "__main__":
+    main()
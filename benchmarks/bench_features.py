@@ -0,0 +1,93 @@
+"""Token feature extraction: the original per-call dict builder vs the memoized one.
+
+Checks that both produce identical feature dicts (including key order, which
+decides the CatBoost column order) before timing them.
+
+    python benchmarks/bench_features.py --addresses 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator import generate_addresses  # noqa: E402
+from tagger import stopwords, text_to_features, tokens_to_features, word_features  # noqa: E402
+
+
+def reference_tokens_to_features(tokens, i):
+  word = tokens[i]
+
+  features = {
+    "bias": 1.0,
+    "word.word": word,
+    "word[:3]": word[:3],
+    "word.isspace()": word.isspace(),
+    "word.is_stopword()": word in stopwords,
+    "word.isdigit()": word.isdigit(),
+    "word.islen5": word.isdigit() and len(word) == 5
+  }
+
+  if i > 0:
+    prevword = tokens[i - 1]
+    features.update({
+      "-1.word.prevword": prevword,
+      "-1.word.isspace()": prevword.isspace(),
+      "-1.word.is_stopword()": prevword in stopwords,
+      "-1.word.isdigit()": prevword.isdigit(),
+    })
+  else:
+    features["BOS"] = True
+
+  if i < len(tokens) - 1:
+    nextword = tokens[i + 1]
+    features.update({
+      "+1.word.nextword": nextword,
+      "+1.word.isspace()": nextword.isspace(),
+      "+1.word.is_stopword()": nextword in stopwords,
+      "+1.word.isdigit()": nextword.isdigit(),
+    })
+  else:
+    features["EOS"] = True
+
+  return features
+
+
+def reference_text_to_features(text):
+    tokens = text.split()
+    return [reference_tokens_to_features(tokens, i) for i in range(len(tokens))]
+
+
+def check_equivalence(texts):
+    extra = ["", "ผู้", "ที่ 10230", "  ", "นายวิเชียร ผู้พักอาศัยอยู่ที่ ซ.ทองหล่อ 23 เขตพระโขนง"]
+    for text in list(texts) + extra:
+        expected = reference_text_to_features(text)
+        for got in (text_to_features(text),
+                    [tokens_to_features(text.split(), i) for i in range(len(text.split()))]):
+            assert got == expected, text
+            assert [list(f) for f in got] == [list(f) for f in expected], text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--addresses", type=int, default=100_000)
+    args = parser.parse_args()
+
+    texts, _ = generate_addresses(args.addresses)
+    n_tokens = sum(len(text.split()) for text in texts)
+
+    check_equivalence(texts[:1000])
+    print("feature dicts identical to the reference implementation")
+
+    for name, fn in (("reference", reference_text_to_features), ("memoized", text_to_features)):
+        start = time.perf_counter()
+        for text in texts:
+            fn(text)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10}: {n_tokens / elapsed:>12,.0f} tokens/s")
+    print(word_features.cache_info())
+
+
+if __name__ == "__main__":
+    main()
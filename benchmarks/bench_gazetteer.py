@@ -0,0 +1,62 @@
+"""Gazetteer index: lookup cost per token and the effect of post-correction on accuracy.
+
+Annotates generated addresses (in order and shuffled) with the index, timing
+cold lookups (empty cache) and warm ones, then compares token accuracy of
+the CRF's tags with and without gazetteer post-correction. The generator
+draws from the same gazetteers, so the accuracy gain here is an upper bound.
+
+    python benchmarks/bench_gazetteer.py --addresses 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gazetteer import GazetteerIndex  # noqa: E402
+from generator import generate_addresses  # noqa: E402
+from tagger import parse_many  # noqa: E402
+
+
+def accuracy(tags_list, labels_list):
+    correct = sum(p == t for tags, labels in zip(tags_list, labels_list) for p, t in zip(tags, labels))
+    return correct / sum(map(len, labels_list))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--addresses", type=int, default=100_000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = GazetteerIndex()
+    print(f"index built in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    addresses, label_list = generate_addresses(args.addresses)
+    rng = np.random.default_rng(0)
+    ordered = [address.split() for address in addresses]
+    permutations = [rng.permutation(len(tokens)) for tokens in ordered]
+    shuffled = [[tokens[i] for i in order] for tokens, order in zip(ordered, permutations)]
+    shuffled_labels = [[labels[i] for i in order] for labels, order in zip(label_list, permutations)]
+    n_tokens = sum(map(len, ordered))
+
+    for name in ("cold", "warm"):
+        start = time.perf_counter()
+        index.annotate(ordered)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>5} annotate: {elapsed * 1e9 / n_tokens:6.0f} ns/token  ({n_tokens / elapsed:,.0f} tokens/s)")
+
+    for name, token_lists, expected in (("ordered", ordered, label_list), ("shuffled", shuffled, shuffled_labels)):
+        predicted = parse_many([" ".join(tokens) for tokens in token_lists])
+        start = time.perf_counter()
+        corrected = index.correct_many(token_lists, predicted)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>8}: accuracy {accuracy(predicted, expected):.3f} -> {accuracy(corrected, expected):.3f} "
+              f"with correction ({elapsed * 1e9 / n_tokens:.0f} ns/token)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Bulk file tagging: throughput, and peak memory against file size and chunk size.
+
+Writes generated addresses to CSV, Parquet and JSONL files of two sizes and
+tags each with ingest.tag_file(). Peak traced memory should follow the chunk
+size and stay flat as the file grows.
+
+    python benchmarks/bench_ingest.py --rows 20000 40000 --chunk-sizes 1000 10000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator import generate_addresses  # noqa: E402
+from ingest import tag_file  # noqa: E402
+from models import get_model  # noqa: E402
+
+
+def write_input(directory, n_rows, fmt):
+    addresses, _ = generate_addresses(n_rows)
+    df = pd.DataFrame({"id": range(n_rows), "Address": addresses})
+    path = os.path.join(directory, f"in-{n_rows}.{fmt}")
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+    elif fmt == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_json(path, orient="records", lines=True, force_ascii=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[20_000, 40_000])
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--formats", nargs="+", default=["csv", "parquet", "jsonl"])
+    args = parser.parse_args()
+
+    get_model("crf")
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt in args.formats:
+            for n_rows in args.rows:
+                source = write_input(directory, n_rows, fmt)
+                for chunk_size in args.chunk_sizes:
+                    output = os.path.join(directory, f"out.{fmt}")
+                    tracemalloc.start()
+                    start = time.perf_counter()
+                    _, written = tag_file(source, output, ["Address"], chunk_size=chunk_size)
+                    elapsed = time.perf_counter() - start
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    assert written == n_rows
+                    rows.append({
+                        "format": fmt,
+                        "rows": n_rows,
+                        "chunk size": chunk_size,
+                        # tracemalloc slows everything down; compare rows/s between rows of this table only
+                        "rows/s": n_rows / elapsed,
+                        "peak MiB": peak / 2**20,
+                    })
+    print(pd.DataFrame(rows).to_string(index=False, float_format="{:,.1f}".format))
+
+
+if __name__ == "__main__":
+    main()
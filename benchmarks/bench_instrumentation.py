@@ -0,0 +1,97 @@
+"""Instrumentation overhead: spans disabled, enabled, and not there at all.
+
+Times empty spans to get the fixed cost per span, then a realistic stage
+(tagging a chunk of addresses, wrapped in a span per chunk) with profiling
+off and on, reporting the overhead of each against the bare stage.
+
+    python benchmarks/bench_instrumentation.py --spans 1000000 --addresses 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator import generate_addresses  # noqa: E402
+from instrumentation import Profiler  # noqa: E402
+from tagger import DEFAULT_CHUNK_SIZE, parse_many  # noqa: E402
+
+
+def best_of(repeat, run):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--spans", type=int, default=1_000_000)
+    parser.add_argument("--addresses", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    log_path = os.path.join(tempfile.mkdtemp(), "profile.jsonl")
+    profiler = Profiler(log_path=log_path)
+
+    def bare():
+        for _ in range(args.spans):
+            pass
+
+    def spans():
+        for _ in range(args.spans):
+            with profiler.span("empty"):
+                pass
+
+    loop = best_of(args.repeat, bare)
+    disabled = best_of(args.repeat, spans)
+    print(f"disabled span: {(disabled - loop) * 1e9 / args.spans:8.0f} ns")
+    profiler.enable()
+    n_enabled = args.spans // 100
+
+    def nested_spans():
+        # Nested like real stages, so most lines are written without a flush
+        with profiler.span("outer"):
+            for _ in range(n_enabled):
+                with profiler.span("empty"):
+                    pass
+
+    enabled = best_of(args.repeat, nested_spans)
+    profiler.disable()
+    print(f" enabled span: {enabled * 1e9 / n_enabled:8.0f} ns (CPU clock, tracemalloc and a log line each)")
+
+    addresses, _ = generate_addresses(args.addresses)
+    chunks = [addresses[start:start + DEFAULT_CHUNK_SIZE] for start in range(0, len(addresses), DEFAULT_CHUNK_SIZE)]
+
+    def stage(instrumented):
+        def run():
+            for chunk in chunks:
+                if instrumented:
+                    with profiler.span("tag chunk"):
+                        parse_many(chunk)
+                else:
+                    parse_many(chunk)
+        return run
+
+    # Fill the word feature cache first, so that no variant pays for it
+    stage(False)()
+    # Interleaved so that drifting machine load hits every variant alike; best run of each
+    timings = {"no spans": [], "profiling off": [], "profiling on": []}
+    for _ in range(args.repeat):
+        timings["no spans"].append(best_of(1, stage(False)))
+        timings["profiling off"].append(best_of(1, stage(True)))
+        profiler.enable()
+        timings["profiling on"].append(best_of(1, stage(True)))
+        profiler.disable()
+    baseline, off, on = (min(values) for values in timings.values())
+    print(f"\ntagging {args.addresses:,} addresses in {len(chunks)} chunks")
+    for name, elapsed in (("no spans", baseline), ("profiling off", off), ("profiling on", on)):
+        print(f"{name:>14}: {elapsed:7.3f}s  ({(elapsed / baseline - 1) * 100:+6.2f}%)")
+
+
+if __name__ == "__main__":
+    main()
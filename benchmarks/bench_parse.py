@@ -0,0 +1,47 @@
+"""Throughput of one predict call per address vs batched parse_many().
+
+Run from the repository root:
+
+    python benchmarks/bench_parse.py --sizes 100 10000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator import generate_addresses  # noqa: E402
+from models import get_model  # noqa: E402
+from tagger import parse_many, text_to_features  # noqa: E402
+
+
+def parse_one_by_one(texts):
+    # The pre-batching code path: a one-element predict call per address
+    model = get_model("crf")
+    return [model.predict([text_to_features(text)])[0] for text in texts]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 1_000_000])
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    get_model("crf")  # keep the one-off model load out of the timings
+    print(f"{'addresses':>10} {'per-address/s':>16} {'parse_many() addr/s':>20} {'speedup':>8}")
+    for n in args.sizes:
+        texts, _ = generate_addresses(n)
+        single = timed(parse_one_by_one, texts)
+        batched = timed(parse_many, texts, args.chunk_size)
+        print(f"{n:>10} {n / single:>16,.0f} {n / batched:>20,.0f} {single / batched:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Latency of typical page interactions, measured with Streamlit's AppTest.
+
+Besides the wall time of the rerun, prints which sections actually ran and
+how long each took (the page's own section timings).
+
+    python benchmarks/bench_reruns.py --repeat 3
+"""
+import argparse
+import os
+import statistics
+import time
+
+from streamlit.testing.v1 import AppTest
+
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "visual.py")
+
+
+def _by_label(widgets, label):
+    return next(widget for widget in widgets if widget.label == label)
+
+
+INTERACTIONS = {
+    "bar chart data source": lambda at: _by_label(at.selectbox, "Select Data to Show").set_value("Fixed"),
+    "free text edit": lambda at: at.text_area[0].set_value(at.text_area[0].value + " 10230"),
+    "toggle SHAP": lambda at: _by_label(at.checkbox, "Show SHAP value of each token").uncheck(),
+    "generator format change": lambda at: _by_label(at.multiselect, "Select Soi Format").unselect("ซอย"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'interaction':<26} {'median ms':>10}  sections rerun (ms)")
+    for name, interact in [("initial load", None)] + list(INTERACTIONS.items()):
+        timings = []
+        sections = {}
+        for _ in range(args.repeat):
+            at = AppTest.from_file(APP, default_timeout=600)
+            if interact is None:
+                start = time.perf_counter()
+                at.run()
+            else:
+                at.run()
+                interact(at)
+                at.session_state["section_timings"] = {}
+                start = time.perf_counter()
+                at.run()
+            timings.append(time.perf_counter() - start)
+            assert not at.exception, at.exception
+            for section, record in at.session_state["section_timings"].items():
+                sections.setdefault(section, []).append(record["wall_ms"])
+        summary = ", ".join(f"{section} {statistics.median(ms):.0f}" for section, ms in sections.items())
+        print(f"{name:<26} {statistics.median(timings) * 1000:>10.0f}  {summary}")
+
+
+if __name__ == "__main__":
+    main()
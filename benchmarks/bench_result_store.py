@@ -0,0 +1,93 @@
+"""Session results: lists of strings vs the columnar ResultStore.
+
+Tags generated addresses, then reports the memory each layout holds and the
+time to build the per-rerun DataFrame, after checking that the store gives
+back the same addresses, tags, confusion matrix and Sankey links.
+
+    python benchmarks/bench_result_store.py --samples 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evaluation import ConfusionAccumulator  # noqa: E402
+from generator import generate_addresses  # noqa: E402
+from result_store import ResultStore  # noqa: E402
+from sankey import pad_codes, sankey_transitions, sankey_transitions_from_matrix  # noqa: E402
+from tagger import parse_many_with_confidence  # noqa: E402
+
+
+def deep_size(obj, seen):
+    """Bytes held by lists, strings and arrays reachable from `obj`, counting shared objects once."""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in obj)
+    return size
+
+
+def check_equivalence(store, addresses, predictions, labels, confidence):
+    assert store.addresses() == addresses
+    assert all(store.prediction(i) == predictions[i] and store.label(i) == labels[i] for i in range(len(store)))
+    assert np.array_equal(np.concatenate(confidence), store.confidence)
+    expected = ConfusionAccumulator().add(labels, predictions).counts
+    assert np.array_equal(ConfusionAccumulator().add_codes(store.labels, store.predictions).counts, expected)
+    links = sankey_transitions_from_matrix(pad_codes(store.predictions, store.lengths))
+    assert all(np.array_equal(a, b) for a, b in zip(links[1:], sankey_transitions(predictions)[1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=100_000)
+    args = parser.parse_args()
+
+    addresses, labels = generate_addresses(args.samples)
+    predictions, confidence = parse_many_with_confidence(addresses)
+
+    start = time.perf_counter()
+    store = ResultStore.from_lists(addresses, predictions, labels, confidence)
+    build = time.perf_counter() - start
+    check_equivalence(store, addresses, predictions, labels, confidence)
+    print(f"store identical to the lists; built in {build:.2f}s")
+
+    seen = set()
+    lists = {
+        "addresses": deep_size(addresses, seen),
+        "predictions": deep_size(predictions, seen),
+        "labels": deep_size(labels, seen),
+        "confidence": deep_size(confidence, seen),
+    }
+    columns = store.memory_usage()
+    columns["addresses"] += columns.pop("token offsets")
+    report = pd.DataFrame({"lists": lists, "ResultStore": columns}) / 2**20
+    report.loc["total"] = report.sum()
+    report["ratio"] = report["lists"] / report["ResultStore"]
+    print(f"\nMemory per result set at {args.samples:,} samples (MiB)")
+    print(report.to_string(float_format="{:,.2f}".format))
+
+    timings = {}
+    for name, build_frame in (
+        ("pd.DataFrame(lists)", lambda: pd.DataFrame({"Address": addresses, "Prediction": predictions, "Labels": labels})),
+        ("store.to_pandas()", store.to_pandas),
+        ("store.to_arrow()", store.to_arrow),
+        ("store.to_arrow(decode_tags=True)", lambda: store.to_arrow(decode_tags=True)),
+    ):
+        start = time.perf_counter()
+        for _ in range(5):
+            build_frame()
+        timings[name] = (time.perf_counter() - start) / 5 * 1000
+    print("\nFrame construction (ms)")
+    for name, ms in timings.items():
+        print(f"{name:>34}: {ms:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
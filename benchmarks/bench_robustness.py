@@ -0,0 +1,86 @@
+"""Permutation robustness: batched index-array permutations vs re-parsing each shuffled string.
+
+Draws the same token orders for both paths. The reference joins every
+permuted address back into a string and tags it with crfsuite; the engine
+gathers precomputed per-word emission pieces and Viterbi-decodes whole
+batches. Checks that both give identical counts, then times the engine at
+full size.
+
+    python benchmarks/bench_robustness.py --addresses 10000 --permutations 100 --reference 1000
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evaluation import TAGS  # noqa: E402
+from generator import generate_addresses  # noqa: E402
+from robustness import DEFAULT_BATCH_SEQUENCES, PermutationAccumulator, permutation_indices, permutation_robustness  # noqa: E402
+from sankey import encode_tag_codes  # noqa: E402
+from tagger import parse_many  # noqa: E402
+
+
+def reference(addresses, label_list, k, seed):
+    """The engine's orders, applied to strings one address at a time and tagged with crfsuite."""
+    rng = np.random.default_rng(seed)
+    accumulator = PermutationAccumulator()
+    token_lists = [address.split() for address in addresses]
+    lengths = np.array([len(tokens) for tokens in token_lists])
+    for length in np.unique(lengths[lengths > 0]).tolist():
+        rows = np.flatnonzero(lengths == length)
+        per_batch = max(1, DEFAULT_BATCH_SEQUENCES // min(k, math.factorial(length)))
+        for start in range(0, len(rows), per_batch):
+            batch = rows[start:start + per_batch]
+            orders = permutation_indices(length, k, len(batch), rng)
+            texts, truth = [], []
+            for row, row_orders in zip(batch.tolist(), orders.tolist()):
+                for order in row_orders:
+                    texts.append(" ".join(token_lists[row][i] for i in order))
+                    truth.append([label_list[row][i] for i in order])
+            predicted = encode_tag_codes(parse_many(texts), TAGS).reshape(-1, length)
+            accumulator.add(orders.reshape(-1, length), encode_tag_codes(truth, TAGS).reshape(-1, length), predicted)
+    return accumulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--addresses", type=int, default=10_000)
+    parser.add_argument("--permutations", type=int, default=100)
+    parser.add_argument("--reference", type=int, default=1_000, help="addresses also run through the reference")
+    args = parser.parse_args()
+
+    addresses, label_list = generate_addresses(args.addresses)
+    k = args.permutations
+
+    subset = addresses[:args.reference], label_list[:args.reference]
+    start = time.perf_counter()
+    expected = reference(*subset, k, seed=0)
+    reference_time = time.perf_counter() - start
+    start = time.perf_counter()
+    got = permutation_robustness(*subset, k, seed=0)
+    engine_time = time.perf_counter() - start
+    assert all(np.array_equal(got.counts[name], expected.counts[name]) for name in expected.counts)
+    print(f"{args.reference:,} addresses x {k} orders: identical counts; "
+          f"reference {reference_time:.2f}s, engine {engine_time:.2f}s ({reference_time / engine_time:.1f}x)")
+
+    start = time.perf_counter()
+    accumulator = permutation_robustness(addresses, label_list, k, seed=0)
+    elapsed = time.perf_counter() - start
+    print(f"{args.addresses:,} addresses x {k} orders: {accumulator.total:,} tokens in {elapsed:.2f}s "
+          f"({accumulator.total / elapsed:,.0f} tokens/s), accuracy {accumulator.accuracy:.3f}")
+    for length in (3, 4, 5):
+        start = time.perf_counter()
+        short = [" ".join(address.split()[:length]) for address in addresses]
+        short_labels = [labels[:length] for labels in label_list]
+        accumulator = permutation_robustness(short, short_labels, k, seed=0)
+        print(f"first {length} tokens, all {min(k, math.factorial(length))} orders: "
+              f"accuracy {accumulator.accuracy:.3f} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
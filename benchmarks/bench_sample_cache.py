@@ -0,0 +1,101 @@
+"""Sample cache: generating and tagging a sample set vs loading it from memory or from disk after a restart.
+
+Checks that configs differing only in ways the generator ignores share a
+key, that a set loaded by a fresh cache (as after a restart) is identical
+array for array to the one generated, and that both tiers stay within their
+byte budgets.
+
+    python benchmarks/bench_sample_cache.py --samples 100000
+"""
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator import DEFAULT_CONFIG, generate_addresses  # noqa: E402
+from result_store import ResultStore  # noqa: E402
+from sample_cache import SampleCache, SampleSet, samples_key  # noqa: E402
+from tagger import parse_many_with_confidence  # noqa: E402
+
+
+def build(n, seed, config):
+    """What the page's sample job computes, without the job and the prediction cache."""
+    addresses, label_list = generate_addresses(n, config, seed)
+    tags, confidence = parse_many_with_confidence(addresses)
+    results = ResultStore.from_lists(addresses, tags, label_list, confidence)
+    shuffled_addresses, shuffled_labels = results.shuffled_tokens(np.random.default_rng(seed))
+    tags, confidence = parse_many_with_confidence(shuffled_addresses)
+    return SampleSet(results, ResultStore.from_lists(shuffled_addresses, tags, shuffled_labels, confidence))
+
+
+def assert_same(got, expected):
+    for store in ("results", "shuffled"):
+        got_arrays = getattr(got, store).to_arrays()
+        expected_arrays = getattr(expected, store).to_arrays()
+        assert got_arrays.keys() == expected_arrays.keys()
+        for name, array in expected_arrays.items():
+            assert np.array_equal(got_arrays[name], array), (store, name)
+    for name, counts in expected.confusion.items():
+        assert np.array_equal(got.confusion[name], counts), name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    reordered = copy.deepcopy(DEFAULT_CONFIG)
+    reordered["formats"]["Name"].reverse()
+    reordered["component_visibility"]["Soi"] = False
+    hidden = copy.deepcopy(reordered)
+    hidden["formats"]["Soi"] = []
+    assert samples_key(100, 0, reordered) == samples_key(100, 0, hidden) != samples_key(100, 0, DEFAULT_CONFIG)
+    assert samples_key(100, 0, DEFAULT_CONFIG) != samples_key(100, 1, DEFAULT_CONFIG) != samples_key(101, 0, DEFAULT_CONFIG)
+    print("keys ignore format order and hidden components, and change with count and seed")
+
+    directory = tempfile.mkdtemp()
+    key = samples_key(args.samples, args.seed, DEFAULT_CONFIG)
+    start = time.perf_counter()
+    generated = build(args.samples, args.seed, DEFAULT_CONFIG)
+    generate_time = time.perf_counter() - start
+    cache = SampleCache(directory)
+    start = time.perf_counter()
+    cache.put(key, generated)
+    put_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from_memory = cache.get(key)
+    memory_time = time.perf_counter() - start
+    # A fresh cache over the same directory is what the next process sees
+    start = time.perf_counter()
+    from_disk = SampleCache(directory).get(key)
+    disk_time = time.perf_counter() - start
+    assert from_memory is generated
+    assert_same(from_disk, generated)
+    regenerated = build(args.samples, args.seed, DEFAULT_CONFIG)
+    assert_same(regenerated, generated)
+    print(f"{args.samples:,} samples ({generated.nbytes / 2**20:.1f} MiB): generate and tag {generate_time:.2f}s, "
+          f"write {put_time * 1000:.0f} ms, memory hit {memory_time * 1e6:.0f} us, "
+          f"disk hit after restart {disk_time * 1000:.0f} ms; regenerating reproduces it exactly")
+
+    small = SampleCache(tempfile.mkdtemp(), memory_bytes=3 * build(1_000, 0, DEFAULT_CONFIG).nbytes,
+                        disk_bytes=5 * os.path.getsize(os.path.join(directory, f"{key}.npz")) * 1_000 // args.samples)
+    for seed in range(10):
+        small.put(samples_key(1_000, seed, DEFAULT_CONFIG), build(1_000, seed, DEFAULT_CONFIG))
+    on_disk = sum(entry.stat().st_size for entry in os.scandir(small.directory))
+    stats = small.stats()
+    assert stats["memory_bytes"] <= small.memory_bytes and on_disk <= small.disk_bytes
+    assert small.get(samples_key(1_000, 9, DEFAULT_CONFIG)) is not None
+    print(f"10 sets into small budgets: {stats['memory_entries']} kept in memory, "
+          f"{len(os.listdir(small.directory))} on disk ({stats['memory_evictions']} + {stats['disk_evictions']} evictions)")
+
+
+if __name__ == "__main__":
+    main()
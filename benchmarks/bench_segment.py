@@ -0,0 +1,70 @@
+"""Segmenting addresses written without spaces with the gazetteer trie tokenizer.
+
+Removes the spaces from generated addresses, segments them back and reports
+throughput and how often the original tokens are recovered exactly, for the
+default component order and for shuffled tokens. The trie pattern is then
+timed against a flat longest-first alternation, with the gazetteer as shipped
+and padded with random entries to the size of a national one.
+
+    python benchmarks/bench_segment.py --addresses 1000000
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator import generate_batches  # noqa: E402
+from tokenizer import GAZETTEER, NUMBER, PREFIXES, compile_tokenizer, segment  # noqa: E402
+
+
+def flat_alternation(words):
+    prefix = "|".join(map(re.escape, sorted(PREFIXES, key=len, reverse=True)))
+    word = "|".join(map(re.escape, sorted(words, key=len, reverse=True)))
+    unknown = rf"(?:(?!{prefix}|{word}|\d)\S)+"
+    return re.compile(rf"(?:{prefix})(?:{word}|{NUMBER}|{unknown})?|{word}|{NUMBER}|{unknown}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--addresses", type=int, default=1_000_000)
+    parser.add_argument("--baseline", type=int, default=5_000, help="addresses timed with the flat alternation")
+    parser.add_argument("--extra-words", type=int, default=7_000, help="random entries added for the larger gazetteer")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    spaced, shuffled = [], []
+    for addresses, _ in generate_batches(args.addresses):
+        spaced.extend(addresses)
+        shuffled.extend(" ".join(rng.permutation(address.split())) for address in addresses)
+
+    for name, texts in (("generated", spaced), ("shuffled", shuffled)):
+        unspaced = [text.replace(" ", "") for text in texts]
+        n_chars = sum(map(len, unspaced))
+        start = time.perf_counter()
+        tokens = [segment(text) for text in unspaced]
+        elapsed = time.perf_counter() - start
+        exact = sum(got == text.split() for got, text in zip(tokens, texts)) / len(texts)
+        print(f"{name:>10}: {len(texts) / elapsed:>10,.0f} strings/s  {n_chars / elapsed / 1e6:5.1f}M chars/s  "
+              f"{exact:6.1%} recovered exactly")
+
+    thai = [chr(c) for c in range(0x0E01, 0x0E2F)]
+    extra = ["".join(rng.choice(thai, size=rng.integers(3, 9))) for _ in range(args.extra_words)]
+    unspaced = [text.replace(" ", "") for text in spaced[:args.baseline]]
+    for words in (GAZETTEER, sorted(set(GAZETTEER + extra))):
+        trie, flat = compile_tokenizer(PREFIXES, words), flat_alternation(words)
+        timings = []
+        for pattern in (trie, flat):
+            start = time.perf_counter()
+            for text in unspaced:
+                pattern.findall(text)
+            timings.append(len(unspaced) / (time.perf_counter() - start))
+        print(f"{len(words):>6,} entries: trie {timings[0]:>10,.0f} strings/s, flat alternation {timings[1]:>10,.0f} strings/s")
+
+
+if __name__ == "__main__":
+    main()
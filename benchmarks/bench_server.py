@@ -0,0 +1,142 @@
+"""Inference server load test: requests/s and p50/p99 latency under concurrent clients.
+
+Starts server.py in its own process once per setting (or targets --url) and has
+--clients threads send single-address requests back to back over keep-alive
+connections for --seconds. By default it compares one predict call per
+request (a 0 ms window, batches of 1) with micro-batching, and reports the
+mean batch size and the server's model time per text from /metrics.
+
+    python benchmarks/bench_server.py --clients 32 --seconds 10
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generator import generate_addresses  # noqa: E402
+from evaluation import DECODERS  # noqa: E402
+from server import DEFAULT_DECODER, DEFAULT_MAX_BATCH, DEFAULT_WINDOW_MS  # noqa: E402
+
+
+def start_server(port, window_ms, max_batch, decoder):
+    # A process of its own, so the clients' threads do not compete with the server for the GIL
+    process = subprocess.Popen([sys.executable, "server.py", "--port", str(port), "--window-ms", str(window_ms),
+                                "--max-batch", str(max_batch), "--decoder", decoder], cwd=ROOT, stdout=subprocess.DEVNULL)
+    for _ in range(600):
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/healthz")
+            connection.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("the server did not come up")
+
+
+def client(host, port, texts, offset, stop, latencies, statuses, confidence):
+    connection = http.client.HTTPConnection(host, port, timeout=60)
+    i = offset
+    while not stop.is_set():
+        body = json.dumps({"text": texts[i % len(texts)], "confidence": confidence})
+        start = time.perf_counter()
+        connection.request("POST", "/parse", body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        statuses.append(response.status)
+        i += 1
+    connection.close()
+
+
+def metrics(host, port):
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    connection.request("GET", "/metrics")
+    values = {}
+    for line in connection.getresponse().read().decode().splitlines():
+        if not line.startswith("#") and "{" not in line:
+            name, value = line.split()
+            values[name.removeprefix("datavis_")] = float(value)
+    connection.close()
+    return values
+
+
+def run_load(host, port, texts, clients, seconds, confidence):
+    stop = threading.Event()
+    per_client = [([], []) for _ in range(clients)]
+    threads = [threading.Thread(target=client, args=(host, port, texts, i * 997, stop, *per_client[i], confidence))
+               for i in range(clients)]
+    before = metrics(host, port)
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    after = metrics(host, port)
+
+    latencies = np.concatenate([np.array(latency) for latency, _ in per_client]) * 1000
+    statuses = np.concatenate([np.array(status) for _, status in per_client])
+    batches = after["batches_total"] - before["batches_total"]
+    texts = after["texts_total"] - before["texts_total"]
+    return {
+        "requests/s": (statuses == 200).sum() / elapsed,
+        "p50 ms": np.percentile(latencies, 50),
+        "p99 ms": np.percentile(latencies, 99),
+        "rejected": int((statuses == 503).sum()),
+        "mean batch": texts / batches if batches else float("nan"),
+        "model us/text": (after["predict_seconds_total"] - before["predict_seconds_total"]) / texts * 1e6 if texts else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--confidence", action="store_true", help="ask for confidences as well")
+    parser.add_argument("--port", type=int, default=8765, help="port for the servers this starts")
+    parser.add_argument("--decoder", choices=list(DECODERS), default=DEFAULT_DECODER, help="decoder of the servers this starts")
+    parser.add_argument("--url", help="load an already running server instead, e.g. http://127.0.0.1:8000")
+    args = parser.parse_args()
+
+    texts, _ = generate_addresses(10_000)
+    if args.url:
+        url = urlparse(args.url)
+        settings = {args.url: (url.hostname, url.port)}
+    else:
+        settings = {"one request per batch": (0.0, 1), f"{DEFAULT_WINDOW_MS:g} ms / {DEFAULT_MAX_BATCH} batches":
+                    (DEFAULT_WINDOW_MS, DEFAULT_MAX_BATCH)}
+
+    for name, setting in settings.items():
+        process = None
+        if args.url:
+            host, port = setting
+        else:
+            host, port = "127.0.0.1", args.port
+            process = start_server(port, *setting, args.decoder)
+        try:
+            result = run_load(host, port, texts, args.clients, args.seconds, args.confidence)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+        print(f"{name}: {args.clients} clients, {result['requests/s']:,.0f} requests/s, "
+              f"p50 {result['p50 ms']:.1f} ms, p99 {result['p99 ms']:.1f} ms, "
+              f"mean batch {result['mean batch']:.1f}, model {result['model us/text']:.0f} us/text, "
+              f"rejected {result['rejected']}")
+
+
+if __name__ == "__main__":
+    main()
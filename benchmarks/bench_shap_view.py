@@ -0,0 +1,74 @@
+"""Render time and payload of the SHAP view: one matplotlib waterfall PNG per
+token (the old page) vs the single Plotly figure.
+
+    python benchmarks/bench_shap_view.py --tokens 16
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from explain import catboost_feature_frame, get_shap_engine, shap_heatmap_figure, shap_token_figure  # noqa: E402
+from generator import generate_addresses  # noqa: E402
+
+
+def render_waterfalls(explanation, predicted):
+    import shap
+
+    payload = 0
+    classes = list(get_shap_engine().classes)
+    for instance_idx, label in enumerate(predicted):
+        fig, ax = plt.subplots()
+        shap.plots.waterfall(explanation[instance_idx, :, classes.index(label)], show=False)
+        # st.pyplot() sends the figure as a PNG
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png")
+        payload += buffer.tell()
+    return payload
+
+
+def render_plotly(values, tokens, feature_df, classes, predicted):
+    heatmap = shap_heatmap_figure(values, tokens, feature_df.columns, classes)
+    drill_down = shap_token_figure(values[0], feature_df.iloc[0], feature_df.columns, classes, predicted[0])
+    # st.plotly_chart() sends the figure JSON
+    return len(heatmap.to_json()) + len(drill_down.to_json())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=16)
+    args = parser.parse_args()
+
+    addresses, _ = generate_addresses(args.tokens, seed=0)
+    tokens = " ".join(addresses).split()[:args.tokens]
+
+    engine = get_shap_engine()
+    feature_df = catboost_feature_frame(tokens, engine.model.feature_names_)
+    predicted = engine.model.predict(feature_df).flatten()
+    explanation = engine.explain(feature_df)
+
+    start = time.perf_counter()
+    png_bytes = render_waterfalls(explanation, predicted)
+    waterfall_seconds = time.perf_counter() - start
+    leaked = len(plt.get_fignums())
+    plt.close("all")
+
+    start = time.perf_counter()
+    json_bytes = render_plotly(explanation.values, tokens, feature_df, engine.classes, predicted)
+    plotly_seconds = time.perf_counter() - start
+
+    print(f"{len(tokens)} tokens")
+    print(f"  matplotlib waterfalls: {waterfall_seconds:.3f}s, {png_bytes / 1024:,.0f} KiB PNG, {leaked} figures left open")
+    print(f"  plotly heatmap:        {plotly_seconds:.3f}s, {json_bytes / 1024:,.0f} KiB JSON")
+
+
+if __name__ == "__main__":
+    main()
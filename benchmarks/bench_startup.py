@@ -0,0 +1,119 @@
+"""Cold start: import-time breakdown of the page's modules and time to first render.
+
+Each measurement runs in a fresh interpreter. The import check fails if
+importing the page's own modules pulls in any of the heavy libraries that
+sections load on demand; the render check fails if the first render of
+visual.py (empty prediction cache, as in a new container) takes longer than
+--budget seconds. Exits with status 1 on either, so it can guard against
+startup regressions in CI.
+
+    python benchmarks/bench_startup.py --budget 8
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# What visual.py imports from the repo at the top of every run
+PAGE_MODULES = [
+    "catboost_tagger", "comparison", "evaluation", "explain", "fonts", "gazetteer", "generator", "ingest",
+    "instrumentation", "jobs", "models", "prediction_cache", "result_store", "robustness", "sample_cache", "sankey",
+    "tokenizer",
+]
+# Loaded by the sections that draw or explain something, never by importing the page.
+# (pyarrow is missing on purpose: pandas imports it whenever it is installed.)
+DEFERRED = ["altair", "catboost", "matplotlib", "plotly", "requests", "scipy", "seaborn", "shap", "sklearn"]
+
+
+def loaded(modules):
+    return [name for name in DEFERRED if name in modules]
+
+
+def import_breakdown(top):
+    code = f"import json, sys; import {', '.join(PAGE_MODULES)}; print(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True,
+                            text=True, check=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Only modules imported directly by the page's modules or by the interpreter, not their children
+        if len(name) - len(name.lstrip()) <= 1:
+            entries.append((int(cumulative) / 1e6, name.strip()))
+    modules = json.loads(result.stdout)
+    return sum(seconds for seconds, _ in entries), sorted(entries, reverse=True)[:top], loaded(modules)
+
+
+def render_child():
+    from prediction_cache import PredictionCache
+    from sample_cache import SampleCache
+    import prediction_cache
+    import sample_cache
+
+    # A new container has no prediction or sample cache yet
+    prediction_cache._cache = PredictionCache(path=os.path.join(tempfile.mkdtemp(), "predictions.sqlite"))
+    sample_cache._cache = SampleCache(directory=tempfile.mkdtemp())
+    from streamlit.testing.v1 import AppTest
+
+    before = set(sys.modules)
+    app = AppTest.from_file(os.path.join(ROOT, "visual.py"), default_timeout=300)
+    start = time.perf_counter()
+    app.run()
+    first = time.perf_counter() - start
+    sections = {name: record["wall_ms"] for name, record in app.session_state["section_timings"].items()}
+    start = time.perf_counter()
+    app.run()
+    second = time.perf_counter() - start
+    print(json.dumps({
+        "first": first,
+        "second": second,
+        "exceptions": [exception.message for exception in app.exception],
+        "sections": sections,
+        "loaded": loaded(set(sys.modules) - before),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, default=8.0, help="seconds allowed for the first render")
+    parser.add_argument("--top", type=int, default=12)
+    parser.add_argument("--render-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.render_child:
+        render_child()
+        return
+
+    failures = []
+    total, entries, heavy = import_breakdown(args.top)
+    print(f"importing the page's modules: {total:.2f}s")
+    for seconds, name in entries:
+        print(f"  {seconds * 1000:8.1f} ms  {name}")
+    if heavy:
+        failures.append(f"importing the page loads {', '.join(heavy)}")
+
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--render-child"], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    render = json.loads(result.stdout.strip().splitlines()[-1])
+    print(f"\nfirst render: {render['first']:.2f}s, second render: {render['second']:.2f}s")
+    for name, ms in sorted(render["sections"].items(), key=lambda item: -item[1]):
+        print(f"  {ms:8.1f} ms  {name}")
+    print(f"loaded by the first render: {', '.join(render['loaded']) or 'none of ' + ', '.join(DEFERRED)}")
+    if render["exceptions"]:
+        failures.append(f"the page raised: {render['exceptions']}")
+    if render["first"] > args.budget:
+        failures.append(f"first render took {render['first']:.2f}s, over the {args.budget:.2f}s budget")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""CRF decoding: python-crfsuite per sequence vs the batched NumPy Viterbi decoder.
+
+Builds a regression corpus of generated addresses plus shuffled and truncated
+variants, checks the NumPy decoder gives exactly the tags `model.predict` does,
+then times both.
+
+    python benchmarks/bench_viterbi.py --addresses 25000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator import generate_addresses  # noqa: E402
+from tagger import parse_many  # noqa: E402
+from viterbi import get_numpy_crf, parse_many_numpy  # noqa: E402
+
+
+def regression_corpus(n, seed=0):
+    texts, _ = generate_addresses(n, seed=seed)
+    rng = np.random.default_rng(seed)
+    shuffled, truncated = [], []
+    for text in texts:
+        tokens = text.split()
+        shuffled.append(" ".join(rng.permutation(tokens)))
+        truncated.append(" ".join(tokens[:rng.integers(1, len(tokens) + 1)]))
+    extra = ["", "ผู้", "10230", "นายวิเชียร ผู้พักอาศัยอยู่ที่ ซ.ทองหล่อ 23 เขตพระโขนง"]
+    return list(texts) + shuffled + truncated + extra
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--addresses", type=int, default=25_000)
+    args = parser.parse_args()
+
+    texts = regression_corpus(args.addresses)
+    n_tokens = sum(len(text.split()) for text in texts)
+
+    start = time.perf_counter()
+    get_numpy_crf()
+    print(f"export: {time.perf_counter() - start:.2f}s")
+
+    expected = parse_many(texts)
+    got = parse_many_numpy(texts)
+    mismatches = sum(a != b for a, b in zip(expected, got))
+    assert mismatches == 0, f"{mismatches} of {len(texts)} sequences differ"
+    print(f"{len(texts):,} sequences tagged identically")
+
+    for name, fn in (("crfsuite", parse_many), ("numpy", parse_many_numpy)):
+        start = time.perf_counter()
+        fn(texts)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10}: {elapsed:6.2f}s  {n_tokens / elapsed:>12,.0f} tokens/s")
+
+
+if __name__ == "__main__":
+    main()
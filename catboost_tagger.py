@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+from models import get_model
+from tagger import TokenBatch
+
+
+# Texts sent to CatBoost in one predict call; its per-call overhead is far larger than the CRF's
+CATBOOST_CHUNK_SIZE = 5_000
+
+# Per-word features, in the model's column order; the same names prefixed by -1/+1 describe the neighbours
+_OWN = ["word.word", "word[:3]", "word.isspace()", "word.is_stopword()", "word.isdigit()", "word.islen5"]
+_NEIGHBOUR = {"word.word": "word", "word.isspace()": "isspace()", "word.is_stopword()": "is_stopword()",
+              "word.isdigit()": "isdigit()"}
+
+# Every column the model was trained on, in its order
+FEATURE_COLUMNS = (
+    ["bias", *_OWN, "BOS"]
+    + [f"+1.word.{'nextword' if own == 'word.word' else name}" for own, name in _NEIGHBOUR.items()]
+    + [f"-1.word.{'prevword' if own == 'word.word' else name}" for own, name in _NEIGHBOUR.items()]
+    + ["EOS"]
+)
+
+
+def catboost_feature_frame_many(token_lists, columns=None):
+    """CatBoost input for many token sequences at once, one row per token.
+
+    Builds the frame column by column from per-word arrays instead of one
+    dict per token, and matches what the model was trained on cell for cell,
+    dtypes included. That includes a quirk of the training code: BOS and EOS
+    were converted with `1 if x else 0`, which maps the NaN of every inner
+    token to 1 as well, so both are 1 on every row and every missing
+    neighbour feature is filled with "EOS", at either end of a sequence.
+    """
+    return batch_feature_frame(TokenBatch(token_lists), columns)
+
+
+def batch_feature_frame(batch, columns=None):
+    """catboost_feature_frame_many() for a TokenBatch whose features were computed already."""
+    # Each column is looked up once per distinct word, then gathered per token
+    own = [features[0] for features in batch.features]
+    vocabulary = {name: np.array([features[name] for features in own], dtype=object if name in ("word.word", "word[:3]") else bool)
+                  for name in _OWN}
+    # Neighbour ids wrap around at the ends of the flat array; those rows are masked anyway
+    prev_ids = np.roll(batch.ids, 1)
+    next_ids = np.roll(batch.ids, -1)
+
+    n_tokens = batch.n_tokens
+    frame = {"bias": np.ones(n_tokens)}
+    for name in _OWN:
+        frame[name] = vocabulary[name][batch.ids]
+    frame["BOS"] = np.ones(n_tokens, dtype=np.int64)
+    for prefix, neighbour_ids, missing in (("+1", next_ids, batch.is_last), ("-1", prev_ids, batch.is_first)):
+        for own_name, name in _NEIGHBOUR.items():
+            if own_name == "word.word":
+                name = "nextword" if prefix == "+1" else "prevword"
+            values = vocabulary[own_name][neighbour_ids].astype(object)
+            frame[f"{prefix}.word.{name}"] = np.where(missing, "EOS", values)
+    frame["EOS"] = np.ones(n_tokens, dtype=np.int64)
+
+    feature_df = pd.DataFrame(frame, columns=FEATURE_COLUMNS)
+    return feature_df if columns is None else feature_df[list(columns)]
+
+
+def catboost_pool(feature_df, model=None):
+    """A Pool over `feature_df` with the model's categorical features declared.
+
+    Build it once and reuse it for predict_proba(), predict() and SHAP values
+    rather than letting each call convert the frame again.
+    """
+    from catboost import Pool
+
+    model = get_model("catboost") if model is None else model
+    return Pool(feature_df, cat_features=model.get_cat_feature_indices())
+
+
+def tag_batch(batch, model=None):
+    """CatBoost tags of every sequence of a TokenBatch, in one predict call."""
+    model = get_model("catboost") if model is None else model
+    if not batch.n_tokens:
+        return [[] for _ in batch.token_lists]
+    tags = model.predict(catboost_pool(batch_feature_frame(batch, model.feature_names_), model)).ravel().tolist()
+    offsets = np.cumsum(batch.lengths) - batch.lengths
+    return [tags[start:start + length] for start, length in zip(offsets.tolist(), batch.lengths.tolist())]
+
+
+def parse_many_catboost(texts, chunk_size=CATBOOST_CHUNK_SIZE):
+    """parse_many() on the CatBoost token classifier, `chunk_size` texts per predict call."""
+    model = get_model("catboost")
+    predicted_tags_list = []
+    for start in range(0, len(texts), chunk_size):
+        predicted_tags_list.extend(tag_batch(TokenBatch.from_texts(texts[start:start + chunk_size]), model))
+    return predicted_tags_list
@@ -0,0 +1,197 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from catboost_tagger import tag_batch
+from evaluation import TAGS, ConfusionAccumulator, generated_batches, labelled_file_batches
+from generator import DEFAULT_BATCH_SIZE
+from instrumentation import span
+from models import get_model
+from sankey import PAD, encode_tag_codes
+from tagger import TokenBatch, tag_sequences
+from viterbi import get_numpy_crf
+
+
+MODELS = ("CRF", "CatBoost")
+# Stage that builds the token features both models read
+FEATURES = "features (shared)"
+# Addresses kept per disagreement, to show what the models argue about
+MAX_EXAMPLES = 3
+LATENCY_PERCENTILES = (50, 95, 99)
+
+# The CRF can decode a shared batch either way; both give identical tags
+CRF_DECODERS = {
+    "crfsuite": lambda batch: tag_sequences(batch.sequence_features()),
+    "numpy": lambda batch: get_numpy_crf().decode_batch(batch),
+}
+
+
+class ComparisonAccumulator:
+    """Per-token counts of (true tag, CRF tag, CatBoost tag), plus the time each stage took per chunk.
+
+    Both confusion matrices and the disagreement table are marginals of the
+    one (tags, tags, tags) count array, so they always describe the same tokens.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros((len(TAGS),) * 3, dtype=np.int64)
+        self.latencies = {stage: [] for stage in (FEATURES, *MODELS)}
+        self.n_addresses = 0
+        self.examples = {}
+
+    def add(self, addresses, lengths, truth, crf, catboost):
+        """Fold in one chunk: its addresses, their token counts, and flat TAGS codes of labels and both models' tags."""
+        # Like ConfusionAccumulator, tokens with a tag outside TAGS are skipped
+        known = (truth != PAD) & (crf != PAD) & (catboost != PAD)
+        flat = (truth[known].astype(np.int64) * len(TAGS) + crf[known]) * len(TAGS) + catboost[known]
+        self.counts += np.bincount(flat, minlength=len(TAGS) ** 3).reshape(self.counts.shape)
+
+        # A few addresses per disagreeing pair, looked up per pair rather than per token
+        pairs = crf.astype(np.int64) * len(TAGS) + catboost
+        disagree = known & (crf != catboost)
+        token_address = np.repeat(np.arange(len(addresses)), lengths)
+        for pair in np.unique(pairs[disagree]).tolist():
+            examples = self.examples.setdefault(divmod(pair, len(TAGS)), [])
+            if len(examples) >= MAX_EXAMPLES:
+                continue
+            rows, first = np.unique(token_address[disagree & (pairs == pair)], return_index=True)
+            for row in rows[np.argsort(first)][:MAX_EXAMPLES].tolist():
+                if len(examples) < MAX_EXAMPLES and addresses[row] not in examples:
+                    examples.append(addresses[row])
+        self.n_addresses += len(addresses)
+        return self
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def confusion(self, model):
+        """The model's ConfusionAccumulator over the compared tokens."""
+        return ConfusionAccumulator(self.counts.sum(axis=2 if model == "CRF" else 1))
+
+    def accuracy(self, model):
+        counts = self.confusion(model).counts
+        return np.trace(counts) / counts.sum() if counts.sum() else float("nan")
+
+    @property
+    def agreement(self):
+        agreed = np.einsum("tcc->", self.counts)
+        return agreed / self.total if self.total else float("nan")
+
+    def speed_frame(self):
+        """Time, throughput and per-chunk latency percentiles of the shared feature pass and of each model.
+
+        A model's end-to-end throughput also pays for the feature pass, which
+        serving it alone would have to do as well.
+        """
+        feature_seconds = sum(self.latencies[FEATURES])
+        rows = {}
+        for stage, latencies in self.latencies.items():
+            seconds = sum(latencies)
+            row = {
+                "seconds": seconds,
+                "tokens/s": self.total / seconds if seconds else float("nan"),
+                "addresses/s (end to end)": float("nan"),
+                "accuracy": float("nan"),
+            }
+            for percentile in LATENCY_PERCENTILES:
+                row[f"p{percentile} ms/chunk"] = np.percentile(latencies, percentile) * 1000 if latencies else float("nan")
+            if stage in MODELS:
+                row["addresses/s (end to end)"] = self.n_addresses / (seconds + feature_seconds) if seconds else float("nan")
+                row["accuracy"] = self.accuracy(stage)
+            rows[stage] = row
+        return pd.DataFrame.from_dict(rows, orient="index")
+
+    def disagreement_frame(self):
+        """One row per (CRF tag, CatBoost tag) pair the models disagree on, most frequent first."""
+        rows = []
+        for crf, catboost in zip(*np.nonzero(~np.eye(len(TAGS), dtype=bool))):
+            by_truth = self.counts[:, crf, catboost]
+            if not by_truth.sum():
+                continue
+            rows.append({
+                "CRF": TAGS[crf],
+                "CatBoost": TAGS[catboost],
+                "tokens": int(by_truth.sum()),
+                "CRF right": int(by_truth[crf]),
+                "CatBoost right": int(by_truth[catboost]),
+                "neither right": int(by_truth.sum() - by_truth[crf] - by_truth[catboost]),
+                "examples": " | ".join(self.examples.get((crf, catboost), [])),
+            })
+        columns = ["CRF", "CatBoost", "tokens", "CRF right", "CatBoost right", "neither right", "examples"]
+        return pd.DataFrame(rows, columns=columns).sort_values("tokens", ascending=False, ignore_index=True)
+
+
+def store_batches(store, batch_size=DEFAULT_BATCH_SIZE):
+    """(addresses, flat label codes) chunks of a labelled ResultStore."""
+    addresses = store.addresses()
+    for start in range(0, len(store), batch_size):
+        stop = min(start + batch_size, len(store))
+        yield addresses[start:stop], store.labels[store.token_offsets[start]:store.token_offsets[stop]]
+
+
+def _timed(accumulator, stage, compute):
+    start = time.perf_counter()
+    with span(f"compare: {stage}"):
+        result = compute()
+    accumulator.latencies[stage].append(time.perf_counter() - start)
+    return result
+
+
+def compare_models(batches, crf_decoder="numpy", on_batch=None):
+    """Tag every (addresses, labels) chunk with both models from one shared feature pass.
+
+    `labels` are per-address tag lists or flat TAGS codes aligned with the
+    whitespace tokens. Each chunk is split and featurized once into a
+    TokenBatch, which the CRF and CatBoost both read, so the models are timed
+    on their own work plus one common feature stage. `on_batch(accumulator,
+    n_addresses)` is called after every chunk and may return True to stop early.
+    """
+    catboost = get_model("catboost")
+    if crf_decoder == "numpy":
+        get_numpy_crf()
+    else:
+        get_model("crf")
+
+    accumulator = ComparisonAccumulator()
+    for addresses, labels in batches:
+        batch = _timed(accumulator, FEATURES, lambda: TokenBatch.from_texts(addresses))
+        crf_tags = _timed(accumulator, "CRF", lambda: CRF_DECODERS[crf_decoder](batch))
+        catboost_tags = _timed(accumulator, "CatBoost", lambda: tag_batch(batch, catboost))
+
+        truth = labels if isinstance(labels, np.ndarray) else encode_tag_codes(labels, TAGS)
+        if len(truth) != batch.n_tokens:
+            raise ValueError(f"{len(truth)} labels for {batch.n_tokens} tokens")
+        accumulator.add(addresses, batch.lengths, truth, encode_tag_codes(crf_tags, TAGS), encode_tag_codes(catboost_tags, TAGS))
+        if on_batch is not None and on_batch(accumulator, accumulator.n_addresses):
+            break
+    return accumulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the CRF and the CatBoost tagger on the same addresses.")
+    parser.add_argument("-n", "--samples", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--decoder", choices=list(CRF_DECODERS), default="numpy", help="how the CRF decodes")
+    parser.add_argument("--file", help="CSV with 'Address' and space separated 'Labels' columns instead of generated addresses")
+    args = parser.parse_args()
+
+    if args.file:
+        batches = labelled_file_batches(args.file, args.batch_size)
+    else:
+        batches = generated_batches(args.samples, seed=args.seed, batch_size=args.batch_size)
+    accumulator = compare_models(batches, args.decoder)
+    for model in MODELS:
+        print(f"\n{model}")
+        print(accumulator.confusion(model).to_frame())
+    print()
+    print(accumulator.speed_frame().to_string(float_format="{:,.3f}".format))
+    print(f"\nThe models agree on {accumulator.agreement:.3f} of {accumulator.total:,} tokens")
+    print(accumulator.disagreement_frame().drop(columns="examples").to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from generator import DEFAULT_BATCH_SIZE, DEFAULT_CONFIG, generate_batch, generate_batches, n_batches
+from models import get_model
+from tagger import parse_many
+from viterbi import get_numpy_crf, parse_many_numpy
+
+
+# Row/column order of every confusion matrix on the page
+TAGS = ['O', 'LOC', 'POST', 'ADDR']
+TAG_INDEX = {tag: i for i, tag in enumerate(TAGS)}
+
+# Interchangeable batch taggers; both give identical tags
+DECODERS = {
+    "crfsuite": parse_many,
+    "numpy": parse_many_numpy,
+}
+
+
+class ConfusionAccumulator:
+    """Fixed-size confusion matrix that addresses can be added to chunk by chunk."""
+
+    def __init__(self, counts=None):
+        self.counts = np.zeros((len(TAGS), len(TAGS)), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+
+    def add(self, label_list, predicted_tags_list):
+        true_idx = []
+        pred_idx = []
+        for labels, predictions in zip(label_list, predicted_tags_list):
+            true_idx.extend(TAG_INDEX.get(tag, -1) for tag in labels)
+            pred_idx.extend(TAG_INDEX.get(tag, -1) for tag in predictions)
+        return self.add_codes(true_idx, pred_idx)
+
+    def add_codes(self, true_idx, pred_idx):
+        """add() for tags already encoded as indices into TAGS, flattened over all sequences."""
+        true_idx = np.asarray(true_idx, dtype=np.int64)
+        pred_idx = np.asarray(pred_idx, dtype=np.int64)
+
+        # Like sklearn's confusion_matrix(labels=...), tags outside TAGS are skipped
+        known = (true_idx >= 0) & (true_idx < len(TAGS)) & (pred_idx >= 0) & (pred_idx < len(TAGS))
+        flat = true_idx[known] * len(TAGS) + pred_idx[known]
+        self.counts += np.bincount(flat, minlength=len(TAGS) ** 2).reshape(len(TAGS), len(TAGS))
+        return self
+
+    def merge(self, other):
+        self.counts += other.counts
+        return self
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def to_frame(self):
+        return pd.DataFrame(self.counts, index=TAGS, columns=TAGS)
+
+
+def evaluate_batches(batches, on_batch=None, decoder="crfsuite"):
+    """Tag (addresses, label_list) batches and fold them into one ConfusionAccumulator.
+
+    Only the accumulator outlives each batch, so memory does not grow with the
+    number of addresses. `on_batch(accumulator, n_addresses)` is called after
+    every batch and may return True to stop early.
+    """
+    parse = DECODERS[decoder]
+    accumulator = ConfusionAccumulator()
+    n_addresses = 0
+    for addresses, label_list in batches:
+        accumulator.add(label_list, parse(addresses))
+        n_addresses += len(addresses)
+        if on_batch is not None and on_batch(accumulator, n_addresses):
+            break
+    return accumulator
+
+
+def generated_batches(n, config=DEFAULT_CONFIG, seed=0, batch_size=DEFAULT_BATCH_SIZE):
+    for addresses, labels in generate_batches(n, config, seed, batch_size):
+        yield addresses, [labels] * len(addresses)
+
+
+def labelled_file_batches(file, batch_size=DEFAULT_BATCH_SIZE):
+    """Read a CSV with 'Address' and space separated 'Labels' columns in chunks."""
+    for chunk in pd.read_csv(file, usecols=["Address", "Labels"], dtype=str, chunksize=batch_size):
+        chunk = chunk.fillna("")
+        yield chunk["Address"].tolist(), [labels.split() for labels in chunk["Labels"]]
+
+
+def _init_worker(decoder):
+    # Load the CRF once per worker process rather than once per shard
+    if decoder == "numpy":
+        get_numpy_crf()
+    else:
+        get_model("crf")
+
+
+def _evaluate_shard(batch_index, n, config, seed, batch_size, decoder):
+    addresses, labels = generate_batch(batch_index, n, config, seed, batch_size)
+    counts = ConfusionAccumulator().add([labels] * len(addresses), DECODERS[decoder](addresses)).counts
+    return counts, len(addresses)
+
+
+def evaluate_parallel(n, config=DEFAULT_CONFIG, seed=0, batch_size=DEFAULT_BATCH_SIZE, workers=None, on_batch=None,
+                      decoder="crfsuite"):
+    """Evaluate `n` generated addresses with shards spread over a process pool.
+
+    Shard i is generator batch i with its own (seed, i) seed, so the merged
+    matrix is identical to evaluate_batches(generated_batches(...)) in one
+    process, whatever the number of workers.
+    """
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        return evaluate_batches(generated_batches(n, config, seed, batch_size), on_batch, decoder)
+
+    accumulator = ConfusionAccumulator()
+    n_addresses = 0
+    # spawn rather than fork: the Streamlit server that may call this is multi-threaded
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(decoder,)) as executor:
+        # Keep a couple of shards queued per worker instead of submitting all of them up front
+        shards = iter(range(n_batches(n, batch_size)))
+        pending = set()
+        stopped = False
+        while True:
+            while not stopped and len(pending) < 2 * workers:
+                batch_index = next(shards, None)
+                if batch_index is None:
+                    break
+                pending.add(executor.submit(_evaluate_shard, batch_index, n, config, seed, batch_size, decoder))
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                counts, size = future.result()
+                accumulator.merge(ConfusionAccumulator(counts))
+                n_addresses += size
+                if on_batch is not None and on_batch(accumulator, n_addresses):
+                    stopped = True
+            if stopped:
+                for future in pending:
+                    future.cancel()
+                break
+    return accumulator
+
+
+def scaling_report(n, worker_counts, config=DEFAULT_CONFIG, seed=0, batch_size=DEFAULT_BATCH_SIZE, decoder="crfsuite"):
+    """Throughput of evaluate_parallel() for each worker count, checked against the first run."""
+    rows = []
+    reference = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        accumulator = evaluate_parallel(n, config, seed, batch_size, workers, decoder=decoder)
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = accumulator.counts
+        rows.append({
+            "workers": workers,
+            "seconds": elapsed,
+            "addresses/s": n / elapsed,
+            "tokens/s": accumulator.total / elapsed,
+            "matches": bool((accumulator.counts == reference).all()),
+        })
+    report = pd.DataFrame(rows)
+    report["speedup"] = report["seconds"].iloc[0] / report["seconds"]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the CRF tagger on generated addresses.")
+    parser.add_argument("-n", "--samples", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--decoder", choices=list(DECODERS), default="crfsuite")
+    parser.add_argument("--scaling", type=int, nargs="+", metavar="WORKERS",
+                        help="report throughput for each of these worker counts instead")
+    args = parser.parse_args()
+
+    if args.scaling:
+        report = scaling_report(args.samples, args.scaling, seed=args.seed, batch_size=args.batch_size, decoder=args.decoder)
+        print(report.to_string(index=False))
+        return
+
+    start = time.perf_counter()
+    accumulator = evaluate_parallel(args.samples, seed=args.seed, batch_size=args.batch_size, workers=args.workers,
+                                    decoder=args.decoder)
+    elapsed = time.perf_counter() - start
+    print(accumulator.to_frame())
+    print(f"{args.samples:,} addresses, {accumulator.total:,} tokens in {elapsed:.1f}s "
+          f"({args.samples / elapsed:,.0f} addresses/s) on {args.workers} workers")
+
+
+if __name__ == "__main__":
+    main()
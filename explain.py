@@ -0,0 +1,154 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from catboost_tagger import catboost_feature_frame_many, catboost_pool
+from instrumentation import span
+from models import get_model
+
+
+# Distinct feature rows whose SHAP values are kept per model
+SHAP_CACHE_SIZE = 100_000
+
+
+@span("CatBoost features")
+def catboost_feature_frame(tokens, columns=None):
+    """CatBoost input for one token sequence, built the way the model was trained.
+
+    Pass the model's feature names as `columns` so that short texts, which
+    lack some neighbour features entirely, still get every column.
+    """
+    feature_df = catboost_feature_frame_many([tokens], columns)
+    if columns is None and len(tokens) == 1:
+        # A lone token has no neighbours, so the training code never produced their columns
+        feature_df = feature_df.drop(columns=[col for col in feature_df.columns if col[:3] in ("+1.", "-1.")])
+    return feature_df
+
+
+class ShapEngine:
+    """SHAP values of a CatBoost classifier, computed natively in batches and cached per feature row."""
+
+    def __init__(self, model, cache_size=SHAP_CACHE_SIZE):
+        self.model = model
+        self.classes = list(model.classes_)
+        self.cache_size = cache_size
+        self.base_values = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @span("SHAP values")
+    def _compute(self, feature_df):
+        pool = catboost_pool(feature_df, self.model)
+        # (rows, classes, features + 1); the last column is each class's expected value
+        raw = self.model.get_feature_importance(pool, type="ShapValues")
+        self.base_values = raw[0, :, -1]
+        return raw[:, :, :-1].transpose(0, 2, 1)
+
+    def shap_values(self, feature_df):
+        """SHAP values for every row and class, shaped (rows, features, classes)."""
+        # Rows only share cached values when they come from the same columns
+        columns = tuple(feature_df.columns)
+        keys = [(columns, row) for row in feature_df.itertuples(index=False, name=None)]
+        values = np.empty((len(keys), feature_df.shape[1], len(self.classes)))
+
+        with self._lock:
+            missing = {}
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    values[i] = self._cache[key]
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing:
+                # One native call for every distinct uncached row and all classes
+                first = [positions[0] for positions in missing.values()]
+                computed = self._compute(feature_df.iloc[first])
+                for (key, positions), row_values in zip(missing.items(), computed):
+                    values[positions] = row_values
+                    self._cache[key] = row_values
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return values
+
+    def explain(self, feature_df):
+        """A shap.Explanation over all rows and classes, as shap.Explainer(model)(feature_df) returns."""
+        import shap
+
+        values = self.shap_values(feature_df)
+        return shap.Explanation(
+            values=values,
+            base_values=np.tile(self.base_values, (len(feature_df), 1)),
+            data=feature_df.values,
+            feature_names=list(feature_df.columns),
+        )
+
+
+@span("SHAP heatmap")
+def shap_heatmap_figure(values, tokens, feature_names, classes):
+    """One heatmap per class of the (tokens, features) SHAP values, sharing the token axis.
+
+    Tokens are plotted at their integer position so a clicked cell maps
+    straight back to the token index.
+    """
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    fig = make_subplots(rows=1, cols=len(classes), shared_yaxes=True, subplot_titles=list(classes),
+                        horizontal_spacing=0.02)
+    positions = list(range(len(tokens)))
+    for class_idx, class_name in enumerate(classes):
+        fig.add_trace(
+            go.Heatmap(
+                z=values[:, :, class_idx],
+                x=list(feature_names),
+                y=positions,
+                customdata=np.broadcast_to(np.asarray(tokens, dtype=object)[:, None], values.shape[:2]),
+                coloraxis="coloraxis",
+                name=class_name,
+                hovertemplate="Token: %{customdata}<br>Feature: %{x}<br>SHAP: %{z:.3f}<extra>" + class_name + "</extra>",
+            ),
+            row=1,
+            col=class_idx + 1,
+        )
+    fig.update_yaxes(tickmode="array", tickvals=positions, ticktext=list(tokens), autorange="reversed")
+    fig.update_xaxes(tickangle=-60)
+    fig.update_layout(
+        coloraxis=dict(colorscale="RdBu_r", cmid=0, colorbar=dict(title="SHAP")),
+        height=250 + 28 * len(tokens),
+        margin=dict(t=40, b=10),
+    )
+    return fig
+
+
+@span("SHAP token waterfall")
+def shap_token_figure(values, data, feature_names, classes, predicted_class):
+    """Per-feature SHAP values of one token for every class, the predicted class drawn solid."""
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+    labels = [f"{name} = {value}" for name, value in zip(feature_names, data)]
+    for class_idx, class_name in enumerate(classes):
+        fig.add_trace(go.Bar(
+            x=values[:, class_idx],
+            y=labels,
+            orientation="h",
+            name=class_name,
+            opacity=1.0 if class_name == predicted_class else 0.35,
+        ))
+    fig.update_layout(barmode="group", height=200 + 40 * len(labels),
+                      yaxis=dict(autorange="reversed"), xaxis_title="SHAP value")
+    return fig
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_shap_engine(name="catboost"):
+    """The process-wide ShapEngine for a registered model, built on first use."""
+    with _engines_lock:
+        if name not in _engines:
+            _engines[name] = ShapEngine(get_model(name))
+    return _engines[name]
@@ -0,0 +1,30 @@
+import os
+import threading
+
+from paths import BASE_DIR
+
+
+THAI_FONT_PATH = os.path.join(BASE_DIR, "thsarabunnew-webfont.ttf")
+THAI_FONT_FAMILY = "TH Sarabun New"
+
+_registered = False
+_lock = threading.Lock()
+
+
+def use_thai_font():
+    """Register the Thai font with Matplotlib and make it the default, once per process.
+
+    Streamlit re-executes the page on every rerun, so this lives outside it;
+    Matplotlib itself is only imported by the first chart that needs it.
+    """
+    global _registered
+    if _registered:
+        return
+    with _lock:
+        if not _registered:
+            import matplotlib
+            from matplotlib import font_manager
+
+            font_manager.fontManager.addfont(THAI_FONT_PATH)
+            matplotlib.rc("font", family=THAI_FONT_FAMILY)
+            _registered = True
@@ -0,0 +1,136 @@
+import threading
+from itertools import chain
+
+import numpy as np
+
+from generator import (
+    FORMAT_OPTIONS,
+    district_variants,
+    districts,
+    first_names,
+    postal_codes,
+    province_variants,
+    provinces,
+    road_variants,
+    soi_variants,
+    subdistrict_variants,
+    subdistricts,
+    tag_labels,
+    village_variants,
+)
+
+
+# Gazetteer categories are the generator's components; each gets one bit of a uint8 mask.
+# Roads, sois, villages and names are indexed too so that values shared with a
+# location (ลาดพร้าว is a road, a district and a subdistrict) count as ambiguous.
+CATEGORY_VALUES = {
+    "Name": first_names,
+    "Village": village_variants,
+    "Soi": soi_variants,
+    "Road": road_variants,
+    "Subdistrict": subdistricts + subdistrict_variants,
+    "District": districts + district_variants,
+    "Province": provinces + province_variants,
+    "PostalCode": postal_codes,
+}
+CATEGORIES = list(CATEGORY_VALUES)
+
+# Distinct tokens whose lookups are kept around
+LOOKUP_CACHE_SIZE = 100_000
+
+
+class _Memo(dict):
+    # Hits stay inside dict.__getitem__; only misses call back into Python
+    def __init__(self, compute):
+        super().__init__()
+        self.compute = compute
+
+    def __missing__(self, key):
+        if len(self) >= LOOKUP_CACHE_SIZE:
+            self.clear()
+        value = self[key] = self.compute(key)
+        return value
+
+
+class GazetteerIndex:
+    """Hash index from address tokens to the gazetteers they appear in.
+
+    A token matches either as a whole ("10230", "ลาดพร้าว") or as a component
+    prefix followed by a value ("ต.บางกะปิ"), in which case only the prefix's
+    own component counts. Whitespace tokens are whole words, so a hash lookup
+    per token is all that is needed; segmenting unspaced text is the tokenizer's job.
+    """
+
+    def __init__(self, category_values=CATEGORY_VALUES, format_options=FORMAT_OPTIONS):
+        self.categories = list(category_values)
+        self.bits = {category: 1 << i for i, category in enumerate(self.categories)}
+        self._masks = {}
+        for category, values in category_values.items():
+            for value in values:
+                self._masks[value] = self._masks.get(value, 0) | self.bits[category]
+        self._prefixes = {
+            prefix: component
+            for component, options in format_options.items()
+            if component in self.bits
+            for prefix in options
+            if prefix != "No prefix"
+        }
+        self._prefix_lengths = sorted({len(prefix) for prefix in self._prefixes}, reverse=True)
+        self._masks_of = _Memo(self._compute_mask)
+        self._tags_of = _Memo(self._compute_tag)
+
+    def _compute_mask(self, token):
+        mask = self._masks.get(token, 0)
+        if not mask:
+            for length in self._prefix_lengths:
+                component = self._prefixes.get(token[:length])
+                if component is not None:
+                    mask = self._masks.get(token[length:], 0) & self.bits[component]
+                    break
+        return mask
+
+    def _compute_tag(self, token):
+        # Correct only when every category the token belongs to carries the same tag
+        mask = self._masks_of[token]
+        tags = {tag_labels[category] for category in self.categories if mask & self.bits[category]}
+        return tags.pop() if len(tags) == 1 else None
+
+    def mask(self, token):
+        """Bitmask of the categories `token` belongs to; 0 when it is in no gazetteer."""
+        return self._masks_of[token]
+
+    def matches(self, token):
+        mask = self._masks_of[token]
+        return [category for category in self.categories if mask & self.bits[category]]
+
+    def annotate(self, token_lists):
+        """Category masks for every token of every sequence, as one uint8 array per sequence."""
+        lengths = [len(tokens) for tokens in token_lists]
+        masks = np.fromiter(map(self._masks_of.__getitem__, chain.from_iterable(token_lists)),
+                            dtype=np.uint8, count=sum(lengths))
+        return np.split(masks, np.cumsum(lengths)[:-1]) if token_lists else []
+
+    def correct(self, tokens, tags):
+        """`tags` with every unambiguous gazetteer hit replaced by its component's tag.
+
+        A 5-digit known postal code becomes POST, "ต.บางกะปิ" becomes LOC and
+        "ถ.สาทร" ADDR; "ลาดพร้าว" alone is left to the model.
+        """
+        fixes = map(self._tags_of.__getitem__, tokens)
+        return [tag if fixed is None else fixed for tag, fixed in zip(tags, fixes)]
+
+    def correct_many(self, token_lists, tags_list):
+        return [self.correct(tokens, tags) for tokens, tags in zip(token_lists, tags_list)]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_gazetteer_index():
+    """The process-wide GazetteerIndex, built on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = GazetteerIndex()
+    return _index
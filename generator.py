@@ -0,0 +1,195 @@
+import numpy as np
+
+
+# Sample Thai names and surnames
+first_names = ["สมชาย", "วิชัย", "สมศักดิ์", "กิตติ", "อัศวิน", "ประสิทธิ์", "สุริยะ", "ชัยวัฒน์", "วัฒนา", "เอกชัย", "พัฒน์พงศ์", "สุพจน์", "วิเชียร", "อรุณ", "กำธร"]
+last_names = ["มีสุข", "สวัสดี", "สุขใจ", "ใจดี", "ใจบุญ", "กิตติกูล", "ชนะพงศ์", "สุวรรณ", "คงเจริญ", "เพิ่มพูน", "เจริญสุข", "ชัยรัตน์", "ทรงชัย", "สุทธิชัย", "รุ่งเรือง"]
+
+# Sample Thai locations
+districts = ["สามย่าน", "ลาดพร้าว", "บางนา", "บางเขน", "ห้วยขวาง", "บางกะปิ", "ดอนเมือง", "บางบัวทอง", "บางพลี", "พระโขนง", "พญาไท", "บางกอกน้อย", "บางกอกใหญ่", "ปทุมวัน", "สาทร"]
+subdistricts = ["ทุ่งมหาเมฆ", "สวนหลวง", "ลาดยาว", "สีกัน", "บางรัก", "ปากเกร็ด", "บางมด", "ลาดพร้าว", "ศาลายา", "บางกะปิ", "คลองตัน", "พระโขนง", "ลาดพร้าว", "บางนา", "บางซื่อ"]
+provinces = ["กรุงเทพฯ", "กทม", "กรุงเทพมหานคร", "นนทบุรี", "ปทุมธานี", "สมุทรปราการ", "นครปฐม", "ชลบุรี", "อยุธยา", "สระบุรี", "ราชบุรี", "อ่างทอง"]
+postal_codes = ["10100", "10240", "10120", "10230", "10310", "10150", "10210", "11120", "10270", "10540"]
+
+village_variants = [ "รักนิยม","ปิยะ","เพชรเกษม","ท่าช้าง","สวนลุม",
+                    "นครทอง","อรุณสวัสดิ์","อัมพร","คลองสี่", "บางแค"]
+
+soi_variants = ["สาทร11", "รามคำแหง24","สุขุมวิท39","อ่อนนุช18","พัฒนาการ20","นวลจันทร์","ทองหล่อ23"]
+
+road_variants = ["สาทร", "สุขุมวิท", "รามคำแหง", "พัฒนาการ", "วิภาวดีรังสิต","อ่อนนุช", 
+                 "ทองหล่อ", "พระราม9", "ลาดพร้าว"]
+
+subdistrict_variants = ["ทุ่งมหาเมฆ", "สวนหลวง", "ลาดยาว", "สีกัน", "บางรัก", "ปากเกร็ด", 
+                        "บางมด", "ลาดพร้าว", "ศาลายา", "บางกะปิ", "คลองตัน", "พระโขนง", 
+                        "ลาดพร้าว", "บางนา", "บางซื่อ"]
+
+district_variants = ["สามย่าน", "ลาดพร้าว", "บางนา", "บางเขน", "ห้วยขวาง", "บางกะปิ", "ดอนเมือง", 
+                     "บางบัวทอง", "บางพลี", "พระโขนง", "พญาไท", "บางกอกน้อย", "บางกอกใหญ่", "ปทุมวัน", "สาทร"]
+
+province_variants = ["ราชบุรี","กรุงเทพ","กรุงเทพมหานคร"]
+
+COMPONENTS = ["Name", "HouseNumber", "Village", "Soi", "Road", "Subdistrict", "District", "Province", "PostalCode"]
+
+# Options offered by the format multiselects, per component
+FORMAT_OPTIONS = {
+    "Name": ["นาย", "นาง", "นางสาว", "No prefix"],
+    "HouseNumber": ["123", "123/45", "123หมู่1"],
+    "Village": ["หมู่บ้าน", "ม.", "No prefix"],
+    "Soi": ["ซอย", "ซ.", "No prefix"],
+    "Road": ["ถนน", "ถ.", "No prefix"],
+    "Subdistrict": ["ตำบล", "ต.", "แขวง"],
+    "District": ["อำเภอ", "อ.", "เขต"],
+    "Province": ["จังหวัด", "จ.", "No prefix"],
+}
+
+# Values that follow the prefix for each prefixed component
+COMPONENT_VALUES = {
+    "Name": first_names,
+    "Village": village_variants,
+    "Soi": soi_variants,
+    "Road": road_variants,
+    "Subdistrict": subdistrict_variants,
+    "District": district_variants,
+    "Province": province_variants,
+}
+
+# Define tag labels
+tag_labels = {
+    "Name": "O",
+    "HouseNumber": "ADDR",
+    "Village": "ADDR",
+    "Soi": "ADDR",
+    "Road": "ADDR",
+    "Subdistrict": "LOC",
+    "District": "LOC",
+    "Province": "LOC",
+    "PostalCode": "POST"
+}
+
+DEFAULT_CONFIG = {
+    "components_order": list(COMPONENTS),
+    "component_visibility": {component: True for component in COMPONENTS},
+    "formats": {component: list(options) for component, options in FORMAT_OPTIONS.items()},
+}
+
+# Addresses drawn per batch by generate_batches()
+DEFAULT_BATCH_SIZE = 10_000
+
+
+def visible_components(config):
+    return [
+        component
+        for component in config["components_order"]
+        if config["component_visibility"].get(component, False)
+    ]
+
+
+# What an empty format selection means; drawing from these gives the same addresses
+_EMPTY_FORMATS = {component: ["No prefix"] for component in FORMAT_OPTIONS}
+_EMPTY_FORMATS["HouseNumber"] = ["123หมู่1"]
+
+
+def normalize_config(config):
+    """The parts of `config` that decide what generate_bulk() draws, in one canonical form.
+
+    Hidden components and their formats are dropped, each visible
+    component's formats are put in FORMAT_OPTIONS order without duplicates,
+    and an empty selection is spelled out. Configs that normalize to the
+    same thing generate the same addresses from the same seed, so the
+    normal form is what sample caches are keyed on.
+    """
+    components = visible_components(config)
+    formats = {}
+    for component in components:
+        if component not in FORMAT_OPTIONS:
+            continue
+        selected = list(dict.fromkeys(config["formats"].get(component, [])))
+        known = FORMAT_OPTIONS[component]
+        ordered = [fmt for fmt in known if fmt in selected] + sorted(fmt for fmt in selected if fmt not in known)
+        formats[component] = ordered or list(_EMPTY_FORMATS[component])
+    return {
+        "components_order": components,
+        "component_visibility": {component: True for component in components},
+        "formats": formats,
+    }
+
+
+def _choose(rng, options, n):
+    # Object arrays index into the existing Python strings instead of copying them
+    return np.asarray(options, dtype=object)[rng.integers(len(options), size=n)]
+
+
+def _prefixed(rng, formats, values, n):
+    # An empty selection and "No prefix" both mean no prefix at all
+    prefixes = ["" if fmt == "No prefix" else fmt for fmt in formats] or [""]
+    # Drawing from the prefix x value product is the same as drawing each independently
+    return _choose(rng, [prefix + value for prefix in prefixes for value in values], n)
+
+
+_NUMBERS = np.asarray([str(i) for i in range(1000)], dtype=object)
+
+
+def _house_numbers(rng, formats, n):
+    number = _NUMBERS[rng.integers(1, 1000, size=n)]
+    with_slash = number + "/" + _NUMBERS[rng.integers(1, 100, size=n)]
+    with_moo = number + "หมู่" + _NUMBERS[rng.integers(1, 21, size=n)]
+
+    # Anything other than "123" and "123/45" (including no selection) falls back to "123หมู่1"
+    kinds = [{"123": 0, "123/45": 1}.get(fmt, 2) for fmt in formats] or [2]
+    kind = np.asarray(kinds)[rng.integers(len(kinds), size=n)]
+    return np.choose(kind, [number, with_slash, with_moo])
+
+
+def generate_bulk(n, config=DEFAULT_CONFIG, rng=None):
+    """Generate `n` addresses column-wise.
+
+    Returns the address strings and, since every address shares the same
+    visible components, a single list of labels for one address.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    # The order formats were picked in must not change the addresses
+    config = normalize_config(config)
+    components = visible_components(config)
+    formats = config["formats"]
+
+    columns = []
+    for component in components:
+        if component == "HouseNumber":
+            columns.append(_house_numbers(rng, formats["HouseNumber"], n))
+        elif component == "PostalCode":
+            columns.append(_choose(rng, postal_codes, n))
+        else:
+            columns.append(_prefixed(rng, formats[component], COMPONENT_VALUES[component], n))
+
+    addresses = [" ".join(parts) for parts in zip(*columns)] if columns else [""] * n
+    return addresses, [tag_labels[component] for component in components]
+
+
+def generate_batches(n, config=DEFAULT_CONFIG, seed=0, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield (addresses, labels) for `n` addresses, `batch_size` at a time.
+
+    Batch i is always drawn from the generator seeded with (seed, i), so the
+    output does not depend on how the batches are consumed or split up.
+    """
+    for batch_index in range(n_batches(n, batch_size)):
+        yield generate_batch(batch_index, n, config, seed, batch_size)
+
+
+def n_batches(n, batch_size=DEFAULT_BATCH_SIZE):
+    return -(-n // batch_size)
+
+
+def generate_batch(batch_index, n, config=DEFAULT_CONFIG, seed=0, batch_size=DEFAULT_BATCH_SIZE):
+    """Batch `batch_index` of generate_batches(), generated on its own."""
+    size = min(batch_size, n - batch_index * batch_size)
+    return generate_bulk(size, config, np.random.default_rng([seed, batch_index]))
+
+
+def generate_addresses(n, config=DEFAULT_CONFIG, seed=0, batch_size=DEFAULT_BATCH_SIZE):
+    """Generate `n` addresses and one label list per address."""
+    addresses = []
+    label_list = []
+    for batch_addresses, labels in generate_batches(n, config, seed, batch_size):
+        addresses.extend(batch_addresses)
+        label_list.extend([labels] * len(batch_addresses))
+    return addresses, label_list
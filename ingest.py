@@ -0,0 +1,306 @@
+import argparse
+import io
+import os
+import time
+from contextlib import nullcontext
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from evaluation import DECODERS, TAG_INDEX, TAGS
+from paths import BASE_DIR
+
+
+# Rows read, tagged and written at a time; memory use is bounded by this, not by the file size
+DEFAULT_INGEST_CHUNK_SIZE = 10_000
+
+# Where the app writes tagged files before they are downloaded
+DEFAULT_OUTPUT_DIR = os.path.join(BASE_DIR, ".cache", "ingest")
+# Tagged files outlive the sessions that wrote them; beyond this age or total size the oldest go
+MAX_OUTPUT_AGE_SECONDS = 24 * 60 * 60
+MAX_OUTPUT_BYTES = 2 << 30
+
+FORMATS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+}
+
+# Suffix of the column holding the space separated tags of each tagged column
+TAGS_SUFFIX = "_tags"
+
+
+def detect_format(name):
+    """'csv', 'parquet' or 'jsonl' from a file name's extension."""
+    fmt = FORMATS.get(os.path.splitext(name)[1].lower())
+    if fmt is None:
+        raise ValueError(f"Unsupported file type {name!r}; expected one of {', '.join(FORMATS)}")
+    return fmt
+
+
+def _parquet():
+    # pyarrow is only needed for Parquet files
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Reading and writing Parquet files needs pyarrow (pip install pyarrow)") from e
+    return pa, pq
+
+
+def read_columns(file, fmt):
+    """Column names of a file without reading its rows; file objects are rewound afterwards."""
+    if fmt == "parquet":
+        columns = _parquet()[1].ParquetFile(file).schema_arrow.names
+    elif fmt == "csv":
+        columns = list(pd.read_csv(file, nrows=0).columns)
+    else:
+        columns = list(next(_jsonl_chunks(file, 1), pd.DataFrame()).columns)
+    if hasattr(file, "seek"):
+        file.seek(0)
+    return columns
+
+
+def count_rows(file, fmt):
+    """Row count when the file records it (Parquet), otherwise None."""
+    if fmt != "parquet":
+        return None
+    n_rows = _parquet()[1].ParquetFile(file).metadata.num_rows
+    if hasattr(file, "seek"):
+        file.seek(0)
+    return n_rows
+
+
+def _jsonl_chunks(file, chunk_size):
+    # pandas' chunked JSON reader closes file objects it is given, which would
+    # close Streamlit's uploaded file, so lines are grouped here instead
+    with open(file, "rb") if isinstance(file, (str, os.PathLike)) else nullcontext(file) as f:
+        while True:
+            lines = [line for line in islice(f, chunk_size) if line.strip()]
+            if not lines:
+                return
+            yield pd.read_json(io.BytesIO(b"".join(lines)), lines=True, dtype=False)
+
+
+def read_chunks(file, fmt, chunk_size=DEFAULT_INGEST_CHUNK_SIZE):
+    """DataFrames of at most `chunk_size` rows, read lazily from a path or file object."""
+    if fmt == "parquet":
+        for batch in _parquet()[1].ParquetFile(file).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    elif fmt == "csv":
+        yield from pd.read_csv(file, dtype=str, keep_default_na=False, chunksize=chunk_size)
+    else:
+        yield from _jsonl_chunks(file, chunk_size)
+
+
+def source_schema(file, fmt):
+    """Arrow schema of a Parquet file, without its pandas metadata; None for other formats."""
+    if fmt != "parquet":
+        return None
+    schema = _parquet()[1].ParquetFile(file).schema_arrow.remove_metadata()
+    if hasattr(file, "seek"):
+        file.seek(0)
+    return schema
+
+
+def tagged_schema(columns, tag_columns, source=None):
+    """Arrow schema of tagged output with `columns`.
+
+    Columns keep their type in the `source` schema when there is one; tag
+    columns and everything read from CSV or JSONL are strings. Fixing it up
+    front means a column that happens to be all null in the first chunk does
+    not get typed null and reject the values of later chunks.
+    """
+    pa = _parquet()[0]
+    fields = {} if source is None else {field.name: field for field in source}
+    return pa.schema([
+        fields[name] if name in fields and name not in tag_columns else pa.field(name, pa.string())
+        for name in columns
+    ])
+
+
+class ChunkWriter:
+    """Appends DataFrames to a CSV, Parquet or JSONL file as they are produced.
+
+    Parquet output is written with `schema`, or with a schema of strings for
+    the first chunk's columns when none is given.
+    """
+
+    def __init__(self, path, fmt, schema=None):
+        self.path = path
+        self.fmt = fmt
+        self.schema = schema
+        self._file = None
+        self._parquet_writer = None
+
+    def write(self, chunk):
+        if self.fmt == "parquet":
+            pa, pq = _parquet()
+            if self._parquet_writer is None:
+                self.schema = self.schema or tagged_schema(chunk.columns, chunk.columns)
+                self._parquet_writer = pq.ParquetWriter(self.path, self.schema)
+            # Columns a JSONL chunk lacks are written as nulls
+            table = pa.Table.from_pandas(chunk.reindex(columns=self.schema.names), preserve_index=False)
+            self._parquet_writer.write_table(table.cast(self.schema))
+            return
+        if self._file is None:
+            self._file = open(self.path, "w", encoding="utf-8", newline="")
+            header = True
+        else:
+            header = False
+        if self.fmt == "csv":
+            chunk.to_csv(self._file, header=header, index=False)
+        else:
+            self._file.write(chunk.to_json(orient="records", lines=True, force_ascii=False).rstrip("\n") + "\n")
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def prune_outputs(directory=DEFAULT_OUTPUT_DIR, max_age=MAX_OUTPUT_AGE_SECONDS, max_bytes=MAX_OUTPUT_BYTES):
+    """Delete tagged files not written to for `max_age` seconds, then the oldest until the rest fit in `max_bytes`.
+
+    Files still being written keep a fresh mtime, and the newest file always stays.
+    """
+    if not os.path.isdir(directory):
+        return
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    cutoff = time.time() - max_age
+    for mtime, size, path in entries[:-1]:
+        if mtime >= cutoff and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+class TagSummary:
+    """Tag counts per tagged column, added to chunk by chunk."""
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.counts = {column: np.zeros(len(TAGS), dtype=np.int64) for column in self.columns}
+        self.rows = dict.fromkeys(self.columns, 0)
+        self.empty_rows = dict.fromkeys(self.columns, 0)
+
+    def add(self, column, tags_list):
+        lengths = [len(tags) for tags in tags_list]
+        indices = np.fromiter((TAG_INDEX[tag] for tags in tags_list for tag in tags), dtype=np.int64, count=sum(lengths))
+        self.counts[column] += np.bincount(indices, minlength=len(TAGS))
+        self.rows[column] += len(tags_list)
+        self.empty_rows[column] += lengths.count(0)
+        return self
+
+    def to_frame(self):
+        frame = pd.DataFrame.from_dict(self.counts, orient="index", columns=TAGS)
+        frame["tokens"] = frame[TAGS].sum(axis=1)
+        frame["rows"] = pd.Series(self.rows)
+        frame["empty rows"] = pd.Series(self.empty_rows)
+        return frame
+
+
+def tag_chunk(chunk, columns, decoder="crfsuite"):
+    """Tag `columns` of one chunk; returns the chunk with a `<column>_tags` column after each and the tags lists.
+
+    A `<column>_tags` column the chunk already has, say from tagging the file
+    before, is overwritten where it is.
+    """
+    parse = DECODERS[decoder]
+    tagged = {}
+    for column in columns:
+        texts = chunk[column].fillna("").astype(str)
+        # Exported customer files repeat addresses; each distinct one is tagged once per chunk
+        codes, uniques = pd.factorize(texts)
+        unique_tags = parse(list(uniques))
+        tagged[column] = [unique_tags[code] for code in codes]
+
+    out = chunk.copy()
+    for column in columns:
+        tags = [" ".join(tags) for tags in tagged[column]]
+        if column + TAGS_SUFFIX in out.columns:
+            out[column + TAGS_SUFFIX] = tags
+        else:
+            out.insert(out.columns.get_loc(column) + 1, column + TAGS_SUFFIX, tags)
+    return out, tagged
+
+
+def tag_file(source, output, columns, fmt=None, output_fmt=None, chunk_size=DEFAULT_INGEST_CHUNK_SIZE,
+             decoder="crfsuite", on_chunk=None):
+    """Tag `columns` of a CSV/Parquet/JSONL file chunk by chunk, appending each tagged chunk to `output`.
+
+    on_chunk(summary, n_rows) runs after every chunk is written; returning True
+    stops early and leaves the rows written so far in `output`. Returns the
+    TagSummary and the number of rows written.
+    """
+    fmt = fmt or detect_format(getattr(source, "name", source))
+    output_fmt = output_fmt or detect_format(output)
+    # Tagging X and X_tags would write X's tags over the other column being tagged
+    clashing = [column for column in columns if column + TAGS_SUFFIX in columns]
+    if clashing:
+        raise ValueError(f"Tags of {', '.join(clashing)} would overwrite a column being tagged; "
+                         f"tag {', '.join(column + TAGS_SUFFIX for column in clashing)} separately")
+    schema = source_schema(source, fmt) if output_fmt == "parquet" else None
+    tag_columns = [column + TAGS_SUFFIX for column in columns]
+    summary = TagSummary(columns)
+    n_rows = 0
+    with ChunkWriter(output, output_fmt) as writer:
+        for chunk in read_chunks(source, fmt, chunk_size):
+            missing = [column for column in columns if column not in chunk.columns]
+            if missing:
+                raise KeyError(f"Columns not in the file: {', '.join(missing)}")
+            out, tagged = tag_chunk(chunk, columns, decoder)
+            if output_fmt == "parquet" and writer.schema is None:
+                writer.schema = tagged_schema(out.columns, tag_columns, schema)
+            writer.write(out)
+            for column in columns:
+                summary.add(column, tagged[column])
+            n_rows += len(chunk)
+            if on_chunk is not None and on_chunk(summary, n_rows):
+                break
+    return summary, n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tag the address columns of a CSV, Parquet or JSONL file.")
+    parser.add_argument("source")
+    parser.add_argument("output")
+    parser.add_argument("-c", "--columns", nargs="+", default=["Address"])
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_INGEST_CHUNK_SIZE)
+    parser.add_argument("--decoder", choices=list(DECODERS), default="crfsuite")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    def report(summary, n_rows):
+        elapsed = time.perf_counter() - start
+        print(f"\r{n_rows:,} rows ({n_rows / elapsed:,.0f} rows/s)", end="", flush=True)
+
+    summary, n_rows = tag_file(args.source, args.output, args.columns, chunk_size=args.chunk_size,
+                               decoder=args.decoder, on_chunk=report)
+    print()
+    print(summary.to_frame())
+    print(f"{n_rows:,} rows in {time.perf_counter() - start:.1f}s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
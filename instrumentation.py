@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import ContextDecorator
+
+import pandas as pd
+
+from paths import BASE_DIR
+
+
+# Set to 1 to profile from startup; the diagnostics panel can switch it on and off as well
+PROFILE_ENV = "DATAVIS_PROFILE"
+DEFAULT_LOG_PATH = os.path.join(BASE_DIR, ".cache", "profile.jsonl")
+# Frames tracemalloc keeps per allocation; totals and peaks need only one, which is also the cheapest
+TRACEMALLOC_FRAMES = 1
+# Finished spans kept per thread for the diagnostics panel
+MAX_RECORDS = 1_000
+
+
+class Span(ContextDecorator):
+    """One timed stage; a context manager, or a decorator that times every call.
+
+    `record` holds the result once the span has exited: always the wall time,
+    and with the profiler enabled also CPU time and memory.
+    """
+
+    def __init__(self, profiler, name, fields):
+        self.profiler = profiler
+        self.name = name
+        self.fields = fields
+        self.record = None
+        self._profiled = False
+
+    def _recreate_cm(self):
+        # Each decorated call gets its own span, so recursion and threads do not share state
+        return Span(self.profiler, self.name, self.fields)
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.profiler._enter(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        if self._profiled:
+            self.profiler._exit(self, wall)
+        else:
+            self.record = {"name": self.name, "wall_ms": wall * 1000}
+        return False
+
+
+class Profiler:
+    """Spans recording wall time, CPU time and tracemalloc memory, logged as JSON lines.
+
+    Disabled, a span costs two perf_counter() calls and nothing else is
+    traced. Enabled, each span also records the thread's CPU time, the memory
+    it left allocated and its peak allocation above where it started (nested
+    spans included), and is appended to `log_path`. tracemalloc counts every
+    thread's allocations, so memory figures of stages that overlap with other
+    sessions' work are upper bounds.
+    """
+
+    def __init__(self, enabled=False, log_path=DEFAULT_LOG_PATH):
+        self.enabled = False
+        self.log_path = log_path
+        self._started_tracing = False
+        self._local = threading.local()
+        self._log = None
+        self._log_lock = threading.Lock()
+        if enabled:
+            self.enable()
+
+    def enable(self, log_path=None):
+        if log_path is not None and log_path != self.log_path:
+            self._close_log()
+            self.log_path = log_path
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._started_tracing = True
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        # Leave tracemalloc alone if somebody else started it
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self._close_log()
+
+    def _close_log(self):
+        with self._log_lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def span(self, name, **fields):
+        """Time the stage `name`; extra `fields` (e.g. the session) go into its log line."""
+        return Span(self, name, fields)
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def records(self):
+        """Spans this thread finished while profiling, oldest first."""
+        records = getattr(self._local, "records", None)
+        if records is None:
+            records = self._local.records = deque(maxlen=MAX_RECORDS)
+        return records
+
+    def take(self):
+        """records(), emptied."""
+        records = self.records()
+        taken = list(records)
+        records.clear()
+        return taken
+
+    def _enter(self, span):
+        stack = self._stack()
+        current, peak = tracemalloc.get_traced_memory()
+        # The peak is reset for the new span, so fold the one so far into the enclosing span first
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, peak)
+        tracemalloc.reset_peak()
+        span.memory_start = current
+        span.peak = current
+        span.depth = len(stack)
+        span.parent = stack[-1].name if stack else None
+        span.cpu_start = time.thread_time()
+        span._profiled = True
+        stack.append(span)
+
+    def _exit(self, span, wall):
+        cpu = time.thread_time() - span.cpu_start
+        current, peak = tracemalloc.get_traced_memory()
+        span.peak = max(span.peak, peak)
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, span.peak)
+
+        span.record = {
+            "name": span.name,
+            "wall_ms": wall * 1000,
+            "cpu_ms": cpu * 1000,
+            "allocated_kib": (current - span.memory_start) / 1024,
+            "peak_kib": (span.peak - span.memory_start) / 1024,
+            "depth": span.depth,
+            "parent": span.parent,
+            "time": time.time(),
+            "thread": threading.current_thread().name,
+            **span.fields,
+        }
+        self.records().append(span.record)
+        if self.log_path is not None:
+            line = json.dumps(span.record, default=str, ensure_ascii=False)
+            with self._log_lock:
+                # Opened once per enable(); flushed whenever a top-level stage ends, so that the
+                # log can be read while the app runs without paying for a flush per nested span
+                if self._log is None:
+                    os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                    self._log = open(self.log_path, "a", encoding="utf-8")
+                self._log.write(line + "\n")
+                if span.depth == 0:
+                    self._log.flush()
+
+
+def summarize(path=DEFAULT_LOG_PATH):
+    """Aggregate a span log: calls, median and p95 wall time, mean CPU time and peak memory per stage."""
+    spans = pd.read_json(path, lines=True)
+    grouped = spans.groupby("name")
+    summary = pd.DataFrame({
+        "calls": grouped.size(),
+        "wall_ms_p50": grouped["wall_ms"].median(),
+        "wall_ms_p95": grouped["wall_ms"].quantile(0.95),
+        "wall_ms_total": grouped["wall_ms"].sum(),
+        "cpu_ms_mean": grouped["cpu_ms"].mean(),
+        "peak_kib_max": grouped["peak_kib"].max(),
+        "allocated_kib_mean": grouped["allocated_kib"].mean(),
+    })
+    return summary.sort_values("wall_ms_total", ascending=False)
+
+
+profiler = Profiler(enabled=os.environ.get(PROFILE_ENV) == "1")
+span = profiler.span
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the stage timings and memory logged while profiling.")
+    parser.add_argument("log", nargs="?", default=DEFAULT_LOG_PATH)
+    args = parser.parse_args()
+    print(summarize(args.log).to_string(float_format="{:,.1f}".format))
+
+
+if __name__ == "__main__":
+    main()
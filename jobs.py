@@ -0,0 +1,187 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import profiler
+
+
+# Pools jobs run on. Sample generation gets threads of its own, so that long evaluations and file
+# tagging started by other sessions can never keep a new session waiting for its first samples
+INTERACTIVE, BULK = "interactive", "bulk"
+# Jobs running at once per pool; the rest wait in that pool's queue
+DEFAULT_JOB_WORKERS = {INTERACTIVE: 2, BULK: 2}
+# Finished jobs kept around so that sessions asking for the same thing get the result straight away
+MAX_FINISHED_JOBS = 16
+
+QUEUED, RUNNING, DONE, CANCELLED, FAILED = "queued", "running", "done", "cancelled", "failed"
+
+
+def job_key(kind, **params):
+    """Hash of a job's kind and parameters (generator config, sample count, seed, ...).
+
+    Identical requests get the same key, whichever session makes them.
+    """
+    payload = json.dumps([kind, params], sort_keys=True, default=str)
+    return f"{kind}-{hashlib.sha256(payload.encode()).hexdigest()[:16]}"
+
+
+class Job:
+    """One run of `target(job, *args)` on the runner's worker threads.
+
+    The target reports back through update() and returns early once the job
+    is cancelled. `partial` is whatever it last reported, so watchers can show
+    results before the job is done; a cancelled job keeps the result its
+    target returned on the way out.
+    """
+
+    def __init__(self, key, target, args):
+        self.key = key
+        self.target = target
+        self.args = args
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.partial = None
+        self.result = None
+        self.error = None
+        # Stages the target ran through, when profiling was on
+        self.spans = []
+        self.submitted = time.time()
+        self.finished = None
+        # Sessions waiting on the job; it is only cancelled once all of them have given up
+        self.owners = set()
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def update(self, progress=None, message=None, partial=None):
+        """Report progress from the target; returns True once the job is cancelled.
+
+        The return value makes it usable as an on_batch/on_chunk callback that stops the run.
+        """
+        if progress is not None:
+            self.progress = min(max(progress, 0.0), 1.0)
+        if message is not None:
+            self.message = message
+        if partial is not None:
+            self.partial = partial
+        return self.cancelled
+
+    def wait(self, timeout=None):
+        """Block until the job is done or `timeout` seconds have passed; True if it is done."""
+        return self._done.wait(timeout)
+
+    def _run(self):
+        try:
+            if self.cancelled:
+                self.status = CANCELLED
+                return
+            self.status = RUNNING
+            result = self.target(self, *self.args)
+        except Exception as exc:
+            self.error = exc
+            self.status = FAILED
+        else:
+            self.result = result
+            self.status = CANCELLED if self.cancelled else DONE
+            if self.status == DONE:
+                self.progress = 1.0
+        finally:
+            self.spans = profiler.take()
+            self.finished = time.time()
+            self._done.set()
+
+
+class JobRunner:
+    """Runs jobs on a thread pool and shares them between everyone asking for the same key.
+
+    Threads rather than processes: jobs hand back ResultStores and accumulators
+    without pickling, and jobs that want more cores (evaluate_parallel) bring
+    their own process pool. `workers` maps each pool to its number of threads.
+    """
+
+    def __init__(self, workers=DEFAULT_JOB_WORKERS, max_finished=MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._executors = {
+            pool: ThreadPoolExecutor(n, thread_name_prefix=f"job-{pool}") for pool, n in workers.items()
+        }
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, target, *args, owner=None, pool=INTERACTIVE):
+        """Start `target(job, *args)` on `pool` under `key`, or join the job already queued, running or finished under it.
+
+        A job somebody cancelled is started afresh, even while its worker is
+        still winding down: that worker finishes unobserved rather than handing
+        the new owner a cancelled result. A failed job keeps its error until it
+        is evicted.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or job.cancelled:
+                job = Job(key, target, args)
+                self._jobs.pop(key, None)
+                self._jobs[key] = job
+                self._executors[pool].submit(job._run)
+                self._evict()
+            if owner is not None:
+                job.owners.add(owner)
+        return job
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def cancel(self, key, owner=None):
+        """Withdraw `owner` from the job; it is cancelled once no other owner is waiting on it."""
+        with self._lock:
+            job = self._jobs.get(key)
+            # A session that stopped watching an earlier job under this key does not get a say in its replacement
+            if job is None or (owner is not None and owner not in job.owners):
+                return
+            job.owners.discard(owner)
+            if not job.owners and not job.done:
+                job._cancel.set()
+
+    def _evict(self):
+        # Oldest finished jobs go first; queued and running ones are never dropped
+        finished = [key for key, job in self._jobs.items() if job.done]
+        for key in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[key]
+
+    def stats(self):
+        """One row per job known to the runner, for the diagnostics panel."""
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    "job": job.key,
+                    "status": job.status,
+                    "progress": job.progress,
+                    "sessions": len(job.owners),
+                    "seconds": (job.finished or now) - job.submitted,
+                }
+                for job in self._jobs.values()
+            ]
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    """The process-wide JobRunner; shared by every Streamlit session so identical jobs run once."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+    return _runner
@@ -0,0 +1,56 @@
+import os
+import resource
+import threading
+import time
+
+import joblib
+
+from instrumentation import span
+from paths import BASE_DIR
+
+
+MODEL_PATHS = {
+    "crf": os.path.join(BASE_DIR, "model.joblib"),
+    "catboost": os.path.join(BASE_DIR, "catboosts_compressed.joblib"),
+}
+
+# Loaded models and their load statistics, shared by every session and rerun in the process
+_models = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs (e.g. macOS): fall back to peak RSS, reported in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def get_model(name):
+    """Return the model registered as `name`, loading it on first use."""
+    if name in _models:
+        return _models[name]
+
+    with _lock:
+        # Another thread may have finished loading while we waited for the lock
+        if name not in _models:
+            path = MODEL_PATHS[name]
+            rss_before = _rss_bytes()
+            start = time.perf_counter()
+            with span(f"load model {name}"):
+                _models[name] = joblib.load(path)
+            _stats[name] = {
+                "path": os.path.basename(path),
+                "load_seconds": time.perf_counter() - start,
+                "rss_bytes": max(_rss_bytes() - rss_before, 0),
+                "file_bytes": os.path.getsize(path),
+            }
+    return _models[name]
+
+
+def model_stats():
+    """Load time and resident memory growth for every model loaded so far."""
+    return {name: dict(stats) for name, stats in _stats.items()}
@@ -0,0 +1,5 @@
+import os
+
+
+# The repository root; models, fonts and every cache under .cache live relative to it
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
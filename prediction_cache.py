@@ -0,0 +1,211 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from models import MODEL_PATHS
+from paths import BASE_DIR
+from tagger import DEFAULT_CHUNK_SIZE, parse_many_with_confidence
+
+
+DEFAULT_CACHE_PATH = os.path.join(BASE_DIR, ".cache", "predictions.sqlite")
+
+# Entries kept in the in-memory tier and in the on-disk tier
+MEMORY_CACHE_SIZE = 50_000
+DISK_CACHE_SIZE = 1_000_000
+
+
+# (path, size, mtime) -> SHA-256, so unchanged model files are not re-hashed
+_fingerprints = {}
+
+
+def file_fingerprint(path):
+    """SHA-256 of a file, recomputed only when its size or mtime changes."""
+    stat = os.stat(path)
+    signature = (path, stat.st_size, stat.st_mtime_ns)
+    if signature not in _fingerprints:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _fingerprints[signature] = digest.hexdigest()
+    return _fingerprints[signature]
+
+
+def token_key(tokens):
+    return hashlib.blake2b("\x1f".join(tokens).encode(), digest_size=16).digest()
+
+
+class PredictionCache:
+    """Two-tier cache of CRF tags: an in-memory LRU in front of a SQLite table.
+
+    Each entry may also hold the confidence of its tags as float16 bytes;
+    entries cached without it count as misses for confidence lookups.
+    Entries belong to the fingerprint of the model file they were predicted
+    with; when the file changes both tiers drop everything from the old model.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, model_path=MODEL_PATHS["crf"],
+                 memory_size=MEMORY_CACHE_SIZE, disk_size=DISK_CACHE_SIZE):
+        self.model_path = model_path
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self.counters = dict.fromkeys(["memory_hits", "disk_hits", "misses", "memory_evictions", "disk_evictions"], 0)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Streamlit sessions run on different threads; every access goes through self._lock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            " fingerprint TEXT NOT NULL, key BLOB NOT NULL, tags TEXT NOT NULL, confidence BLOB,"
+            " PRIMARY KEY (fingerprint, key))"
+        )
+        # Tables written before confidence was cached lack the column
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(predictions)")]
+        if "confidence" not in columns:
+            self._db.execute("ALTER TABLE predictions ADD COLUMN confidence BLOB")
+        self._db.commit()
+        # Kept up to date by every write, so the budget check never has to count the whole table
+        self._rows = self._db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def _check_fingerprint(self):
+        fingerprint = file_fingerprint(self.model_path)
+        if fingerprint != self._fingerprint:
+            self._memory.clear()
+            self._rows -= self._db.execute("DELETE FROM predictions WHERE fingerprint != ?", (fingerprint,)).rowcount
+            self._db.commit()
+            self._fingerprint = fingerprint
+
+    def _remember(self, key, tags, confidence):
+        if confidence is None and key in self._memory:
+            confidence = self._memory[key][1]
+        self._memory[key] = (tags, confidence)
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self.counters["memory_evictions"] += 1
+
+    def get_many(self, keys, confidence=False):
+        """Cached tags for each key, or None where the key is not cached.
+
+        With `confidence`, each hit is a (tags, float16 array) pair instead.
+        """
+        with self._lock:
+            self._check_fingerprint()
+            results = [None] * len(keys)
+            missing = []
+            for i, key in enumerate(keys):
+                entry = self._memory.get(key)
+                if entry is None or (confidence and entry[1] is None):
+                    missing.append(i)
+                else:
+                    self._memory.move_to_end(key)
+                    results[i] = entry if confidence else entry[0]
+            self.counters["memory_hits"] += len(keys) - len(missing)
+
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(missing), 500):
+                batch = missing[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, tags, confidence FROM predictions"
+                    f" WHERE fingerprint = ? AND key IN ({','.join('?' * len(batch))})",
+                    [self._fingerprint] + [keys[i] for i in batch],
+                ).fetchall()
+                found = {
+                    key: (tags.split(), None if blob is None else np.frombuffer(blob, dtype=np.float16))
+                    for key, tags, blob in rows
+                    if blob is not None or not confidence
+                }
+                for i in batch:
+                    if keys[i] in found:
+                        entry = found[keys[i]]
+                        self._remember(keys[i], *entry)
+                        results[i] = entry if confidence else entry[0]
+                        self.counters["disk_hits"] += 1
+                    else:
+                        self.counters["misses"] += 1
+            return results
+
+    def put_many(self, items):
+        """Store (key, tags) or (key, tags, confidence) items; a missing confidence keeps any stored one."""
+        with self._lock:
+            self._check_fingerprint()
+            rows = []
+            for key, tags, *rest in items:
+                confidence = np.asarray(rest[0], dtype=np.float16) if rest and rest[0] is not None else None
+                self._remember(key, list(tags), confidence)
+                rows.append((self._fingerprint, key, " ".join(tags), None if confidence is None else confidence.tobytes()))
+            # Keys already stored are updated in place and do not add rows
+            keys = list(dict.fromkeys(row[1] for row in rows))
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                stored = self._db.execute(
+                    f"SELECT COUNT(*) FROM predictions WHERE fingerprint = ? AND key IN ({','.join('?' * len(batch))})",
+                    [self._fingerprint] + batch,
+                ).fetchone()[0]
+                self._rows += len(batch) - stored
+            self._db.executemany(
+                "INSERT INTO predictions (fingerprint, key, tags, confidence) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (fingerprint, key) DO UPDATE SET"
+                " tags = excluded.tags, confidence = COALESCE(excluded.confidence, confidence)",
+                rows,
+            )
+            # Drop the oldest rows once the table outgrows its budget
+            overflow = self._rows - self.disk_size
+            if overflow > 0:
+                self._rows -= self._db.execute(
+                    "DELETE FROM predictions WHERE rowid IN (SELECT rowid FROM predictions ORDER BY rowid LIMIT ?)",
+                    (overflow,),
+                ).rowcount
+                self.counters["disk_evictions"] += overflow
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM predictions")
+            self._db.commit()
+            self._rows = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, memory_entries=len(self._memory))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prediction_cache():
+    """The process-wide PredictionCache, opened on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PredictionCache()
+    return _cache
+
+
+def parse_many_with_confidence_cached(texts, chunk_size=DEFAULT_CHUNK_SIZE, cache=None):
+    """parse_many_with_confidence() backed by the prediction cache; returns (tags list, confidence list)."""
+    cache = cache or get_prediction_cache()
+    keys = [token_key(text.split()) for text in texts]
+    results = cache.get_many(keys, confidence=True)
+
+    missing = {}
+    for i, entry in enumerate(results):
+        if entry is None:
+            missing.setdefault(keys[i], []).append(i)
+    if missing:
+        first = [positions[0] for positions in missing.values()]
+        predicted, confidence = parse_many_with_confidence([texts[i] for i in first], chunk_size)
+        cache.put_many(list(zip(missing, predicted, confidence)))
+        for positions, tags, scores in zip(missing.values(), predicted, confidence):
+            for i in positions:
+                results[i] = (list(tags), scores)
+    return [list(tags) for tags, _ in results], [scores for _, scores in results]
@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+
+from evaluation import TAGS
+from sankey import PAD, encode_tag_codes
+
+
+def _offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+class ResultStore:
+    """Addresses with their predicted tags, labels and confidence, stored column-wise.
+
+    Arrow-style layout: the addresses are one UTF-8 buffer sliced by
+    `text_offsets`; predictions and labels are uint8 indices into `tags` (PAD
+    for anything else) and confidence is float16, all flat and sliced by the
+    shared `token_offsets`. No Python object is kept per address or per token.
+    """
+
+    def __init__(self, text, text_offsets, token_offsets, predictions, labels=None, confidence=None, tags=TAGS):
+        self.text = text
+        self.text_offsets = text_offsets
+        self.token_offsets = token_offsets
+        self.predictions = predictions
+        self.labels = labels
+        self.confidence = confidence
+        self.tags = list(tags)
+        n_tokens = int(token_offsets[-1])
+        for name, column in (("predictions", predictions), ("labels", labels), ("confidence", confidence)):
+            if column is not None and len(column) != n_tokens:
+                raise ValueError(f"{name} has {len(column)} entries for {n_tokens} tokens")
+
+    @classmethod
+    def from_lists(cls, addresses, predicted_tags_list, label_list=None, confidence_list=None, tags=TAGS):
+        """Build from per-address lists; `label_list` may also be already encoded flat codes."""
+        encoded = [address.encode() for address in addresses]
+        text = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        text_offsets = _offsets(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)))
+        token_offsets = _offsets(np.fromiter(map(len, predicted_tags_list), dtype=np.int64, count=len(predicted_tags_list)))
+
+        predictions = encode_tag_codes(predicted_tags_list, tags)
+        if label_list is None or isinstance(label_list, np.ndarray):
+            labels = label_list
+        else:
+            labels = encode_tag_codes(label_list, tags)
+        confidence = None
+        if confidence_list is not None:
+            confidence = np.concatenate(confidence_list).astype(np.float16) if len(confidence_list) else np.zeros(0, np.float16)
+        return cls(text, text_offsets, token_offsets, predictions, labels, confidence, tags)
+
+    def to_arrays(self, prefix=""):
+        """The store's buffers as a dict of arrays, e.g. for np.savez; from_arrays() reverses it."""
+        arrays = {
+            f"{prefix}text": self.text,
+            f"{prefix}text_offsets": self.text_offsets,
+            f"{prefix}token_offsets": self.token_offsets,
+            f"{prefix}predictions": self.predictions,
+            f"{prefix}tags": np.asarray(self.tags),
+        }
+        for name in ("labels", "confidence"):
+            if getattr(self, name) is not None:
+                arrays[f"{prefix}{name}"] = getattr(self, name)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix=""):
+        def get(name):
+            return arrays[f"{prefix}{name}"] if f"{prefix}{name}" in arrays else None
+
+        return cls(get("text"), get("text_offsets"), get("token_offsets"), get("predictions"), get("labels"),
+                   get("confidence"), get("tags").tolist())
+
+    def __len__(self):
+        return len(self.text_offsets) - 1
+
+    @property
+    def lengths(self):
+        """Number of tokens of each address."""
+        return np.diff(self.token_offsets)
+
+    def _tokens(self, i):
+        return slice(self.token_offsets[i], self.token_offsets[i + 1])
+
+    def address(self, i):
+        return self.text[self.text_offsets[i]:self.text_offsets[i + 1]].tobytes().decode()
+
+    def addresses(self):
+        data = self.text.tobytes()
+        offsets = self.text_offsets.tolist()
+        return [data[start:end].decode() for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def prediction(self, i):
+        return [self.tags[code] if code != PAD else None for code in self.predictions[self._tokens(i)]]
+
+    def label(self, i):
+        return [self.tags[code] if code != PAD else None for code in self.labels[self._tokens(i)]]
+
+    def confidence_of(self, i):
+        return self.confidence[self._tokens(i)]
+
+    def shuffled_tokens(self, rng):
+        """The addresses with their tokens shuffled within each address, and the labels moved with them.
+
+        Returns the new address strings and the label codes in their new order.
+        """
+        n_tokens = int(self.token_offsets[-1])
+        rows = np.repeat(np.arange(len(self)), self.lengths)
+        # Sorting by address + a random fraction permutes tokens inside each address only
+        order = np.argsort(rows + rng.random(n_tokens), kind="stable")
+        tokens = " ".join(self.addresses()).split()
+        if len(tokens) != n_tokens:
+            raise ValueError("addresses and tags are not aligned token for token")
+        shuffled = [tokens[i] for i in order.tolist()]
+        offsets = self.token_offsets.tolist()
+        addresses = [" ".join(shuffled[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+        labels = None if self.labels is None else self.labels[order]
+        return addresses, labels
+
+    def memory_usage(self):
+        """Bytes held by each column."""
+        usage = {
+            "addresses": self.text.nbytes + self.text_offsets.nbytes,
+            "token offsets": self.token_offsets.nbytes,
+            "predictions": self.predictions.nbytes,
+        }
+        if self.labels is not None:
+            usage["labels"] = self.labels.nbytes
+        if self.confidence is not None:
+            usage["confidence"] = self.confidence.nbytes
+        return usage
+
+    @property
+    def nbytes(self):
+        return sum(self.memory_usage().values())
+
+    def to_arrow(self, decode_tags=False):
+        """A pyarrow Table over the store's own buffers.
+
+        Tags are dictionary-encoded lists pointing at the uint8 codes. With
+        `decode_tags` they become plain string lists instead, which costs one
+        take() per column; use that for consumers that do not understand
+        dictionaries.
+        """
+        import pyarrow as pa
+
+        n = len(self)
+        offsets = pa.Array.from_buffers(pa.int64(), n + 1, [None, pa.py_buffer(self.token_offsets)])
+        dictionary = pa.array(self.tags, type=pa.string())
+
+        def tag_column(codes):
+            if (codes == PAD).any():
+                indices = pa.array(codes, mask=codes == PAD)
+            else:
+                indices = pa.Array.from_buffers(pa.uint8(), len(codes), [None, pa.py_buffer(codes)])
+            values = (dictionary.take(indices) if decode_tags
+                      else pa.DictionaryArray.from_arrays(indices, dictionary))
+            return pa.LargeListArray.from_arrays(offsets, values)
+
+        columns = {
+            "Address": pa.Array.from_buffers(pa.large_string(), n,
+                                             [None, pa.py_buffer(self.text_offsets), pa.py_buffer(self.text)]),
+            "Prediction": tag_column(self.predictions),
+        }
+        if self.labels is not None:
+            columns["Labels"] = tag_column(self.labels)
+        if self.confidence is not None:
+            values = pa.Array.from_buffers(pa.float16(), len(self.confidence), [None, pa.py_buffer(self.confidence)])
+            columns["Confidence"] = pa.LargeListArray.from_arrays(offsets, values)
+        return pa.table(columns)
+
+    def to_pandas(self):
+        """A DataFrame backed by the Arrow buffers rather than Python lists."""
+        return self.to_arrow().to_pandas(types_mapper=pd.ArrowDtype)
@@ -0,0 +1,171 @@
+import argparse
+import math
+import time
+from itertools import chain, permutations
+
+import numpy as np
+import pandas as pd
+
+from evaluation import TAGS, TAG_INDEX
+from generator import generate_addresses
+from sankey import PAD, encode_tag_codes
+from viterbi import get_numpy_crf
+
+
+# Token orders tried per address
+DEFAULT_PERMUTATIONS = 100
+# Permuted sequences decoded per Viterbi call; bounds the (sequences, steps, labels) tensors
+DEFAULT_BATCH_SEQUENCES = 50_000
+
+
+def permutation_indices(length, k, n, rng):
+    """Token orders to try for each of `n` addresses of `length` tokens, as an (n, orders, length) array.
+
+    When there are at most `k` orders in all, every one is tried (the array is
+    a broadcast view of a single table); otherwise the original order and
+    k - 1 random ones are drawn per address. The first order is always the
+    original one.
+    """
+    if math.factorial(length) <= k:
+        table = np.array(list(permutations(range(length))), dtype=np.intp)
+        return np.broadcast_to(table, (n, len(table), length))
+    orders = rng.random((n, k, length)).argsort(axis=-1)
+    orders[:, 0] = np.arange(length)
+    return orders
+
+
+def inversions(orders):
+    """Kendall tau distance of each order from the original: the number of token pairs it swaps."""
+    first, second = np.triu_indices(orders.shape[-1], 1)
+    return (orders[..., first] > orders[..., second]).sum(axis=-1)
+
+
+class PermutationAccumulator:
+    """Correct and total token counts over permuted addresses, broken down several ways."""
+
+    BREAKDOWNS = ("original position", "shuffled position", "tag", "distance", "distance (addresses)")
+
+    def __init__(self):
+        self.counts = {name: np.zeros((2, 0), dtype=np.int64) for name in self.BREAKDOWNS}
+
+    def _add(self, name, index, correct):
+        index = index.ravel()
+        correct = correct.ravel()
+        size = max(self.counts[name].shape[1], int(index.max()) + 1 if len(index) else 0)
+        counts = np.pad(self.counts[name], ((0, 0), (0, size - self.counts[name].shape[1])))
+        counts[0] += np.bincount(index[correct], minlength=size)
+        counts[1] += np.bincount(index, minlength=size)
+        self.counts[name] = counts
+
+    def add(self, orders, truth, predicted):
+        """Fold in (sequences, length) arrays: each sequence's order and its true and predicted tag codes."""
+        correct = truth == predicted
+        distance = inversions(orders)
+        self._add("original position", orders, correct)
+        self._add("shuffled position", np.broadcast_to(np.arange(orders.shape[1]), orders.shape), correct)
+        known = truth != PAD
+        self._add("tag", truth[known].astype(np.intp), correct[known])
+        self._add("distance", np.broadcast_to(distance[:, None], orders.shape), correct)
+        self._add("distance (addresses)", distance, correct.all(axis=1))
+        return self
+
+    @property
+    def total(self):
+        return int(self.counts["tag"][1].sum())
+
+    @property
+    def accuracy(self):
+        correct, total = self.counts["shuffled position"].sum(axis=1)
+        return correct / total if total else float("nan")
+
+    def to_frames(self):
+        """One accuracy table per breakdown; distance is the number of token pairs swapped."""
+        frames = {}
+        for name, (correct, total) in self.counts.items():
+            with np.errstate(invalid="ignore", divide="ignore"):
+                frame = pd.DataFrame({"tokens": total, "accuracy": correct / total})
+            if name == "tag":
+                frame.index = TAGS[:len(frame)]
+            elif name == "distance (addresses)":
+                frame.columns = ["addresses", "exact"]
+            frames[name] = frame[frame.iloc[:, 0] > 0]
+        frames["distance"] = frames["distance"].join(frames.pop("distance (addresses)"))
+        return frames
+
+
+def permutation_robustness(addresses, labels, k=DEFAULT_PERMUTATIONS, seed=0,
+                           batch_sequences=DEFAULT_BATCH_SEQUENCES, on_batch=None):
+    """Tag `k` token orders of every address and measure how accuracy holds up.
+
+    `labels` are per-address tag lists or flat TAGS codes aligned with the
+    whitespace tokens. Every distinct word is scored once; its own, "-1" and
+    "+1" feature pieces do not depend on its neighbours, so each permuted
+    sequence's emissions are gathered from them by index and all orders of a
+    batch are Viterbi-decoded together. `on_batch(accumulator, n_addresses)`
+    is called after every batch and may return True to stop early.
+    """
+    crf = get_numpy_crf()
+    token_lists = [address.split() for address in addresses]
+    lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists))
+    n_tokens = int(lengths.sum())
+    if not isinstance(labels, np.ndarray):
+        labels = encode_tag_codes(labels, TAGS)
+    if len(labels) != n_tokens:
+        raise ValueError(f"{len(labels)} labels for {n_tokens} tokens")
+
+    word_ids = {}
+    ids = np.fromiter((word_ids.setdefault(word, len(word_ids)) for word in chain.from_iterable(token_lists)),
+                      dtype=np.intp, count=n_tokens)
+    pieces = crf.word_pieces(word_ids)
+    to_tag = np.array([TAG_INDEX.get(label, PAD) for label in crf.labels], dtype=np.uint8)
+    starts = np.cumsum(lengths) - lengths
+
+    rng = np.random.default_rng(seed)
+    accumulator = PermutationAccumulator()
+    n_done = int((lengths == 0).sum())
+    # Addresses of one length share the (addresses, orders, length) index arrays
+    for length in np.unique(lengths[lengths > 0]).tolist():
+        rows = np.flatnonzero(lengths == length)
+        tokens = starts[rows, None] + np.arange(length)
+        n_orders = min(k, math.factorial(length))
+        per_batch = max(1, batch_sequences // n_orders)
+        for start in range(0, len(rows), per_batch):
+            batch = tokens[start:start + per_batch]
+            orders = permutation_indices(length, k, len(batch), rng)
+            permuted = np.take_along_axis(batch[:, None, :], orders, axis=-1).reshape(-1, length)
+            emission = crf.sequence_emissions(pieces, ids[permuted])
+            paths = crf.best_paths(emission, np.full(len(permuted), length))
+            accumulator.add(orders.reshape(-1, length), labels[permuted], to_tag[paths])
+            n_done += len(batch)
+            if on_batch is not None and on_batch(accumulator, n_done):
+                return accumulator
+    return accumulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how the CRF's accuracy holds up when address tokens are reordered.")
+    parser.add_argument("-n", "--samples", type=int, default=10_000)
+    parser.add_argument("-k", "--permutations", type=int, default=DEFAULT_PERMUTATIONS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-sequences", type=int, default=DEFAULT_BATCH_SEQUENCES)
+    args = parser.parse_args()
+
+    addresses, label_list = generate_addresses(args.samples, seed=args.seed)
+    start = time.perf_counter()
+
+    def report(accumulator, n_done):
+        elapsed = time.perf_counter() - start
+        print(f"\r{n_done:,} addresses ({accumulator.total / elapsed:,.0f} tokens/s)", end="", flush=True)
+
+    accumulator = permutation_robustness(addresses, label_list, args.permutations, args.seed,
+                                         args.batch_sequences, on_batch=report)
+    elapsed = time.perf_counter() - start
+    print()
+    for name, frame in accumulator.to_frames().items():
+        print(f"\nAccuracy by {name}")
+        print(frame.to_string(float_format="{:.3f}".format))
+    print(f"\n{accumulator.total:,} tokens in {elapsed:.1f}s, overall accuracy {accumulator.accuracy:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from evaluation import ConfusionAccumulator
+from generator import normalize_config
+from instrumentation import span
+from models import MODEL_PATHS
+from paths import BASE_DIR
+from prediction_cache import file_fingerprint
+from result_store import ResultStore
+
+
+DEFAULT_CACHE_DIR = os.path.join(BASE_DIR, ".cache", "samples")
+
+# Bytes of sample sets kept in the in-memory tier and in the on-disk tier
+MEMORY_CACHE_BYTES = 512 << 20
+DISK_CACHE_BYTES = 4 << 30
+
+
+def samples_key(n, seed, config, model_path=MODEL_PATHS["crf"]):
+    """Stable hash of everything a sample set depends on.
+
+    That is the normalized generator config, the number of samples, the seed
+    and the model that tagged them. It does not depend on the process, the
+    session or the order widgets were used in.
+    """
+    payload = json.dumps(
+        {"config": normalize_config(config), "n": int(n), "seed": int(seed), "model": file_fingerprint(model_path)},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return f"samples-{hashlib.sha256(payload.encode()).hexdigest()[:32]}"
+
+
+class SampleSet:
+    """Generated samples with their predictions, the token-shuffled variant, and both confusion matrices."""
+
+    CONFUSION = ("fixed", "shuffled")
+
+    def __init__(self, results, shuffled, confusion=None):
+        self.results = results
+        self.shuffled = shuffled
+        self.confusion = self._count_confusion() if confusion is None else confusion
+
+    @span("confusion matrix counts")
+    def _count_confusion(self):
+        # Fold every token into the same fixed 4x4 accumulator the streaming evaluation uses
+        return {
+            name: ConfusionAccumulator().add_codes(store.labels, store.predictions).counts
+            for name, store in zip(self.CONFUSION, (self.results, self.shuffled))
+        }
+
+    @property
+    def nbytes(self):
+        return self.results.nbytes + self.shuffled.nbytes
+
+    def save(self, path):
+        arrays = {**self.results.to_arrays("results."), **self.shuffled.to_arrays("shuffled.")}
+        for name, counts in self.confusion.items():
+            arrays[f"confusion.{name}"] = counts
+        # Written under a temporary name and renamed, so readers never see half a file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            arrays = dict(data)
+        confusion = {name: arrays[f"confusion.{name}"] for name in cls.CONFUSION}
+        return cls(ResultStore.from_arrays(arrays, "results."), ResultStore.from_arrays(arrays, "shuffled."), confusion)
+
+
+class SampleCache:
+    """Two-tier cache of SampleSets shared by every session: an in-memory LRU in front of .npz files.
+
+    Both tiers are bounded in bytes rather than entries, since one sample set
+    may hold a hundred addresses or a million. On disk the least recently
+    used files go first; a hit refreshes the file's mtime.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, memory_bytes=MEMORY_CACHE_BYTES, disk_bytes=DISK_CACHE_BYTES):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(["memory_hits", "disk_hits", "misses", "memory_evictions", "disk_evictions"], 0)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def _remember(self, key, sample_set):
+        self._memory[key] = sample_set
+        self._memory.move_to_end(key)
+        # The newest entry stays even when it alone is over budget
+        while len(self._memory) > 1 and sum(entry.nbytes for entry in self._memory.values()) > self.memory_bytes:
+            self._memory.popitem(last=False)
+            self.counters["memory_evictions"] += 1
+
+    def get(self, key):
+        """The cached SampleSet for `key`, or None."""
+        with self._lock:
+            sample_set = self._memory.get(key)
+            if sample_set is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return sample_set
+
+        path = self._path(key)
+        try:
+            sample_set = SampleSet.load(path)
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            # Missing, or written by an incompatible version; it is regenerated and overwritten
+            with self._lock:
+                self.counters["misses"] += 1
+            return None
+        with self._lock:
+            self._remember(key, sample_set)
+            self.counters["disk_hits"] += 1
+        return sample_set
+
+    def put(self, key, sample_set):
+        sample_set.save(self._path(key))
+        with self._lock:
+            self._remember(key, sample_set)
+            self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        # Oldest first, never the one just written
+        for _, size, path in sorted(entries)[:-1]:
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            self.counters["disk_evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".npz"):
+                    os.remove(entry.path)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self.counters,
+                memory_entries=len(self._memory),
+                memory_bytes=sum(entry.nbytes for entry in self._memory.values()),
+            )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_sample_cache():
+    """The process-wide SampleCache, opened on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SampleCache()
+    return _cache
@@ -0,0 +1,72 @@
+from itertools import chain
+
+import numpy as np
+
+from evaluation import TAGS
+
+
+# Marks positions past the end of a shorter sequence in the padded tag matrix
+PAD = np.uint8(255)
+
+
+def encode_tag_codes(tag_lists, tags=TAGS):
+    """Every tag of every sequence as one flat uint8 array of indices into `tags`; PAD for anything else."""
+    tag_index = {tag: i for i, tag in enumerate(tags)}
+    n_tokens = sum(map(len, tag_lists))
+    return np.fromiter((tag_index.get(tag, PAD) for tag in chain.from_iterable(tag_lists)),
+                       dtype=np.uint8, count=n_tokens)
+
+
+def encode_tags(tag_lists, tags=TAGS):
+    """Pack variable-length tag sequences into a padded uint8 matrix.
+
+    Tags outside `tags` are stored as PAD too, so they never form a flow.
+    """
+    lengths = np.fromiter(map(len, tag_lists), dtype=np.int64, count=len(tag_lists))
+    return pad_codes(encode_tag_codes(tag_lists, tags), lengths)
+
+
+def pad_codes(codes, lengths):
+    """Padded uint8 matrix from flat tag codes and the length of each sequence."""
+    n_levels = int(lengths.max()) if len(lengths) else 0
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    cols = np.arange(len(codes)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    matrix = np.full((len(lengths), n_levels), PAD, dtype=np.uint8)
+    matrix[rows, cols] = codes
+    return matrix
+
+
+def sankey_transitions(tag_lists, tags=TAGS):
+    """Nodes and links of a level-by-level Sankey of tag sequences.
+
+    Node `level * len(tags) + tag` is that tag at that position; every
+    position-to-position transition is counted in a single bincount. A
+    sequence shorter than the longest one simply has no links past its end.
+    """
+    return sankey_transitions_from_matrix(encode_tags(tag_lists, tags), tags)
+
+
+def sankey_transitions_from_matrix(matrix, tags=TAGS):
+    """sankey_transitions() for tags already in a padded matrix (see encode_tags() and pad_codes())."""
+    n_tags = len(tags)
+    n_levels = matrix.shape[1]
+    labels = [f"{tag} - Level {level + 1}" for level in range(n_levels) for tag in tags]
+    if n_levels < 2:
+        empty = np.zeros(0, dtype=np.int64)
+        return labels, empty, empty, empty
+
+    src = matrix[:, :-1].astype(np.int64)
+    tgt = matrix[:, 1:].astype(np.int64)
+    valid = (src != PAD) & (tgt != PAD)
+    level = np.broadcast_to(np.arange(n_levels - 1), src.shape)
+
+    flat = (level[valid] * n_tags + src[valid]) * n_tags + tgt[valid]
+    counts = np.bincount(flat, minlength=(n_levels - 1) * n_tags * n_tags)
+
+    links = np.flatnonzero(counts)
+    link_level, rest = np.divmod(links, n_tags * n_tags)
+    link_src, link_tgt = np.divmod(rest, n_tags)
+    source = link_level * n_tags + link_src
+    target = (link_level + 1) * n_tags + link_tgt
+    return labels, source, target, counts[links]
@@ -0,0 +1,382 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from evaluation import DECODERS
+from instrumentation import span
+from models import get_model
+from tagger import parse_many_with_confidence
+from viterbi import get_numpy_crf
+
+
+# Longest a request waits for others to share its predict call
+DEFAULT_WINDOW_MS = 2.0
+# Texts that close a micro-batch early
+DEFAULT_MAX_BATCH = 64
+# The NumPy decoder is the one that gets cheaper per text in batches; crfsuite tags one sequence at a time
+DEFAULT_DECODER = "numpy"
+# Requests waiting for a batch; beyond this new ones are turned away with 503
+DEFAULT_MAX_QUEUE = 1_024
+# Longest a request may wait for its tags before it gets a 504
+DEFAULT_REQUEST_TIMEOUT = 30.0
+# Connections the listening socket holds before the kernel refuses more
+LISTEN_BACKLOG = 1_024
+MAX_TEXTS_PER_REQUEST = 1_000
+MAX_BODY_BYTES = 1 << 20
+# Requests whose latency the /metrics quantiles are computed over
+LATENCY_WINDOW = 10_000
+
+
+class Overloaded(Exception):
+    """The batcher's queue is full; the client should back off and retry."""
+
+
+class RequestError(ValueError):
+    """A request the server cannot read; `status` is the HTTP status to answer it with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class _Request:
+    __slots__ = ("texts", "confidence", "future", "deadline")
+
+    def __init__(self, texts, confidence, timeout=None):
+        self.texts = texts
+        self.confidence = confidence
+        self.future = Future()
+        # perf_counter() time after which nobody is waiting for the answer any more
+        self.deadline = None if timeout is None else time.perf_counter() + timeout
+
+
+class ServerMetrics:
+    """Counters and recent latencies of the server, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.counters = dict.fromkeys(
+            ["requests", "rejected", "timeouts", "expired", "errors", "texts", "tagged_texts", "batches"], 0)
+        self.predict_seconds = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe_batch(self, n_texts, n_tagged, seconds):
+        with self._lock:
+            self.counters["batches"] += 1
+            self.counters["texts"] += n_texts
+            self.counters["tagged_texts"] += n_tagged
+            self.predict_seconds += seconds
+
+    def observe_latency(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def render(self, queue_depth):
+        with self._lock:
+            counters = dict(self.counters)
+            predict_seconds = self.predict_seconds
+            latencies = np.array(self.latencies)
+        lines = []
+
+        def metric(name, kind, value, help_text, labels=""):
+            if help_text:
+                lines.append(f"# HELP datavis_{name} {help_text}")
+                lines.append(f"# TYPE datavis_{name} {kind}")
+            lines.append(f"datavis_{name}{labels} {value}")
+
+        metric("requests_total", "counter", counters["requests"], "Tagging requests answered or rejected.")
+        metric("rejected_total", "counter", counters["rejected"], "Requests turned away because the queue was full.")
+        metric("timeouts_total", "counter", counters["timeouts"], "Requests that gave up waiting for their tags.")
+        metric("expired_total", "counter", counters["expired"],
+               "Requests dropped from their batch untagged because their client had already timed out.")
+        metric("errors_total", "counter", counters["errors"], "Requests whose batch failed.")
+        metric("texts_total", "counter", counters["texts"], "Texts received in batches.")
+        metric("tagged_texts_total", "counter", counters["tagged_texts"],
+               "Distinct texts sent to the model; lower than texts_total when duplicates were coalesced.")
+        metric("batches_total", "counter", counters["batches"], "Micro-batches run.")
+        metric("predict_seconds_total", "counter", f"{predict_seconds:.6f}", "Time spent tagging batches.")
+        metric("queue_depth", "gauge", queue_depth, "Requests waiting for a batch.")
+        metric("uptime_seconds", "gauge", f"{time.time() - self.started:.1f}", "Seconds since the server started.")
+        for i, quantile in enumerate((0.5, 0.9, 0.99)):
+            value = np.quantile(latencies, quantile) if len(latencies) else float("nan")
+            metric("request_latency_seconds", "summary", f"{value:.6f}",
+                   f"Latency of the last {LATENCY_WINDOW:,} requests, queueing included." if i == 0 else "",
+                   f'{{quantile="{quantile}"}}')
+        return "\n".join(lines) + "\n"
+
+
+class MicroBatcher:
+    """Collects concurrent tagging requests and answers each micro-batch with one predict call.
+
+    A batch closes `window` seconds after its first request arrives or once
+    it holds `max_batch` texts, whichever comes first. Identical texts within
+    a batch are tagged once, by `decoder` (see evaluation.DECODERS); texts
+    somebody wants confidences for go through crfsuite's marginals instead.
+    At most `max_queue` requests wait; submit() raises Overloaded beyond that
+    instead of letting latency grow without bound. Requests whose `timeout`
+    ran out while they queued are dropped from their batch untagged.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW_MS / 1000, max_batch=DEFAULT_MAX_BATCH, max_queue=DEFAULT_MAX_QUEUE,
+                 decoder=DEFAULT_DECODER, metrics=None):
+        self.window = window
+        self.max_batch = max_batch
+        self.decoder = decoder
+        self.metrics = ServerMetrics() if metrics is None else metrics
+        self._queue = queue.Queue(max_queue)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+
+    def start(self):
+        # Load the model before the first request rather than on it
+        get_model("crf")
+        if self.decoder == "numpy":
+            get_numpy_crf()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, texts, confidence=False, timeout=None):
+        """Queue `texts` for tagging; a Future of (tags, confidence or None) per text.
+
+        After `timeout` seconds the texts are no longer tagged and the Future
+        fails with TimeoutError.
+        """
+        request = _Request(texts, confidence, timeout)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            raise Overloaded(f"{self._queue.maxsize} requests are already waiting") from None
+        return request.future
+
+    def _collect(self):
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        n_texts = len(first.texts)
+        deadline = time.perf_counter() + self.window
+        while n_texts < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            n_texts += len(request.texts)
+        return batch
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            if batch:
+                self._run(batch)
+
+    @span("serve batch")
+    def _run(self, batch):
+        start = time.perf_counter()
+        # Under overload, model time spent on answers nobody will receive only makes the backlog worse
+        expired = [request for request in batch if request.deadline is not None and request.deadline <= start]
+        if expired:
+            for request in expired:
+                request.future.set_exception(TimeoutError("timed out before its batch ran"))
+            self.metrics.count("expired", len(expired))
+            batch = [request for request in batch if request.deadline is None or request.deadline > start]
+            if not batch:
+                return
+        # Coalesce duplicates: each distinct text is tagged once, with confidence if anybody asked for it
+        with_confidence = list(dict.fromkeys(text for request in batch if request.confidence for text in request.texts))
+        wanted = set(with_confidence)
+        plain = list(dict.fromkeys(text for request in batch for text in request.texts if text not in wanted))
+        try:
+            answers = {}
+            if plain:
+                for text, tags in zip(plain, DECODERS[self.decoder](plain, chunk_size=len(plain))):
+                    answers[text] = (tags, None)
+            if with_confidence:
+                tags_list, confidence_list = parse_many_with_confidence(with_confidence, chunk_size=len(with_confidence))
+                for text, tags, confidence in zip(with_confidence, tags_list, confidence_list):
+                    answers[text] = (tags, confidence.astype(float).round(4).tolist())
+        except Exception as exc:
+            for request in batch:
+                request.future.set_exception(exc)
+            return
+        n_texts = sum(len(request.texts) for request in batch)
+        self.metrics.observe_batch(n_texts, len(answers), time.perf_counter() - start)
+        for request in batch:
+            request.future.set_result([answers[text] for text in request.texts])
+
+
+class TaggingHandler(BaseHTTPRequestHandler):
+    """POST /parse, GET /metrics and GET /healthz."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # One line per request would drown the metrics under load
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=()):
+        data = body.encode() if isinstance(body, str) else json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        batcher = self.server.batcher
+        if self.path == "/metrics":
+            self._send(200, batcher.metrics.render(batcher.queue_depth), "text/plain; version=0.0.4")
+        elif self.path == "/healthz":
+            self._send(200, {"status": "ok", "queue_depth": batcher.queue_depth})
+        else:
+            self._send(404, {"error": f"no route {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/parse":
+            self._send(404, {"error": f"no route {self.path}"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(self._content_length()) or b"{}")
+            texts, single = self._texts(payload)
+        except RequestError as exc:
+            self._send(exc.status, {"error": str(exc)})
+            # The body was not read, so the rest of the connection cannot be parsed
+            self.close_connection = True
+            return
+        except (ValueError, TypeError) as exc:
+            self._send(400, {"error": str(exc)})
+            return
+
+        batcher = self.server.batcher
+        metrics = batcher.metrics
+        metrics.count("requests")
+        want_confidence = bool(payload.get("confidence"))
+        start = time.perf_counter()
+        try:
+            answers = batcher.submit(texts, want_confidence, self.server.request_timeout).result(self.server.request_timeout)
+        except Overloaded as exc:
+            metrics.count("rejected")
+            self._send(503, {"error": str(exc)}, headers=[("Retry-After", "1")])
+            return
+        except TimeoutError:
+            metrics.count("timeouts")
+            self._send(504, {"error": f"no tags within {self.server.request_timeout:g}s"})
+            return
+        except Exception as exc:
+            metrics.count("errors")
+            self._send(500, {"error": str(exc)})
+            return
+        metrics.observe_latency(time.perf_counter() - start)
+
+        results = []
+        for text, (tags, confidence) in zip(texts, answers):
+            result = {"tokens": text.split(), "tags": tags}
+            # A duplicate of somebody else's text may come back with confidence it did not ask for
+            if want_confidence:
+                result["confidence"] = confidence
+            results.append(result)
+        self._send(200, results[0] if single else {"results": results})
+
+    def _content_length(self):
+        length = self.headers.get("Content-Length")
+        if length is None:
+            raise RequestError("a Content-Length header is required", 411)
+        # int() alone would also take "-1", "+5" or " 7 "
+        if not length.isdecimal():
+            raise RequestError(f"invalid Content-Length {length!r}")
+        length = int(length)
+        if length > MAX_BODY_BYTES:
+            raise RequestError(f"request bodies are limited to {MAX_BODY_BYTES:,} bytes", 413)
+        return length
+
+    @staticmethod
+    def _texts(payload):
+        # {"text": "..."} gets one result back, {"texts": [...]} a list of them
+        if not isinstance(payload, dict):
+            raise ValueError('expected a JSON object with "text" or "texts"')
+        if "text" in payload:
+            texts, single = [payload["text"]], True
+        elif "texts" in payload:
+            texts, single = payload["texts"], False
+        else:
+            raise ValueError('expected a JSON object with "text" or "texts"')
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            raise ValueError('"texts" must be a list of strings')
+        if not texts or len(texts) > MAX_TEXTS_PER_REQUEST:
+            raise ValueError(f"send between 1 and {MAX_TEXTS_PER_REQUEST:,} texts per request")
+        return texts, single
+
+
+class TaggingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+
+def make_server(host="127.0.0.1", port=8000, window_ms=DEFAULT_WINDOW_MS, max_batch=DEFAULT_MAX_BATCH,
+                max_queue=DEFAULT_MAX_QUEUE, decoder=DEFAULT_DECODER, request_timeout=DEFAULT_REQUEST_TIMEOUT):
+    """A TaggingServer tagging through a started MicroBatcher; call serve_forever() on it.
+
+    Each connection gets a thread that only parses JSON and waits on its
+    Future; all tagging happens on the batcher's one thread.
+    """
+    # Models load before the socket listens, so nobody connects to a server that cannot answer yet
+    batcher = MicroBatcher(window_ms / 1000, max_batch, max_queue, decoder).start()
+    server = TaggingServer((host, port), TaggingHandler)
+    server.batcher = batcher
+    server.request_timeout = request_timeout
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the CRF address tagger over HTTP with micro-batching.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--window-ms", type=float, default=DEFAULT_WINDOW_MS,
+                        help="longest a request waits for others to share its batch")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH, help="texts that close a batch early")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE, help="waiting requests before 503s")
+    parser.add_argument("--decoder", choices=list(DECODERS), default=DEFAULT_DECODER)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_REQUEST_TIMEOUT, help="seconds before a 504")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.window_ms, args.max_batch, args.max_queue, args.decoder,
+                         args.timeout)
+    print(f"Tagging on http://{args.host}:{server.server_address[1]}/parse "
+          f"({args.window_ms:g} ms / {args.max_batch} text batches); metrics on /metrics")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.stop()
+
+
+if __name__ == "__main__":
+    main()
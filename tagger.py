@@ -0,0 +1,181 @@
+import threading
+from functools import lru_cache
+from itertools import chain
+
+import numpy as np
+
+from gazetteer import get_gazetteer_index
+from models import get_model
+from tokenizer import segment_text
+
+
+# Number of addresses sent to the CRF in a single predict call
+DEFAULT_CHUNK_SIZE = 1000
+
+# Distinct words whose features are kept around; the address vocabulary is small
+WORD_FEATURE_CACHE_SIZE = 100_000
+
+# The pycrfsuite tagger keeps the current sequence between set(), tag() and marginal()
+_tagger_lock = threading.Lock()
+
+stopwords = ["ผู้", "ที่", "ซึ่ง", "อัน"]
+_stopword_set = frozenset(stopwords)
+
+@lru_cache(maxsize=WORD_FEATURE_CACHE_SIZE)
+def word_features(word):
+  """Features of `word` as the current token, as the previous one and as the next one."""
+  isspace = word.isspace()
+  is_stopword = word in _stopword_set
+  isdigit = word.isdigit()
+
+  own = {
+    "bias": 1.0,
+    "word.word": word,
+    "word[:3]": word[:3],
+    "word.isspace()": isspace,
+    "word.is_stopword()": is_stopword,
+    "word.isdigit()": isdigit,
+    "word.islen5": isdigit and len(word) == 5
+  }
+  as_prev = {
+    "-1.word.prevword": word,
+    "-1.word.isspace()": isspace,
+    "-1.word.is_stopword()": is_stopword,
+    "-1.word.isdigit()": isdigit,
+  }
+  as_next = {
+    "+1.word.nextword": word,
+    "+1.word.isspace()": isspace,
+    "+1.word.is_stopword()": is_stopword,
+    "+1.word.isdigit()": isdigit,
+  }
+  return own, as_prev, as_next
+
+@lru_cache(maxsize=WORD_FEATURE_CACHE_SIZE)
+def gazetteer_word_features(word):
+  """word_features() plus a flag for each gazetteer `word` is in.
+
+  For training a gazetteer-aware CRF; the shipped model was trained without
+  these and crfsuite ignores attributes it has not seen.
+  """
+  own, as_prev, as_next = (piece.copy() for piece in word_features(word))
+  for category in get_gazetteer_index().matches(word):
+    own[f"word.gaz.{category}"] = True
+    as_prev[f"-1.word.gaz.{category}"] = True
+    as_next[f"+1.word.gaz.{category}"] = True
+  return own, as_prev, as_next
+
+def _window_features(pieces, i):
+  # Copy so callers can never mutate the cached dicts
+  features = pieces[i][0].copy()
+
+  if i > 0:
+    features.update(pieces[i - 1][1])
+  else:
+    features["BOS"] = True
+
+  if i < len(pieces) - 1:
+    features.update(pieces[i + 1][2])
+  else:
+    features["EOS"] = True
+
+  return features
+
+def tokens_to_features(tokens, i):
+  lo = max(i - 1, 0)
+  pieces = [word_features(word) for word in tokens[lo:i + 2]]
+  return _window_features(pieces, i - lo)
+
+def text_to_features(text, gazetteer=False):
+  piece_features = gazetteer_word_features if gazetteer else word_features
+  pieces = [piece_features(word) for word in text.split()]
+  return [_window_features(pieces, i) for i in range(len(pieces))]
+
+class TokenBatch:
+  """Many token sequences flattened into one array, with each distinct word's features computed once.
+
+  The columnar taggers start from this: `ids` indexes every token into
+  `words` and `features` (the word_features() of each), and `is_first` /
+  `is_last` mark where sequences begin and end. Building it is the feature
+  pass both the CRF and CatBoost need, so one batch can be shared between
+  them.
+  """
+
+  def __init__(self, token_lists):
+    self.token_lists = token_lists
+    self.lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists))
+    self.n_tokens = int(self.lengths.sum())
+    word_ids = {}
+    self.ids = np.fromiter((word_ids.setdefault(word, len(word_ids)) for word in chain.from_iterable(token_lists)),
+                           dtype=np.intp, count=self.n_tokens)
+    self.words = list(word_ids)
+    self.features = [word_features(word) for word in self.words]
+
+    ends = np.cumsum(self.lengths)
+    self.is_first = np.zeros(self.n_tokens, dtype=bool)
+    self.is_first[(ends - self.lengths)[self.lengths > 0]] = True
+    self.is_last = np.zeros(self.n_tokens, dtype=bool)
+    self.is_last[ends[self.lengths > 0] - 1] = True
+
+  @classmethod
+  def from_texts(cls, texts):
+    return cls([text.split() for text in texts])
+
+  def sequence_features(self):
+    """text_to_features() of every sequence, assembled from the shared word features."""
+    offsets = np.cumsum(self.lengths) - self.lengths
+    sequences = []
+    for start, length in zip(offsets.tolist(), self.lengths.tolist()):
+      pieces = [self.features[i] for i in self.ids[start:start + length].tolist()]
+      sequences.append([_window_features(pieces, i) for i in range(length)])
+    return sequences
+
+def tag_sequences(features):
+  """crfsuite tags of sequences already turned into feature dicts (text_to_features() of each)."""
+  # predict() returns a 2-D array when every sequence has the same length
+  with _tagger_lock:
+    predicted = get_model("crf").predict(features)
+  return [list(tags) for tags in predicted]
+
+def parse(text, segment=False, correct=False):
+  return parse_many([text], segment=segment, correct=correct)[0]
+
+def parse_many(texts, chunk_size=DEFAULT_CHUNK_SIZE, segment=False, correct=False):
+  """Tag a list of addresses, sending `chunk_size` of them to the CRF per predict call.
+
+  With `segment`, addresses written without spaces are first split with the
+  gazetteer tokenizer; the tags then line up with segment_text(text).split().
+  With `correct`, unambiguous gazetteer hits override the model's tags.
+  """
+  if segment:
+    texts = [segment_text(text) for text in texts]
+  predicted_tags_list = []
+  for start in range(0, len(texts), chunk_size):
+    predicted_tags_list.extend(tag_sequences([text_to_features(text) for text in texts[start:start + chunk_size]]))
+  if correct:
+    predicted_tags_list = get_gazetteer_index().correct_many([text.split() for text in texts], predicted_tags_list)
+  return predicted_tags_list
+
+def parse_many_with_confidence(texts, chunk_size=DEFAULT_CHUNK_SIZE):
+  """Tags plus the marginal probability of each predicted tag, as one float16 array per address.
+
+  The tags are the ones parse_many() gives. One set() per address serves both
+  the Viterbi path and the marginals, so this costs little more than tagging;
+  predict_marginals() would run inference again and fetch every label.
+  """
+  predicted_tags_list = []
+  confidence_list = []
+  tagger = get_model("crf").tagger_
+  for start in range(0, len(texts), chunk_size):
+    features = [text_to_features(text) for text in texts[start:start + chunk_size]]
+    scores = []
+    with _tagger_lock:
+      for xseq in features:
+        tagger.set(xseq)
+        tags = tagger.tag()
+        predicted_tags_list.append(tags)
+        scores.extend(tagger.marginal(tag, i) for i, tag in enumerate(tags))
+    # One conversion per chunk, then a view per address
+    lengths = [len(xseq) for xseq in features]
+    confidence_list.extend(np.split(np.array(scores, dtype=np.float16), np.cumsum(lengths)[:-1]))
+  return predicted_tags_list, confidence_list
@@ -0,0 +1,84 @@
+import re
+
+from generator import (
+    FORMAT_OPTIONS,
+    district_variants,
+    districts,
+    first_names,
+    last_names,
+    province_variants,
+    provinces,
+    road_variants,
+    soi_variants,
+    subdistrict_variants,
+    subdistricts,
+    village_variants,
+)
+
+
+# Component prefixes ("ต.", "อำเภอ", "จังหวัด", ...); in the training data a prefix
+# and the value after it form one token, e.g. "ต.บางกะปิ"
+PREFIXES = sorted({
+    fmt
+    for component, options in FORMAT_OPTIONS.items()
+    if component != "HouseNumber"
+    for fmt in options
+    if fmt != "No prefix"
+})
+
+GAZETTEER = sorted(set(
+    first_names + last_names + districts + subdistricts + provinces + village_variants
+    + soi_variants + road_variants + subdistrict_variants + district_variants + province_variants
+))
+
+# House numbers and postal codes: 123, 123/45, 123หมู่1, 10230
+NUMBER = r"\d+(?:/\d+)?(?:หมู่\d+)?"
+
+
+def trie_pattern(words):
+    """A regex matching the longest of `words` at a position, compiled from their trie.
+
+    Alternatives branch one character at a time and word ends become greedy
+    optional groups, so the engine never tries more than the longest word's
+    length of characters from any position.
+    """
+    root = {}
+    for word in words:
+        node = root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def emit(node):
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(root)
+
+
+def compile_tokenizer(prefixes=PREFIXES, words=GAZETTEER):
+    prefix = trie_pattern(prefixes)
+    word = trie_pattern(words)
+    # Characters up to the next gazetteer word, prefix, digit or space
+    unknown = rf"(?:(?!{prefix}|{word}|\d)\S)+"
+    return re.compile(rf"(?:{prefix})(?:{word}|{NUMBER}|{unknown})?|{word}|{NUMBER}|{unknown}")
+
+
+ADDRESS_TOKEN = compile_tokenizer()
+
+
+def segment(text):
+    """Split an address into tokens, including runs written without spaces.
+
+    "ซ.ทองหล่อ23เขตพระโขนง" -> ["ซ.ทองหล่อ23", "เขตพระโขนง"]. Spaces always end a
+    token; within each space separated run the longest gazetteer match wins.
+    """
+    return ADDRESS_TOKEN.findall(text)
+
+
+def segment_text(text):
+    """segment() joined back with spaces, the form parse() and the features expect."""
+    return " ".join(ADDRESS_TOKEN.findall(text))
@@ -1,100 +1,29 @@
 import streamlit as st
-import plotly.express as px
-import joblib
 import pandas as pd
-import altair as alt
-from sklearn.metrics import confusion_matrix
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import matplotlib.font_manager as fm
-import seaborn as sns
-import random
-import plotly.graph_objects as go
-import shap
-import requests
 import os
-from catboost import CatBoostClassifier
-
-
-model = joblib.load("model.joblib")
-
-stopwords = ["ผู้", "ที่", "ซึ่ง", "อัน"]
-
-def tokens_to_features(tokens, i):
-  word = tokens[i]
-
-  features = {
-    "bias": 1.0,
-    "word.word": word,
-    "word[:3]": word[:3],
-    "word.isspace()": word.isspace(),
-    "word.is_stopword()": word in stopwords,
-    "word.isdigit()": word.isdigit(),
-    "word.islen5": word.isdigit() and len(word) == 5
-  }
-
-  if i > 0:
-    prevword = tokens[i - 1]
-    features.update({
-      "-1.word.prevword": prevword,
-      "-1.word.isspace()": prevword.isspace(),
-      "-1.word.is_stopword()": prevword in stopwords,
-      "-1.word.isdigit()": prevword.isdigit(),
-    })
-  else:
-    features["BOS"] = True
-
-  if i < len(tokens) - 1:
-    nextword = tokens[i + 1]
-    features.update({
-      "+1.word.nextword": nextword,
-      "+1.word.isspace()": nextword.isspace(),
-      "+1.word.is_stopword()": nextword in stopwords,
-      "+1.word.isdigit()": nextword.isdigit(),
-    })
-  else:
-    features["EOS"] = True
-
-  return features
-
-def parse(text):
-  tokens = text.split()
-  features = [tokens_to_features(tokens, i) for i in range(len(tokens))]
-  return model.predict([features])[0]
-
-
-# Sample Thai names and surnames
-first_names = ["สมชาย", "วิชัย", "สมศักดิ์", "กิตติ", "อัศวิน", "ประสิทธิ์", "สุริยะ", "ชัยวัฒน์", "วัฒนา", "เอกชัย", "พัฒน์พงศ์", "สุพจน์", "วิเชียร", "อรุณ", "กำธร"]
-last_names = ["มีสุข", "สวัสดี", "สุขใจ", "ใจดี", "ใจบุญ", "กิตติกูล", "ชนะพงศ์", "สุวรรณ", "คงเจริญ", "เพิ่มพูน", "เจริญสุข", "ชัยรัตน์", "ทรงชัย", "สุทธิชัย", "รุ่งเรือง"]
-
-# Sample Thai locations
-districts = ["สามย่าน", "ลาดพร้าว", "บางนา", "บางเขน", "ห้วยขวาง", "บางกะปิ", "ดอนเมือง", "บางบัวทอง", "บางพลี", "พระโขนง", "พญาไท", "บางกอกน้อย", "บางกอกใหญ่", "ปทุมวัน", "สาทร"]
-subdistricts = ["ทุ่งมหาเมฆ", "สวนหลวง", "ลาดยาว", "สีกัน", "บางรัก", "ปากเกร็ด", "บางมด", "ลาดพร้าว", "ศาลายา", "บางกะปิ", "คลองตัน", "พระโขนง", "ลาดพร้าว", "บางนา", "บางซื่อ"]
-provinces = ["กรุงเทพฯ", "กทม", "กรุงเทพมหานคร", "นนทบุรี", "ปทุมธานี", "สมุทรปราการ", "นครปฐม", "ชลบุรี", "อยุธยา", "สระบุรี", "ราชบุรี", "อ่างทอง"]
-postal_codes = ["10100", "10240", "10120", "10230", "10310", "10150", "10210", "11120", "10270", "10540"]
-
-house_number_variants = [
-    lambda: f"{random.randint(1, 999)}/{random.randint(1, 99)}",
-    lambda: f"{random.randint(1, 999)}",
-    lambda: f"{random.randint(1, 999)}หมู่{random.randint(1, 20)}"]
-
-village_variants = [ "รักนิยม","ปิยะ","เพชรเกษม","ท่าช้าง","สวนลุม",
-                    "นครทอง","อรุณสวัสดิ์","อัมพร","คลองสี่", "บางแค"]
-
-soi_variants = ["สาทร11", "รามคำแหง24","สุขุมวิท39","อ่อนนุช18","พัฒนาการ20","นวลจันทร์","ทองหล่อ23"]
-
-road_variants = ["สาทร", "สุขุมวิท", "รามคำแหง", "พัฒนาการ", "วิภาวดีรังสิต","อ่อนนุช", 
-                 "ทองหล่อ", "พระราม9", "ลาดพร้าว"]
-
-subdistrict_variants = ["ทุ่งมหาเมฆ", "สวนหลวง", "ลาดยาว", "สีกัน", "บางรัก", "ปากเกร็ด", 
-                        "บางมด", "ลาดพร้าว", "ศาลายา", "บางกะปิ", "คลองตัน", "พระโขนง", 
-                        "ลาดพร้าว", "บางนา", "บางซื่อ"]
-
-district_variants = ["สามย่าน", "ลาดพร้าว", "บางนา", "บางเขน", "ห้วยขวาง", "บางกะปิ", "ดอนเมือง", 
-                     "บางบัวทอง", "บางพลี", "พระโขนง", "พญาไท", "บางกอกน้อย", "บางกอกใหญ่", "ปทุมวัน", "สาทร"]
-
-province_variants = ["ราชบุรี","กรุงเทพ","กรุงเทพมหานคร"]
+import io
+import hashlib
+import time
+import uuid
+from contextlib import contextmanager
+from evaluation import DECODERS, ConfusionAccumulator, evaluate_batches, evaluate_parallel, labelled_file_batches
+from fonts import use_thai_font
+from catboost_tagger import catboost_pool
+from comparison import CRF_DECODERS, MODELS, compare_models, store_batches
+from explain import catboost_feature_frame, get_shap_engine, shap_heatmap_figure, shap_token_figure
+from ingest import DEFAULT_INGEST_CHUNK_SIZE, DEFAULT_OUTPUT_DIR, FORMATS, count_rows, detect_format, prune_outputs, read_columns, tag_file
+from gazetteer import get_gazetteer_index
+from generator import COMPONENTS, DEFAULT_BATCH_SIZE, FORMAT_OPTIONS, generate_addresses, normalize_config
+from instrumentation import DEFAULT_LOG_PATH, profiler, span, summarize
+from jobs import BULK, DONE, FAILED, get_job_runner, job_key
+from models import get_model, model_stats
+from prediction_cache import get_prediction_cache, parse_many_with_confidence_cached
+from result_store import ResultStore
+from sample_cache import SampleSet, get_sample_cache, samples_key
+from robustness import DEFAULT_PERMUTATIONS, permutation_robustness
+from sankey import pad_codes, sankey_transitions_from_matrix
+from tokenizer import segment_text
 
 
 #---------------------------------------------------
@@ -106,17 +35,14 @@ st.set_page_config(
 
 # Font URL and local path
 #font_url = 'https://github.com/Phonbopit/sarabun-webfont/raw/master/fonts/thsarabunnew-webfont.ttf'
-font_path = 'thsarabunnew-webfont.ttf'
 
 # Download the font if not already present
 #if not os.path.exists(font_path):
 #    os.system(f"wget {font_url}")
 
-# Add the font to Matplotlib
-mpl.font_manager.fontManager.addfont(font_path)
-
-# Set Matplotlib to use the custom font
-mpl.rc('font', family='TH Sarabun New')
+# Heavy plotting and model libraries are imported by the sections that use them, and the
+# Thai font is registered with Matplotlib once per process (fonts.use_thai_font), so a
+# fresh server and each rerun only pay for what is actually drawn.
 
 
 # url = "https://github.com/Phonbopit/sarabun-webfont/raw/master/fonts/thsarabunnew-webfont.ttf"
@@ -133,6 +59,40 @@ mpl.rc('font', family='TH Sarabun New')
 
 
 
+# How the page hangs together; each step is only recomputed when the one before it changes:
+#   generator config, sample count, seed -> samples -> predictions -> confusion matrices -> heatmaps, bar chart, Sankey
+#                                                     predictions -> token confidence -> shaded highlights, least confident tokens
+#   free text -> tags, confidence -> SHAP
+# Widgets that only feed one section live inside that section's st.fragment, so using
+# them reruns the fragment alone instead of the whole script.
+
+def memoize(key, inputs, compute):
+    """Keep compute()'s result in the session until `inputs` changes."""
+    cached = st.session_state.get(key)
+    if cached is None or cached[0] != inputs:
+        cached = (inputs, compute())
+        st.session_state[key] = cached
+    return cached[1]
+
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
+session_id = st.session_state['session_id']
+
+# Spans left over from this thread's previous run
+profiler.take()
+
+@contextmanager
+def timed_section(name):
+    # The last run of each section, shown under Diagnostics: wall time always, CPU time and memory while profiling.
+    # Also works as a decorator, which is how fragments time their own reruns.
+    section = span(name, session=session_id)
+    try:
+        with section:
+            yield
+    finally:
+        st.session_state.setdefault('section_timings', {})[name] = section.record
+
+
 # Create WebApp by Streamlit
 st.title('Named Entity Recognition (NER) Visualization')
 
@@ -142,8 +102,8 @@ with col1:
 # Address component selection
     components_order = st.multiselect(
         "Select components and their order for the address:",
-        options=["Name", "HouseNumber", "Village", "Soi", "Road", "Subdistrict", "District", "Province", "PostalCode"],
-        default=["Name", "HouseNumber", "Village", "Soi", "Road", "Subdistrict", "District", "Province", "PostalCode"]
+        options=COMPONENTS,
+        default=COMPONENTS
     )
     # Master checkbox for "All"
     all_selected = st.checkbox("Select All Components", True)
@@ -168,247 +128,355 @@ with col1:
             component_visibility[key] = True
 
 with col2:
-    name_format = st.multiselect("Select Name Format", ["นาย", "นาง", "นางสาว","No prefix"], default=["นาย", "นาง", "นางสาว","No prefix"])
-    house_number_format = st.multiselect("Select House Number Format", ["123", "123/45", "123หมู่1"], default=["123", "123/45", "123หมู่1"])
-    village_format = st.multiselect("Select Village Format", ["หมู่บ้าน", "ม.", "No prefix"], default=["หมู่บ้าน", "ม.", "No prefix"])  # Allow multiple selections
-    soi_format = st.multiselect("Select Soi Format", ["ซอย", "ซ.", "No prefix"], default = ["ซอย", "ซ.", "No prefix"])  # Allow multiple selections
-    road_format = st.multiselect("Select Road Format", ["ถนน", "ถ.", "No prefix"], default=["ถนน", "ถ.", "No prefix"])  # Allow multiple selections
-    subdistrict_format = st.multiselect("Select Subdistrict Format", ["ตำบล", "ต.", "แขวง"], default=["ตำบล", "ต.", "แขวง"])
-    district_format = st.multiselect("Select District Format", ["อำเภอ", "อ.", "เขต"], default=["อำเภอ", "อ.", "เขต"])
-    province_format = st.multiselect("Select Province Format", ["จังหวัด", "จ.", "No prefix"], default= ["จังหวัด", "จ.", "No prefix"])  # Allow multiple selections
-
-# Modify the variations to use selected format
-def generate_address():
-
-    selected_name_format = random.choice(name_format) if name_format else ""
-    Name = f"{selected_name_format}{random.choice(first_names)}" if selected_name_format != "No prefix" else random.choice(first_names)
-
-    # Generate house number with randomly selected format
-    selected_house_number_format = random.choice(house_number_format) if house_number_format else ""
-    if selected_house_number_format == "123":
-        house_number = f"{random.randint(1, 999)}"
-    elif selected_house_number_format == "123/45":
-        house_number = f"{random.randint(1, 999)}/{random.randint(1, 99)}"
+    name_format = st.multiselect("Select Name Format", FORMAT_OPTIONS["Name"], default=FORMAT_OPTIONS["Name"])
+    house_number_format = st.multiselect("Select House Number Format", FORMAT_OPTIONS["HouseNumber"], default=FORMAT_OPTIONS["HouseNumber"])
+    village_format = st.multiselect("Select Village Format", FORMAT_OPTIONS["Village"], default=FORMAT_OPTIONS["Village"])  # Allow multiple selections
+    soi_format = st.multiselect("Select Soi Format", FORMAT_OPTIONS["Soi"], default=FORMAT_OPTIONS["Soi"])  # Allow multiple selections
+    road_format = st.multiselect("Select Road Format", FORMAT_OPTIONS["Road"], default=FORMAT_OPTIONS["Road"])  # Allow multiple selections
+    subdistrict_format = st.multiselect("Select Subdistrict Format", FORMAT_OPTIONS["Subdistrict"], default=FORMAT_OPTIONS["Subdistrict"])
+    district_format = st.multiselect("Select District Format", FORMAT_OPTIONS["District"], default=FORMAT_OPTIONS["District"])
+    province_format = st.multiselect("Select Province Format", FORMAT_OPTIONS["Province"], default=FORMAT_OPTIONS["Province"])  # Allow multiple selections
+
+# Everything the synthetic address generator needs to know about the selections above
+generator_config = {
+    "components_order": components_order,
+    "component_visibility": component_visibility,
+    "formats": {
+        "Name": name_format,
+        "HouseNumber": house_number_format,
+        "Village": village_format,
+        "Soi": soi_format,
+        "Road": road_format,
+        "Subdistrict": subdistrict_format,
+        "District": district_format,
+        "Province": province_format,
+    },
+}
+
+# Samples are generated and tagged on a background job; polling faster than this only adds reruns
+JOB_POLL_SECONDS = 0.5
+# Sample jobs that finish within this long are shown on the same run, without a progress bar
+SYNC_WAIT_SECONDS = 3.0
+
+def tag_samples(job, addresses, label_list, done_before, total):
+    # NER tags and their confidence, a chunk at a time so that the job can report progress and stop
+    predicted_tags_list, confidence_list = [], []
+    for start in range(0, len(addresses), DEFAULT_BATCH_SIZE):
+        predictions, confidence = parse_many_with_confidence_cached(addresses[start:start + DEFAULT_BATCH_SIZE])
+        predicted_tags_list.extend(predictions)
+        confidence_list.extend(confidence)
+        done = done_before + len(predicted_tags_list)
+        if job.update(done / total, f"Tagged {done:,} of {total:,} addresses"):
+            return None
+    # Kept column-wise: one text buffer and flat uint8/float16 token arrays instead of lists of strings
+    return ResultStore.from_lists(addresses, predicted_tags_list, label_list, confidence_list)
+
+# Generate samples and predictions, plus a copy with the tokens of each address shuffled, unless
+# any session since the last restart already did: the job's key is the samples' config hash.
+# Runs on a job thread, so nothing in here may touch st.*
+@span("generate samples")
+def generate_samples(job, n_samples, seed, config):
+    sample_cache = get_sample_cache()
+    sample_set = sample_cache.get(job.key)
+    if sample_set is not None:
+        return sample_set
+    job.update(0.0, "Generating addresses")
+    sample_addresses, label_list = generate_addresses(n_samples, config, seed)
+    results = tag_samples(job, sample_addresses, label_list, 0, 2 * n_samples)
+    if results is None:
+        return None
+    shuffled_results = shuffle_address_components(results, seed, job)
+    if shuffled_results is None:
+        return None
+    sample_set = SampleSet(results, shuffled_results)
+    sample_cache.put(job.key, sample_set)
+    return sample_set
+
+@span("shuffle samples")
+def shuffle_address_components(results, seed, job):
+    # Shuffle the tokens within each address, carrying their labels along, then tag the new order
+    shuffled_addresses, shuffled_labels = results.shuffled_tokens(np.random.default_rng(seed))
+    return tag_samples(job, shuffled_addresses, shuffled_labels, len(results), 2 * len(results))
+
+def use_samples(key, sample_set):
+    st.session_state['results'], st.session_state['shuffled_results'] = sample_set.results, sample_set.shuffled
+    st.session_state['sample_confusion'] = sample_set.confusion
+    st.session_state['samples_key'] = key
+    st.session_state['samples_version'] = st.session_state.get('samples_version', 0) + 1
+
+def cancel_sample_job(key):
+    # The job keeps running if another session is still waiting for the same samples
+    get_job_runner().cancel(key, session_id)
+    st.session_state['dismissed_samples'] = key
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def sample_job_status(key):
+  job = get_job_runner().get(key)
+  # A job whose cancellation was requested is not re-attached to; the rerun submits a fresh one
+  if job is None or job.done or job.cancelled:
+      # The whole page has to pick up the new samples, not just this fragment
+      st.rerun()
+  st.progress(job.progress, text=job.message or "Waiting for a free worker...")
+  st.button("Cancel", key="cancel_samples", on_click=cancel_sample_job, args=(key,))
+
+def draw_new_seed():
+    st.session_state['seed'] = int(np.random.SeedSequence().entropy % 2**32)
+
+with col1:
+  n_samples = st.number_input("Number of samples", min_value=1, max_value=1_000_000, value=100, step=100)
+  seed = st.number_input("Random seed", min_value=0, max_value=2**32 - 1, key="seed")
+
+  # Button to regenerate samples with a fresh seed; the new seed gives the job a new key
+  st.button("Generate New Samples", on_click=draw_new_seed)
+
+  # Shade tokens by how sure the CRF is of their tag
+  show_confidence = st.toggle("Confidence mode", help="Shade each token by the marginal probability of its predicted tag and list the least confident tokens.")
+
+# Generate or regenerate samples. Sessions asking for the same config, count and seed share one job and
+# one cache entry, which also outlives restarts; while the job runs the page keeps showing the previous samples
+sample_key = samples_key(n_samples, seed, generator_config)
+if st.session_state.get('samples_key') != sample_key and st.session_state.get('dismissed_samples') != sample_key:
+    with timed_section("samples"):
+        # Settings changed while an earlier job ran: this session no longer needs its samples
+        previous_key = st.session_state.get('sample_job')
+        if previous_key not in (None, sample_key):
+            get_job_runner().cancel(previous_key, session_id)
+        st.session_state['sample_job'] = sample_key
+        # Cached samples are used straight away rather than waiting for a worker to look them up
+        cached_samples = get_sample_cache().get(sample_key)
+        if cached_samples is None:
+            sample_job = get_job_runner().submit(sample_key, generate_samples, n_samples, seed, generator_config, owner=session_id)
+            sample_job.wait(SYNC_WAIT_SECONDS)
+    if cached_samples is not None:
+        use_samples(sample_key, cached_samples)
+    elif sample_job.status == DONE:
+        use_samples(sample_job.key, sample_job.result)
+    elif sample_job.done:
+        st.session_state['dismissed_samples'] = sample_key
+        if sample_job.status == FAILED:
+            st.error(f"Generating samples failed: {sample_job.error}")
     else:
-        house_number = f"{random.randint(1, 999)}หมู่{random.randint(1, 20)}"
-
-    # Generate village with randomly selected format
-    selected_village_format = random.choice(village_format) if village_format else ""
-    village = f"{selected_village_format}{random.choice(village_variants)}" if selected_village_format != "No prefix" else random.choice(village_variants)
-
-    # Generate Soi with randomly selected format
-    selected_soi_format = random.choice(soi_format) if soi_format else ""
-    soi = f"{selected_soi_format}{random.choice(soi_variants)}" if selected_soi_format != "No prefix" else random.choice(soi_variants)
-
-    # Generate Road with randomly selected format
-    selected_road_format = random.choice(road_format) if road_format else ""
-    road = f"{selected_road_format}{random.choice(road_variants)}" if selected_road_format != "No prefix" else random.choice(road_variants)
-
-    # Generate Subdistrict with randomly selected format
-    selected_subdistrict_format = random.choice(subdistrict_format) if subdistrict_format else ""
-    subdistrict = f"{selected_subdistrict_format}{random.choice(subdistrict_variants)}" if selected_subdistrict_format != "No prefix" else random.choice(subdistrict_variants)
-
-    # Generate District with randomly selected format
-    selected_district_format = random.choice(district_format) if district_format else ""
-    district = f"{selected_district_format}{random.choice(district_variants)}" if selected_district_format != "No prefix" else random.choice(district_variants)
-
-    # Generate Province with randomly selected format
-    selected_province_format = random.choice(province_format) if province_format else ""
-    province = f"{selected_province_format}{random.choice(province_variants)}" if selected_province_format != "No prefix" else random.choice(province_variants)
-
-    # Combine all components into the final address
-    address_components = {
-        "Name" : Name,
-        "HouseNumber": house_number,
-        "Village": village,
-        "Soi": soi,
-        "Road": road,
-        "Subdistrict": subdistrict,
-        "District": district,
-        "Province": province,
-        "PostalCode": random.choice(postal_codes)
-    }
+        sample_job_status(sample_key)
 
-    return address_components
+if 'results' not in st.session_state:
+    if st.session_state.get('dismissed_samples') == sample_key:
+        st.info("Sample generation was stopped. Change the settings or generate new samples to try again.")
+    st.stop()
 
+# Bumped on every regeneration; everything derived from the samples is keyed on it
+samples_version = st.session_state['samples_version']
+results = st.session_state['results']
+shuffled_results = st.session_state['shuffled_results']
+sample_confusion = st.session_state['sample_confusion']
 
-# Generate samples and predictions
+def results_table(store):
+  # Arrow tables over the stores' buffers; nothing is copied into per-row Python objects
+  return store.to_arrow(decode_tags=True).select(["Address", "Prediction", "Labels"])
 
-# Define tag labels
-tag_labels = {
-    "Name": "O",
-    "HouseNumber": "ADDR",
-    "Village": "ADDR",
-    "Soi": "ADDR",
-    "Road": "ADDR",
-    "Subdistrict": "LOC",
-    "District": "LOC",
-    "Province": "LOC",
-    "PostalCode": "POST"
-}
+st.write("### Address Generated")
+st.dataframe(results_table(results), use_container_width=True)
+
+
+def least_confident_tokens(store, k=20):
+  """The k tokens with the lowest confidence across all addresses, least confident first."""
+  flat = store.confidence.astype(np.float32)
+  if len(flat) == 0:
+    return pd.DataFrame(columns=["Address #", "Position", "Token", "Prediction", "Confidence"])
+  k = min(k, len(flat))
+  lowest = np.argpartition(flat, k - 1)[:k]
+  lowest = lowest[np.argsort(flat[lowest], kind="stable")]
+
+  # Flat token index -> (address, position)
+  rows = np.searchsorted(store.token_offsets, lowest, side="right") - 1
+  positions = lowest - store.token_offsets[rows]
+
+  table = pd.DataFrame({
+    "Address #": rows,
+    "Position": positions,
+    "Token": [store.address(r).split()[p] for r, p in zip(rows, positions)],
+    "Prediction": [store.tags[c] for c in store.predictions[lowest]],
+  })
+  if store.labels is not None:
+    table["Label"] = [store.tags[c] for c in store.labels[lowest]]
+  table["Confidence"] = flat[lowest]
+  return table
+
+
+if show_confidence:
+  st.write("##### Least confident tokens")
+  st.dataframe(
+    memoize('least_confident', samples_version, lambda: least_confident_tokens(results)),
+    use_container_width=True,
+    hide_index=True,
+    column_config={"Confidence": st.column_config.ProgressColumn(min_value=0.0, max_value=1.0, format="%.3f")},
+  )
+
+
+def create_confusion_matrix(name):
+  # Counted once per sample set when it was generated, and cached along with it
+  return ConfusionAccumulator(sample_confusion[name]).to_frame()
+
+def annotated_heatmap(ax, df, cmap):
+  # What seaborn.heatmap(df, annot=True, fmt="d", cbar=True) draws, without importing
+  # seaborn and, through it, scipy on the first render
+  mesh = ax.pcolormesh(df.values, cmap=cmap)
+  ax.figure.colorbar(mesh, ax=ax).outline.set_linewidth(0)
+  ax.set_xlim(0, df.shape[1])
+  ax.set_ylim(df.shape[0], 0)
+  ax.set_xticks(np.arange(df.shape[1]) + 0.5, labels=df.columns)
+  ax.set_yticks(np.arange(df.shape[0]) + 0.5, labels=df.index, rotation=90, va="center")
+  for spine in ax.spines.values():
+    spine.set_visible(False)
+  mesh.update_scalarmappable()
+  # Dark text on light cells and light text on dark ones, by the cell colour's relative luminance
+  rgb = mesh.get_facecolors()[:, :3]
+  rgb = np.where(rgb <= 0.03928, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+  luminance = rgb @ [0.2126, 0.7152, 0.0722]
+  for (row, col), value, light in zip(np.ndindex(df.shape), df.values.ravel(), luminance > 0.408):
+    ax.text(col + 0.5, row + 0.5, f"{value:d}", ha="center", va="center", color="#262626" if light else "white")
+
+@span("confusion matrix render")
+def confusion_matrix_png(cm_df, cmap):
+  import matplotlib.pyplot as plt
+
+  use_thai_font()
+  fig, ax = plt.subplots(figsize=(8, 6))  # You can still control fig size
+  annotated_heatmap(ax, cm_df, cmap)
+
+  # Set plot labels and title
+  ax.set_xlabel('Predicted Labels')
+  ax.set_ylabel('True Labels')
+  buffer = io.BytesIO()
+  fig.savefig(buffer, format="png", bbox_inches="tight")
+  # Free the figure now rather than leaving it to pyplot's global registry
+  plt.close(fig)
+  return buffer.getvalue()
+
+def plot_confusion_matrix(cm_df, cmap):
+  # Seaborn only runs again when the counts themselves change
+  png = memoize(f"confusion_png_{cmap}", cm_df.values.tobytes(), lambda: confusion_matrix_png(cm_df, cmap))
+  st.image(png)
 
-# Update generate_samples function to include labels
-def generate_samples():
-    sample_addresses = []
-    predicted_tags_list = []
-    label_list = []
-
-    for _ in range(100):  # Generate 50 samples
-        address_data = generate_address()
-        customized_address = " ".join([
-            address_data[component]
-            for component in components_order
-            if component_visibility.get(component, False)
-        ])
-        
-        # Collect labels based on visible components
-        labels = [
-            tag_labels[component]
-            for component in components_order
-            if component_visibility.get(component, False)
-        ]
-
-        sample_addresses.append(customized_address)
-        predicted_tags = parse(customized_address)  # NER tags for address
-        predicted_tags_list.append(predicted_tags)
-        label_list.append(labels)
-
-    return sample_addresses, predicted_tags_list, label_list
-
-def shuffle_address_components(df):
-    shuffled_addresses = []
-    shuffled_predictions = []
-    shuffled_labels = []
-
-    # Iterate over each row in the original DataFrame
-    for i in range(len(df)):
-        # Split address into tokens
-        address_tokens = df["Address"].iloc[i].split()
-        prediction_tags = df["Prediction"].iloc[i]
-        label_tags = df["Labels"].iloc[i]
-
-        # Pair tokens with their corresponding prediction and label tags
-        token_data = list(zip(address_tokens, prediction_tags, label_tags))
-
-        # Shuffle the token, prediction, and label pairs
-        random.shuffle(token_data)
-
-        # Separate tokens, predictions, and labels back into separate lists
-        shuffled_tokens, shuffled_pred, shuffled_lbl = zip(*token_data)
-
-        # Join tokens to form the shuffled address string
-        shuffled_address = " ".join(shuffled_tokens)
-
-        # Append the shuffled data to their respective lists
-        shuffled_addresses.append(shuffled_address)
-        shuffled_predictions.append(parse(shuffled_address))
-        shuffled_labels.append(list(shuffled_lbl))
-
-    return shuffled_addresses, shuffled_predictions, shuffled_labels
+def prepare_data_for_plot(cm_df, data_source):
+    """Convert confusion matrix DataFrame into a format suitable for a stacked bar chart."""
+    cm_flat = cm_df.reset_index().melt(id_vars="index", var_name="Predicted", value_name="Count")
+    cm_flat.rename(columns={"index": "True"}, inplace=True)
+    cm_flat["Data Source"] = data_source  # Add a column to indicate the data source
+    return cm_flat
 
-with col1:
-  # Button to regenerate samples
-  if st.button("Generate New Samples"):
-      generate_new_samples = True
-  else:
-      generate_new_samples = False
-
-# Generate or regenerate samples
-if generate_new_samples or 'sample_addresses' not in st.session_state:
-    st.session_state['sample_addresses'], st.session_state['predicted_tags_list'], st.session_state['label_list'] = generate_samples()
-    # Clear shuffled data when new samples are generated
-    st.session_state.pop('shuffled_addresses', None)
-    st.session_state.pop('shuffled_predictions', None)
-    st.session_state.pop('shuffled_labels', None)
-
-sample_addresses = st.session_state['sample_addresses']
-predicted_tags_list = st.session_state['predicted_tags_list']
-label_list = st.session_state['label_list']
-
-# Create the original DataFrame
-df_addresses = pd.DataFrame({
-    "Address": sample_addresses,
-    "Prediction": predicted_tags_list,
-    "Labels": label_list
-})
-
-# Check if shuffled data already exists in session_state
-if 'shuffled_addresses' not in st.session_state:
-    shuffled_addresses, shuffled_predictions, shuffled_labels = shuffle_address_components(df_addresses)
-    st.session_state['shuffled_addresses'] = shuffled_addresses
-    st.session_state['shuffled_predictions'] = shuffled_predictions
-    st.session_state['shuffled_labels'] = shuffled_labels
-
-# Access the shuffled data from session_state
-df_shuffled_addresses = pd.DataFrame({
-    "Address": st.session_state['shuffled_addresses'],
-    "Prediction": st.session_state['shuffled_predictions'],
-    "Labels": st.session_state['shuffled_labels']
-})
 
+@st.fragment
+@timed_section("bar chart")
+def bar_chart_section(cm_df_rand, cm_df_fixed):
+    # Prepare data for plotting
+    df_shuffled_bc = prepare_data_for_plot(cm_df_rand, "Shuffled")
+    df_fixed_bc = prepare_data_for_plot(cm_df_fixed, "Fixed")
+    combined_data = pd.concat([df_shuffled_bc, df_fixed_bc], ignore_index=True)
+    if 'streaming_confusion' in st.session_state:
+        cm_df_stream = ConfusionAccumulator(st.session_state['streaming_confusion']).to_frame()
+        combined_data = pd.concat([combined_data, prepare_data_for_plot(cm_df_stream, "Large-scale")], ignore_index=True)
+
+    # Add a "Correct/Incorrect" column to the combined data
+    combined_data["Match"] = combined_data.apply(
+        lambda row: "Correct" if row["True"] == row["Predicted"] else "Incorrect",
+        axis=1
+    )
 
+    # Initialize session state for the dropdown
+    if "selected_data_source" not in st.session_state:
+        st.session_state.selected_data_source = "All Data"
 
-st.write("### Address Generated")
-st.dataframe(df_addresses, use_container_width=True)
+    # Get unique data sources from the combined data
+    data_sources = combined_data['Data Source'].unique()
 
-true_tags = [tag for tags in df_addresses["Labels"] for tag in tags]
-predicted_tags = [tag for tags in df_addresses["Prediction"] for tag in tags]
+    # Add "All Data" to the options for the dropdown
+    dropdown_options = ['All Data'] + list(data_sources)
 
+    # Handle the selected data source correctly
+    selected_data_source = st.selectbox(
+        'Select Data to Show',
+        dropdown_options,
+        index=dropdown_options.index(st.session_state.selected_data_source) if st.session_state.selected_data_source in dropdown_options else 0,
+        key="data_source_dropdown"
+    )
 
-def create_confusion_matrix(df_addresses):
-  # Flatten the 'Tags' and 'Predict' columns to compare corresponding elements
-  true_tags = [tag for tags in df_addresses["Labels"] for tag in tags]
-  predicted_tags = [tag for tags in df_addresses["Prediction"] for tag in tags]
-  
-  # Get the unique labels (tags) to display the confusion matrix with proper labels
-  labels = ['O','LOC','POST','ADDR']
-  
-  # Create the confusion matrix
-  cm = confusion_matrix(true_tags, predicted_tags, labels=labels)
+    # Update session state with the selected value
+    st.session_state.selected_data_source = selected_data_source
 
-  # Convert the confusion matrix into a DataFrame for better visualization
-  cm_df = pd.DataFrame(cm, index=labels, columns=labels)
+    # Filter the data based on the dropdown selection
+    if st.session_state.selected_data_source != 'All Data':
+        filtered_data = combined_data[combined_data['Data Source'] == st.session_state.selected_data_source]
+    else:
+        filtered_data = combined_data
+
+    # Create the stacked bar chart
+    import plotly.express as px
+
+    fig = px.bar(
+        filtered_data,
+        x='True',
+        y='Count',
+        color='Match',
+        barmode='stack',
+        labels={'Match': 'Prediction result', 'True': 'Tag', 'Count': 'Count'}
+    )
 
-  return cm_df
+    # Update layout to adjust the size
+    fig.update_layout(
+        width=1000,  # Set the width of the plot
+        height=600   # Set the height of the plot
+    )
 
-def prepare_data_for_plot(cm_df, data_source):
-    """Convert confusion matrix DataFrame into a format suitable for a stacked bar chart."""
-    cm_flat = cm_df.reset_index().melt(id_vars="index", var_name="Predicted", value_name="Count")
-    cm_flat.rename(columns={"index": "True"}, inplace=True)
-    cm_flat["Data Source"] = data_source  # Add a column to indicate the data source
-    return cm_flat
+    # Display the chart
+    st.plotly_chart(fig, use_container_width=False)
 
 
-def highlight_address(address, tags):
+def highlight_address(address, tags, confidence=None):
     highlighted_address = ""
     tag_colors = {
-        "O": "background-color: #FFB067; border-radius: 5px; padding: 2px;",
-        "LOC": "background-color: #FFED86; border-radius: 5px; padding: 2px;",
-        "POST": "background-color: #A2DCE7; border-radius: 5px; padding: 2px;",
-        "ADDR": "background-color: #F8CCDC; border-radius: 5px; padding: 2px;"
+        "O": "#FFB067",
+        "LOC": "#FFED86",
+        "POST": "#A2DCE7",
+        "ADDR": "#F8CCDC"
     }
     
     words = address.split()
-    for word, tag in zip(words, tags):
-        style = tag_colors.get(tag, "")
-        highlighted_address += f"<span style='{style}'>{word}</span> "
+    for i, (word, tag) in enumerate(zip(words, tags)):
+        color = tag_colors.get(tag)
+        if color is None:
+            highlighted_address += f"<span>{word}</span> "
+        elif confidence is None:
+            highlighted_address += f"<span style='background-color: {color}; border-radius: 5px; padding: 2px;'>{word}</span> "
+        else:
+            # Fade the tag colour with the confidence; unsure tokens also get a dashed outline
+            score = float(confidence[i])
+            alpha = int(round(255 * (0.2 + 0.8 * score)))
+            outline = " outline: 1px dashed #C0392B;" if score < 0.5 else ""
+            highlighted_address += (
+                f"<span title='{tag} {score:.2f}' style='background-color: {color}{alpha:02X}; "
+                f"border-radius: 5px; padding: 2px;{outline}'>{word}</span> "
+            )
     
     return highlighted_address
 
 # def get_random_ex(df_addresses):
 #     return df_addresses.sample(n=1).iloc[0]
 
+# Row shown as the example; the sample count may be smaller than 23
+example_idx = min(22, len(results) - 1)
+
 col5, col6 = st.columns(2)
 with col5:
-  sample_address = df_shuffled_addresses.iloc[22,:] # just an example
-  address = sample_address[0]
-  tags = sample_address[1]
+  # just an example
+  address = shuffled_results.address(example_idx)
+  tags = shuffled_results.prediction(example_idx)
+  confidence = shuffled_results.confidence_of(example_idx) if show_confidence else None
   
   with st.container(border = True):
     st.caption('Example Prediction for Shuffled Position')
 
     # Highlight the example address
-    highlighted_example = highlight_address(address, tags)
+    highlighted_example = highlight_address(address, tags, confidence)
     # Streamlit markdown with the example and legend
     st.markdown(
         f"""
@@ -431,15 +499,16 @@ with col5:
     )
 
 with col6:
-  sample_address = df_addresses.iloc[22,:] # just an example
-  address = sample_address[0]
-  tags = sample_address[1]
+  # just an example
+  address = results.address(example_idx)
+  tags = results.prediction(example_idx)
+  confidence = results.confidence_of(example_idx) if show_confidence else None
 
   with st.container(border = True):
     st.caption('Example Prediction for Fixed Position')
 
     # Highlight the example address
-    highlighted_example = highlight_address(address, tags)
+    highlighted_example = highlight_address(address, tags, confidence)
     # Streamlit markdown with the example and legend
     st.markdown(
         f"""
@@ -461,6 +530,181 @@ with col6:
     )
 
 
+@st.fragment
+@timed_section("large-scale evaluation")
+def large_scale_evaluation_section(generator_config, seed):
+  eval_source = st.radio("Addresses to evaluate", ["Generated", "Uploaded CSV"], horizontal=True)
+  if eval_source == "Generated":
+      eval_n_samples = st.number_input("Number of addresses", min_value=1, max_value=50_000_000, value=100_000, step=10_000)
+      eval_workers = st.number_input("Worker processes", min_value=1, max_value=os.cpu_count(), value=1)
+  else:
+      eval_file = st.file_uploader("CSV with 'Address' and space separated 'Labels' columns", type="csv")
+  eval_batch_size = st.number_input("Chunk size", min_value=100, max_value=100_000, value=DEFAULT_BATCH_SIZE, step=1_000)
+  eval_decoder = st.radio("Decoder", list(DECODERS), horizontal=True, help="Both decoders give identical tags; numpy decodes whole chunks at once.")
+
+  if st.button("Run Evaluation"):
+      if eval_source == "Generated":
+          key = job_key("evaluation", config=normalize_config(generator_config), n=eval_n_samples, seed=seed, batch_size=eval_batch_size,
+                        workers=eval_workers, decoder=eval_decoder)
+          args = (generator_config, seed, eval_n_samples, eval_batch_size, eval_workers, eval_decoder, None)
+      elif eval_file is not None:
+          # Keyed on the file's contents, so sessions uploading the same file share the job
+          key = job_key("evaluation", file=hashlib.sha256(eval_file.getvalue()).hexdigest(), batch_size=eval_batch_size,
+                        decoder=eval_decoder)
+          args = (None, None, None, eval_batch_size, 1, eval_decoder, eval_file)
+      else:
+          key = None
+          st.warning("Upload a CSV to evaluate first.")
+      if key is not None:
+          get_job_runner().submit(key, run_evaluation, *args, owner=session_id, pool=BULK)
+          st.session_state['evaluation_job'] = key
+          st.session_state.pop('evaluation_error', None)
+          # The progress poller lives outside this fragment
+          st.rerun()
+
+  if 'evaluation_error' in st.session_state:
+      st.error(f"Evaluation failed: {st.session_state['evaluation_error']}")
+  if 'streaming_confusion' in st.session_state and 'evaluation_job' not in st.session_state:
+      cm_df_stream = ConfusionAccumulator(st.session_state['streaming_confusion']).to_frame()
+      plot_confusion_matrix(cm_df_stream, "Greens")
+
+# Runs on a job thread; the running confusion matrix is the job's partial result
+def run_evaluation(job, config, seed, n, batch_size, workers, decoder, file):
+  def report_progress(accumulator, n_done):
+      done = n_done / n if n else file.tell() / max(file.size, 1)
+      return job.update(done, f"{n_done:,} addresses, {accumulator.total:,} tokens evaluated", accumulator.counts.copy())
+
+  if file is None:
+      accumulator = evaluate_parallel(n, config, seed, batch_size, workers, report_progress, decoder)
+  else:
+      accumulator = evaluate_batches(labelled_file_batches(file, batch_size), report_progress, decoder)
+  return accumulator.counts
+
+def finish_evaluation(job):
+  # Counts so far stay on the page when this session stops watching
+  st.session_state.pop('evaluation_job', None)
+  if job.status == FAILED:
+      st.session_state['evaluation_error'] = str(job.error)
+  counts = job.result if job.done else job.partial
+  if counts is not None:
+      st.session_state['streaming_confusion'] = counts
+
+def cancel_evaluation(key):
+  runner = get_job_runner()
+  runner.cancel(key, session_id)
+  job = runner.get(key)
+  if job is not None:
+      finish_evaluation(job)
+  else:
+      st.session_state.pop('evaluation_job', None)
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def evaluation_job_status(key):
+  job = get_job_runner().get(key)
+  if job is None or job.done or job.cancelled:
+      if job is not None:
+          finish_evaluation(job)
+      else:
+          st.session_state.pop('evaluation_job', None)
+      # The bar chart outside this fragment has to pick up the new counts as well
+      st.rerun()
+  st.progress(job.progress, text=job.message or "Waiting for a free worker...")
+  st.button("Cancel", key="cancel_evaluation", on_click=cancel_evaluation, args=(key,))
+  if job.partial is not None:
+      plot_confusion_matrix(ConfusionAccumulator(job.partial).to_frame(), "Greens")
+
+with st.expander("Large-scale Evaluation"):
+  st.caption("Tags addresses chunk by chunk and keeps only the running confusion matrix, so memory stays flat however many addresses are evaluated.")
+  large_scale_evaluation_section(generator_config, seed)
+  if 'evaluation_job' in st.session_state:
+      evaluation_job_status(st.session_state['evaluation_job'])
+
+
+@st.fragment
+@timed_section("permutation robustness")
+def robustness_section(results, samples_version, seed):
+  k = st.number_input("Token orders per address", min_value=1, max_value=1_000, value=DEFAULT_PERMUTATIONS, step=10,
+                      help="The original order plus random ones; addresses with fewer possible orders are tried in all of them.")
+
+  if st.button("Run Experiment"):
+      progress = st.progress(0.0)
+
+      def report_progress(accumulator, n_done):
+          progress.progress(n_done / len(results), text=f"{n_done:,} addresses, {accumulator.total:,} tokens tagged")
+
+      accumulator = permutation_robustness(results.addresses(), results.labels, k, seed, on_batch=report_progress)
+      st.session_state['robustness'] = {"samples_version": samples_version, "k": k, "frames": accumulator.to_frames(),
+                                        "accuracy": accumulator.accuracy}
+      progress.empty()
+
+  saved = st.session_state.get('robustness')
+  if saved is not None and saved['samples_version'] == samples_version:
+      frames = saved['frames']
+      st.write(f"Token accuracy over up to {saved['k']} orders per address: {saved['accuracy']:.3f}")
+      col_distance, col_position = st.columns(2)
+      with col_distance:
+          st.write("##### By permutation distance (token pairs swapped)")
+          st.line_chart(frames["distance"], y=["accuracy", "exact"])
+      with col_position:
+          st.write("##### By component position")
+          positions = frames["original position"][["accuracy"]].join(
+              frames["shuffled position"][["accuracy"]], lsuffix=" (original position)", rsuffix=" (shuffled position)")
+          st.bar_chart(positions, stack=False)
+      st.dataframe(frames["tag"], use_container_width=True)
+
+with st.expander("Permutation Robustness"):
+  st.caption("Tags many token orders of every sample at once and breaks accuracy down by where each component started and how far the order is from the original.")
+  robustness_section(results, samples_version, seed)
+
+
+@st.fragment
+@timed_section("model comparison")
+def model_comparison_section(results, samples_version):
+  compare_source = st.radio("Addresses to compare on", ["Current samples", "Uploaded CSV"], horizontal=True, key="compare_source")
+  if compare_source == "Uploaded CSV":
+      compare_file = st.file_uploader("CSV with 'Address' and space separated 'Labels' columns", type="csv", key="compare_file")
+  compare_batch_size = st.number_input("Chunk size", min_value=1, max_value=100_000, value=DEFAULT_BATCH_SIZE, step=1_000,
+                                       key="compare_batch_size", help="Latency is measured per chunk; 1 gives the latency of a single address.")
+  compare_decoder = st.radio("CRF decoder", list(CRF_DECODERS), index=list(CRF_DECODERS).index("numpy"), horizontal=True, key="compare_decoder")
+
+  if st.button("Compare Models"):
+      if compare_source == "Current samples":
+          batches, n_total, version = store_batches(results, compare_batch_size), len(results), samples_version
+      elif compare_file is not None:
+          batches, n_total, version = labelled_file_batches(compare_file, compare_batch_size), None, None
+      else:
+          batches = None
+          st.warning("Upload a CSV to compare on first.")
+      if batches is not None:
+          progress = st.progress(0.0)
+
+          def report_progress(accumulator, n_done):
+              done = n_done / n_total if n_total else compare_file.tell() / max(compare_file.size, 1)
+              progress.progress(min(done, 1.0), text=f"{n_done:,} addresses, {accumulator.total:,} tokens tagged by both models")
+
+          accumulator = compare_models(batches, compare_decoder, on_batch=report_progress)
+          st.session_state['model_comparison'] = {"samples_version": version, "accumulator": accumulator}
+          progress.empty()
+
+  saved = st.session_state.get('model_comparison')
+  # Results on samples go once the samples change; results on a file stay until the next run
+  if saved is not None and saved['samples_version'] in (None, samples_version):
+      accumulator = saved['accumulator']
+      st.write(f"{accumulator.n_addresses:,} addresses, {accumulator.total:,} tokens; "
+               f"the models agree on {accumulator.agreement:.3f} of the tokens")
+      st.dataframe(accumulator.speed_frame(), use_container_width=True,
+                   column_config={"accuracy": st.column_config.NumberColumn(format="%.3f")})
+      for column, model, cmap in zip(st.columns(2), MODELS, ("Purples", "Oranges")):
+          with column:
+              st.write(f"##### {model} (accuracy {accumulator.accuracy(model):.3f})")
+              plot_confusion_matrix(accumulator.confusion(model).to_frame(), cmap)
+      st.write("##### Tokens the models disagree on")
+      st.dataframe(accumulator.disagreement_frame(), use_container_width=True, hide_index=True)
+
+with st.expander("Model Comparison"):
+  st.caption("Runs the CRF and CatBoost over the same addresses from one shared feature pass and compares their speed, accuracy and where they disagree.")
+  model_comparison_section(results, samples_version)
+
 tab1, tab2 = st.tabs(['Confusion Matrix','Bar Chart'])
 with tab1:
   col3, col4 = st.columns(2)
@@ -471,18 +715,11 @@ with tab1:
     # Plotting the confusion matrix using Seaborn and Matplotlib
     with st.container(border = True):
       # Display the plot within a specific div container
-      cm_df_rand = create_confusion_matrix(df_shuffled_addresses)
-      fig, ax = plt.subplots(figsize=(8, 6))  # You can still control fig size
-      sns.heatmap(cm_df_rand, annot=True, fmt="d", cmap="Blues", cbar=True, ax=ax)
-      
-      # Set plot labels and title
-      ax.set_xlabel('Predicted Labels')
-      ax.set_ylabel('True Labels')
-      # ax.set_title('Confusion Matrix')
-      # Display the plot in Streamlit with the custom style class
-      st.pyplot(fig)
+      with timed_section("confusion matrix (shuffled)"):
+        cm_df_rand = memoize('cm_df_rand', samples_version, lambda: create_confusion_matrix("shuffled"))
+        plot_confusion_matrix(cm_df_rand, "Blues")
 
-    st.dataframe(df_shuffled_addresses, use_container_width=True)
+    st.dataframe(results_table(shuffled_results), use_container_width=True)
 
 
   with col4:
@@ -491,18 +728,11 @@ with tab1:
     # Plotting the confusion matrix using Seaborn and Matplotlib
     with st.container(border = True):
       # Display the plot within a specific div container
-      cm_df_fixed = create_confusion_matrix(df_addresses)
-      fig, ax = plt.subplots(figsize=(8, 6))  # You can still control fig size
-      sns.heatmap(cm_df_fixed, annot=True, fmt="d", cmap="Reds", cbar=True, ax=ax)
-      
-      # Set plot labels and title
-      ax.set_xlabel('Predicted Labels')
-      ax.set_ylabel('True Labels')
-      # ax.set_title('Confusion Matrix')
-      # Display the plot in Streamlit with the custom style class
-      st.pyplot(fig)
+      with timed_section("confusion matrix (fixed)"):
+        cm_df_fixed = memoize('cm_df_fixed', samples_version, lambda: create_confusion_matrix("fixed"))
+        plot_confusion_matrix(cm_df_fixed, "Reds")
 
-    st.dataframe(df_addresses, use_container_width=True)
+    st.dataframe(results_table(results), use_container_width=True)
 
   with tab2:
     st.markdown('##### Stack Bar Chart of Prediction Result')
@@ -559,62 +789,8 @@ with tab1:
       
     #   # Show the plot
     #   st.plotly_chart(fig, use_container_width=False)
-    # Prepare data for plotting
-        df_shuffled_bc = prepare_data_for_plot(cm_df_rand, "Shuffled")
-        df_fixed_bc = prepare_data_for_plot(cm_df_fixed, "Fixed")
-        combined_data = pd.concat([df_shuffled_bc, df_fixed_bc], ignore_index=True)
-
-        # Add a "Correct/Incorrect" column to the combined data
-        combined_data["Match"] = combined_data.apply(
-            lambda row: "Correct" if row["True"] == row["Predicted"] else "Incorrect",
-            axis=1
-        )
-
-        # Initialize session state for the dropdown
-        if "selected_data_source" not in st.session_state:
-            st.session_state.selected_data_source = "All Data"
-
-        # Get unique data sources from the combined data
-        data_sources = combined_data['Data Source'].unique()
-
-        # Add "All Data" to the options for the dropdown
-        dropdown_options = ['All Data'] + list(data_sources)
-
-        # Handle the selected data source correctly
-        selected_data_source = st.selectbox(
-            'Select Data to Show',
-            dropdown_options,
-            index=dropdown_options.index(st.session_state.selected_data_source) if st.session_state.selected_data_source in dropdown_options else 0,
-            key="data_source_dropdown"
-        )
-
-        # Update session state with the selected value
-        st.session_state.selected_data_source = selected_data_source
-
-        # Filter the data based on the dropdown selection
-        if st.session_state.selected_data_source != 'All Data':
-            filtered_data = combined_data[combined_data['Data Source'] == st.session_state.selected_data_source]
-        else:
-            filtered_data = combined_data
-
-        # Create the stacked bar chart
-        fig = px.bar(
-            filtered_data,
-            x='True',
-            y='Count',
-            color='Match',
-            barmode='stack',
-            labels={'Match': 'Prediction result', 'True': 'Tag', 'Count': 'Count'}
-        )
-
-        # Update layout to adjust the size
-        fig.update_layout(
-            width=1000,  # Set the width of the plot
-            height=600   # Set the height of the plot
-        )
-
-        # Display the chart
-        st.plotly_chart(fig, use_container_width=False)
+        # Only this fragment reruns when the data source dropdown changes
+        bar_chart_section(cm_df_rand, cm_df_fixed)
 
 
 
@@ -625,40 +801,16 @@ tag_colors = {
     "ADDR": "#A2DCE7"
 }
 
-with st.container(border = True):
-  #Sankey Diagram
-  st.write("### Sankey Diagram of Prediction Flows")
-  st.write('##### (Fixed Position)')
+@span("sankey figure")
+def sankey_figure(store):
+  import plotly.graph_objects as go
 
-  # Split tags into individual levels
-  df_tags_split = pd.DataFrame(predicted_tags_list, columns=[f"Level {i+1}" for i in range(max(len(tags) for tags in predicted_tags_list))])
-
-  # Prepare data for Sankey Diagram
-  levels = df_tags_split.columns
-  unique_tags = ["O", "LOC", "POST", "ADDR"]
-  labels = [f"{tag} - {level}" for level in levels for tag in unique_tags]
-  label_map = {label: i for i, label in enumerate(labels)}
+  # Count every level-to-level tag transition in one vectorized pass, straight from the stored codes
+  labels, source, target, value = sankey_transitions_from_matrix(pad_codes(store.predictions, store.lengths))
 
   # Assign colors to nodes based on tag_colors
   node_colors = [tag_colors[tag.split(" - ")[0]] for tag in labels]
 
-  source = []
-  target = []
-  value = []
-
-  # Create flows between consecutive levels based on tag transitions
-  for i in range(len(levels) - 1):
-      level1 = df_tags_split[levels[i]]
-      level2 = df_tags_split[levels[i + 1]]
-      flow_data = pd.concat([level1, level2], axis=1).value_counts().reset_index()
-      for (src_tag, tgt_tag), count in zip(flow_data.values[:, :2], flow_data.values[:, 2]):
-          src_label = f"{src_tag} - {levels[i]}"
-          tgt_label = f"{tgt_tag} - {levels[i + 1]}"
-          if src_label in label_map and tgt_label in label_map:
-              source.append(label_map[src_label])
-              target.append(label_map[tgt_label])
-              value.append(count)
-
   # Create Sankey Diagram with custom colors and font adjustments
   fig = go.Figure(go.Sankey(
       node=dict(
@@ -686,159 +838,295 @@ with st.container(border = True):
         height=500   # Adjust height as needed
     )
 
+  return fig
+
+with st.container(border = True):
+  #Sankey Diagram
+  st.write("### Sankey Diagram of Prediction Flows")
+  st.write('##### (Fixed Position)')
+
+  with timed_section("sankey"):
+    fig = memoize('sankey_figure', samples_version, lambda: sankey_figure(results))
+
   # Display Sankey Diagram in Streamlit
   st.plotly_chart(fig, use_container_width=False)
 
 from streamlit.components.v1 import html  # Import for HTML rendering
-st.write("### Highlighted NER Tags and SHAP")
-
-# Text input for long text (e.g., an article or paragraph)
-long_text = st.text_area("Enter or paste your text here (no more than 15 words)", 
-                         "นายวิเชียร ผู้พักอาศัยอยู่ที่ ซ.ทองหล่อ 23 เขตพระโขนง สุขุมวิท 67/2 จังหวัดราชบุรี ต.บางกะปิ ม.สวนลุม 10230 ได้แบ่งปันประสบการณ์เกี่ยวกับพื้นที่อาศัย")
-
-
-def fill_values(row, value_columns):
-    for col in value_columns:
-        if pd.isna(row[col]):
-            if row['EOS']==1:
-                row[col] = 'EOS'
-            elif row['BOS'] == 1:
-                row[col] = 'BOS'
-    return row
-
-
-
-cbr = joblib.load('catboosts_compressed.joblib')
-
-# Prepare the tokens and features
-tokens = long_text.split()[0:16]
-feature_matrix = [tokens_to_features(tokens, i) for i in range(len(tokens))]  # Extract features
-feature_df = pd.DataFrame(feature_matrix)
-feature_df['BOS'] = feature_df['BOS'].apply(lambda x: 1 if x else 0)
-feature_df['EOS'] = feature_df['EOS'].apply(lambda x: 1 if x else 0)
-
-# # Handle categorical features
-# cat_features = feature_df.select_dtypes(include=['object']).columns.tolist()
-# feature_df = feature_df.apply(lambda row: fill_values(row, cat_features), axis=1)
-
-# # Predict with the CatBoost model
-# predicted_probs = cbr.predict(feature_df)
-
-# # SHAP explanation
-# explainer = shap.Explainer(cbr)
-# shap_values = explainer(feature_df)
-# classes = cbr.classes_
-
-# Function to generate SHAP waterfall plot
-def plot_shap_waterfall(instance_idx, class_idx):
-    shap_values_for_class = shap_values[instance_idx].values[:, class_idx]
-    base_value_for_class = shap_values[instance_idx].base_values[class_idx]
-    data_for_instance = shap_values[instance_idx].data
-
-    # Create SHAP waterfall plot
-    fig, ax = plt.subplots()
-    shap.plots.waterfall(
-        shap.Explanation(
-            values=shap_values_for_class,
-            base_values=base_value_for_class,
-            data=data_for_instance,
-            feature_names=feature_df.columns
-        )
-    )
+# Editing the text, toggling SHAP or clicking the heatmap only reruns this fragment
+@st.fragment
+@timed_section("free text & SHAP")
+def free_text_section(show_confidence):
+    st.write("### Highlighted NER Tags and SHAP")
 
-    # Display the plot in Streamlit
-    st.pyplot(fig)
+    # Text input for long text (e.g., an article or paragraph)
+    long_text = st.text_area("Enter or paste your text here", 
+                             "นายวิเชียร ผู้พักอาศัยอยู่ที่ ซ.ทองหล่อ 23 เขตพระโขนง สุขุมวิท 67/2 จังหวัดราชบุรี ต.บางกะปิ ม.สวนลุม 10230 ได้แบ่งปันประสบการณ์เกี่ยวกับพื้นที่อาศัย")
 
 
-# Reset cache if button is clicked again
+    # Thai addresses often arrive without spaces between components
+    if st.checkbox("Split unspaced text into tokens", False, help="Segment runs without spaces using the gazetteers before tagging, e.g. ซ.ทองหล่อ23เขตพระโขนง."):
+        long_text = segment_text(long_text)
 
-    # Apply NER model to the text
-tags = parse(long_text)
+    # Reset cache if button is clicked again
 
-st.caption('Example Prediction for Fixed Position')
+        # Apply NER model to the text
+    tags_list, confidence_list = parse_many_with_confidence_cached([long_text])
+    # Known postal codes, prefixed districts etc. override the model's tag
+    if st.checkbox("Correct tags with the gazetteers", False, help="Tokens found in exactly one kind of gazetteer, such as a known 5-digit postal code, get that component's tag."):
+        tags_list = get_gazetteer_index().correct_many([long_text.split()], tags_list)
+    tags = tags_list[0]
 
-# Highlight the example address
-highlighted_example = highlight_address(long_text, tags)
-# Streamlit markdown with the example and legend
-st.markdown(
-    f"""
-    {highlighted_example}
-    """,
-    unsafe_allow_html=True
-)
-      
-    # Legend to explain each tag
-st.markdown(
-    """
-    ###### Legend:
-    <span style='background-color: #FFB067; border-radius: 5px; padding: 2px;'>O</span>
-    <span style='background-color: #FFED86; border-radius: 5px; padding: 2px;'>LOC</span>
-    <span style='background-color: #A2DCE7; border-radius: 5px; padding: 2px;'>POST</span>
-    <span style='background-color: #F8CCDC; border-radius: 5px; padding: 2px;'>ADDR</span>
-    """,
-    unsafe_allow_html=True
-)
+    st.caption('Example Prediction for Fixed Position')
+
+    # Highlight the example address
+    highlighted_example = highlight_address(long_text, tags, confidence_list[0] if show_confidence else None)
+    # Streamlit markdown with the example and legend
+    st.markdown(
+        f"""
+        {highlighted_example}
+        """,
+        unsafe_allow_html=True
+    )
+
+        # Legend to explain each tag
+    st.markdown(
+        """
+        ###### Legend:
+        <span style='background-color: #FFB067; border-radius: 5px; padding: 2px;'>O</span>
+        <span style='background-color: #FFED86; border-radius: 5px; padding: 2px;'>LOC</span>
+        <span style='background-color: #A2DCE7; border-radius: 5px; padding: 2px;'>POST</span>
+        <span style='background-color: #F8CCDC; border-radius: 5px; padding: 2px;'>ADDR</span>
+        """,
+        unsafe_allow_html=True
+    )
 
-st.markdown('##### SHAP value of each token')
+    if show_confidence:
+        st.write("##### Least confident tokens")
+        st.dataframe(
+            least_confident_tokens(ResultStore.from_lists([long_text], tags_list, None, confidence_list), k=5).drop(columns="Address #"),
+            use_container_width=True,
+            hide_index=True,
+            column_config={"Confidence": st.column_config.ProgressColumn(min_value=0.0, max_value=1.0, format="%.3f")},
+        )
 
-# Handle categorical features
-cat_features = feature_df.select_dtypes(include=['object']).columns.tolist()
-feature_df = feature_df.apply(lambda row: fill_values(row, cat_features), axis=1)
+    show_shap = st.checkbox("Show SHAP value of each token", True)
 
-# SHAP explanation
-explainer = shap.Explainer(cbr)
-shap_values = explainer(feature_df)
-classes = cbr.classes_
+    if show_shap and long_text.split():
+        st.markdown('##### SHAP value of each token')
 
-# Get the predicted labels from the model (assume it returns an ndarray)
-predicted_labels = cbr.predict(feature_df)
+        # The CatBoost model is only loaded once somebody asks for SHAP values
+        cbr = get_model("catboost")
 
-    # Ensure we have a 1D array for easy handling
-if predicted_labels.ndim > 1:
-    predicted_labels = predicted_labels.flatten()  # Convert to 1D array if needed
+        # Prepare the tokens and features
+        tokens = long_text.split()
+        feature_df = catboost_feature_frame(tokens, cbr.feature_names_)
 
-# Map tags to class indices
-label_to_class_idx = {
-    'ADDR': 0,
-    'LOC': 1,
-    'O': 2,
-    'POST': 3
-}
+        # SHAP explanation for every token and class in one batched, cached call
+        shap_values = get_shap_engine().shap_values(feature_df)
+        classes = list(cbr.classes_)
 
-col1,col2,col3 = st.columns((1,4,1))
-with col2:
-        
-    # Iterate over tokens and predicted labels to call plot_shap_waterfall
-    for instance_idx, label in enumerate(predicted_labels):
-        tk = tokens[instance_idx]
+        # Get the predicted labels from the model (assume it returns an ndarray)
+        predicted_labels = cbr.predict(catboost_pool(feature_df, cbr))
+
+            # Ensure we have a 1D array for easy handling
+        if predicted_labels.ndim > 1:
+            predicted_labels = predicted_labels.flatten()  # Convert to 1D array if needed
 
-        # Get the corresponding tag for the token
-        token_tag = tags[instance_idx]  # Assuming `tags` is the list of NER tags for tokens
+        col1,col2,col3 = st.columns((1,4,1))
+        with col2:
+            # All tokens x features x classes in a single figure; click a cell to drill into its token
+            st.caption('Click a cell to see the SHAP values of that token')
+            heatmap_event = st.plotly_chart(
+                shap_heatmap_figure(shap_values, tokens, feature_df.columns, classes),
+                use_container_width=True,
+                on_select="rerun",
+                selection_mode="points",
+                key="shap_heatmap",
+            )
+            selected_points = heatmap_event.selection.points if heatmap_event else []
+            instance_idx = int(selected_points[0]["y"]) if selected_points else 0
+            instance_idx = min(instance_idx, len(tokens) - 1)
+
+            tk = tokens[instance_idx]
+            label = predicted_labels[instance_idx]
+
+            # Get the corresponding tag for the token
+            token_tag = tags[instance_idx]  # Assuming `tags` is the list of NER tags for tokens
 
             # Highlight each token with its tag
-        highlighted_token = highlight_address(tk, [token_tag])
-
-        label_color = {
-        'O':"<span style='background-color: #FFB067; border-radius: 5px; padding: 2px;'>O</span>",
-        'LOC':"<span style='background-color: #FFED86; border-radius: 5px; padding: 2px;'>LOC</span>",
-        'POST':"<span style='background-color: #A2DCE7; border-radius: 5px; padding: 2px;'>POST</span>",
-        'ADDR':"<span style='background-color: #F8CCDC; border-radius: 5px; padding: 2px;'>ADDR</span>"
-        }
-
-        if token_tag in label_color:
-            mk_tag = label_color[token_tag]
-
-        st.markdown(
-            f"""
-            SHAP Value for each features of
-            Token:
-            {highlighted_token} <br>
-            Tag: {mk_tag}
-            """,
-            unsafe_allow_html=True
-        )
+            highlighted_token = highlight_address(tk, [token_tag])
+
+            label_color = {
+            'O':"<span style='background-color: #FFB067; border-radius: 5px; padding: 2px;'>O</span>",
+            'LOC':"<span style='background-color: #FFED86; border-radius: 5px; padding: 2px;'>LOC</span>",
+            'POST':"<span style='background-color: #A2DCE7; border-radius: 5px; padding: 2px;'>POST</span>",
+            'ADDR':"<span style='background-color: #F8CCDC; border-radius: 5px; padding: 2px;'>ADDR</span>"
+            }
+            mk_tag = label_color.get(token_tag, token_tag)
+
+            st.markdown(
+                f"""
+                SHAP Value for each features of
+                Token:
+                {highlighted_token} <br>
+                Tag: {mk_tag}
+                """,
+                unsafe_allow_html=True
+            )
+            st.plotly_chart(
+                shap_token_figure(shap_values[instance_idx], feature_df.iloc[instance_idx], feature_df.columns, classes, label),
+                use_container_width=True,
+            )
+
+
+free_text_section(show_confidence)
+
+
+# Runs on a job thread. The rows tagged so far and their summary are the job's partial result; cancelling
+# stops at the next chunk and leaves those rows in the output file
+def run_ingest(job, file, fmt, output, columns, chunk_size, decoder, total_rows):
+  start = time.perf_counter()
+
+  def report_progress(summary, n_rows):
+    elapsed = time.perf_counter() - start
+    done = n_rows / total_rows if total_rows else file.tell() / max(len(file.getbuffer()), 1)
+    partial = {
+      "path": output, "file_name": os.path.basename(output), "rows": n_rows, "seconds": elapsed,
+      "summary": summary.to_frame(),
+    }
+    return job.update(done, f"{n_rows:,} rows, {n_rows / elapsed:,.0f} rows/s", partial)
+
+  tag_file(file, output, columns, fmt=fmt, chunk_size=chunk_size, decoder=decoder, on_chunk=report_progress)
+  return job.partial
+
+def finish_ingest(job):
+  st.session_state.pop('ingest_job', None)
+  if job.status == FAILED:
+    st.session_state['ingest_error'] = str(job.error)
+  result = job.result if job.done else job.partial
+  if result is not None:
+    st.session_state['ingest_result'] = dict(result, finished=job.status == DONE)
+
+def cancel_ingest(key):
+  runner = get_job_runner()
+  runner.cancel(key, session_id)
+  job = runner.get(key)
+  if job is not None:
+    finish_ingest(job)
+  else:
+    st.session_state.pop('ingest_job', None)
+
+def start_ingest(uploaded, fmt, columns, chunk_size, decoder):
+  previous = st.session_state.pop('ingest_result', None)
+  if previous is not None and os.path.exists(previous['path']):
+    os.remove(previous['path'])
+  st.session_state.pop('ingest_error', None)
+  # Files of sessions that ended, or of runs nobody came back for, would otherwise pile up
+  prune_outputs()
+  os.makedirs(DEFAULT_OUTPUT_DIR, exist_ok=True)
+  stem, ext = os.path.splitext(uploaded.name)
+  output = os.path.join(DEFAULT_OUTPUT_DIR, f"{stem}-tagged-{uuid.uuid4().hex[:8]}{ext}")
+  # The job reads its own copy: the uploaded file object belongs to this script run
+  file = io.BytesIO(uploaded.getvalue())
+  # One job per run and session, since each writes its own output file
+  key = job_key("ingest", output=output)
+  get_job_runner().submit(key, run_ingest, file, fmt, output, columns, chunk_size, decoder, count_rows(file, fmt),
+                          owner=session_id, pool=BULK)
+  st.session_state['ingest_job'] = key
+
+# Uploading, picking columns and starting a run only rerun this fragment; the tagging itself runs on a
+# background job, so other interactions with the page no longer interrupt it
+@st.fragment
+@timed_section("file tagging")
+def file_tagging_section():
+  uploaded = st.file_uploader("CSV, Parquet or JSONL file", type=[ext.lstrip(".") for ext in FORMATS])
+  if uploaded is not None:
+    fmt = detect_format(uploaded.name)
+    columns = read_columns(uploaded, fmt)
+    address_columns = st.multiselect(
+      "Address columns to tag",
+      columns,
+      default=[column for column in columns if "address" in column.lower()] or columns[:1],
+    )
+    ingest_chunk_size = st.number_input("Rows per chunk", min_value=100, max_value=200_000, value=DEFAULT_INGEST_CHUNK_SIZE, step=1_000, key="ingest_chunk_size")
+    ingest_decoder = st.radio("Decoder", list(DECODERS), horizontal=True, key="ingest_decoder")
+
+    if st.button("Tag file", disabled=not address_columns or 'ingest_job' in st.session_state):
+      start_ingest(uploaded, fmt, address_columns, ingest_chunk_size, ingest_decoder)
+      # The progress poller lives outside this fragment
+      st.rerun()
+
+  if 'ingest_error' in st.session_state:
+    st.error(f"Tagging the file failed: {st.session_state['ingest_error']}")
+  result = st.session_state.get('ingest_result')
+  if result is not None and 'ingest_job' not in st.session_state and os.path.exists(result['path']):
+    status = "Tagged" if result['finished'] else "Stopped after"
+    st.write(f"{status} {result['rows']:,} rows in {result['seconds']:.1f}s "
+             f"({result['rows'] / max(result['seconds'], 1e-9):,.0f} rows/s)")
+    st.write("##### Tags per column")
+    st.dataframe(result['summary'], use_container_width=True)
+    if not result['finished']:
+      st.warning(f"Tagging was stopped, so the file below holds only the first {result['rows']:,} rows.")
+    with open(result['path'], "rb") as f:
+      st.download_button("Download tagged file" if result['finished'] else "Download partial tagged file", f,
+                         file_name=result['file_name'])
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def ingest_job_status(key):
+  job = get_job_runner().get(key)
+  if job is None or job.done or job.cancelled:
+    if job is not None:
+      finish_ingest(job)
+    else:
+      st.session_state.pop('ingest_job', None)
+    # The result and download button live in the file tagging fragment
+    st.rerun()
+  st.progress(job.progress, text=job.message or "Waiting for a free worker...")
+  st.button("Cancel", key="cancel_ingest", on_click=cancel_ingest, args=(key,))
+  if job.partial is not None:
+    st.dataframe(job.partial['summary'], use_container_width=True)
+
 
-        # Only plot SHAP waterfall for relevant tags
-        if label in label_to_class_idx:
-            class_idx = label_to_class_idx[label]
-            plot_shap_waterfall(instance_idx, class_idx)
+with st.expander("Tag an address file"):
+  file_tagging_section()
+  if 'ingest_job' in st.session_state:
+    ingest_job_status(st.session_state['ingest_job'])
+
+
+# What the diagnostics tables show of each span's record
+SPAN_COLUMNS = ["wall_ms", "cpu_ms", "allocated_kib", "peak_kib"]
+
+def set_profiling():
+  if st.session_state['profiling']:
+    profiler.enable()
+  else:
+    profiler.disable()
+
+with st.expander("Diagnostics"):
+  st.write("##### Loaded models")
+  st.dataframe(pd.DataFrame.from_dict(model_stats(), orient="index"), use_container_width=True)
+  st.write("##### Prediction cache")
+  st.dataframe(pd.DataFrame([get_prediction_cache().stats()]), use_container_width=True, hide_index=True)
+  st.write("##### Sample cache")
+  st.caption(f"Samples of this session: {st.session_state['samples_key']}")
+  st.dataframe(pd.DataFrame([get_sample_cache().stats()]), use_container_width=True, hide_index=True)
+  st.write("##### Background jobs")
+  st.dataframe(pd.DataFrame(get_job_runner().stats()), use_container_width=True, hide_index=True)
+  st.toggle("Profile CPU time and memory", value=profiler.enabled, key="profiling", on_change=set_profiling,
+            help=f"Traces allocations with tracemalloc for the whole server, which slows every session down, and appends each stage to {DEFAULT_LOG_PATH}.")
+  st.write("##### Last run of each section")
+  sections = pd.DataFrame.from_dict(st.session_state.get('section_timings', {}), orient="index")
+  st.dataframe(sections.filter(SPAN_COLUMNS), use_container_width=True)
+  if profiler.enabled:
+    st.write("##### Stages of this run")
+    sample_job = get_job_runner().get(st.session_state.get('samples_key'))
+    stages = (sample_job.spans if sample_job is not None else []) + list(profiler.records())
+    st.dataframe(pd.DataFrame(stages).filter(["name", "parent", *SPAN_COLUMNS]), use_container_width=True, hide_index=True)
+  if os.path.exists(DEFAULT_LOG_PATH):
+    st.write(f"##### All profiled runs ({DEFAULT_LOG_PATH})")
+    st.dataframe(summarize(DEFAULT_LOG_PATH), use_container_width=True)
+  st.write("##### Session results (bytes)")
+  st.dataframe(
+    pd.DataFrame({"Generated": results.memory_usage(), "Shuffled": shuffled_results.memory_usage()}).T.assign(total=lambda df: df.sum(axis=1)),
+    use_container_width=True,
+  )
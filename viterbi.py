@@ -0,0 +1,195 @@
+import os
+import re
+import tempfile
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+from models import get_model
+from tagger import DEFAULT_CHUNK_SIZE, TokenBatch, word_features
+
+
+# One entry of the STATE_FEATURES / TRANSITIONS sections of `crfsuite dump`.
+# Attribute names may contain newlines (the training data had tokens with
+# them), which is why this matches across lines instead of line by line.
+_DUMP_ENTRY = re.compile(r"^  \(\d+\) (.*?) --> ([^\n]*?): ([+-]?\d+\.\d+)$", re.M | re.S)
+
+
+def _dump_sections(text):
+    sections = {}
+    for match in re.finditer(r"^(\w+) = \{\n(.*?)^\}$", text, re.M | re.S):
+        sections[match.group(1)] = match.group(2)
+    return sections
+
+
+def _attribute_weights(features):
+    # The same conversion python-crfsuite applies to a feature dict
+    for name, value in features.items():
+        if isinstance(value, str):
+            yield f"{name}:{value}", 1.0
+        else:
+            yield name, float(value)
+
+
+class NumpyCRF:
+    """A linear-chain CRF held as dense NumPy arrays and decoded in batches.
+
+    `state` is (attributes, labels) and `transitions` is (labels, labels),
+    both exported from a trained sklearn_crfsuite model; attribute rows are
+    looked up through `vocabulary`, a dict from crfsuite attribute string
+    to row.
+    """
+
+    def __init__(self, labels, vocabulary, state, transitions):
+        self.labels = list(labels)
+        self.vocabulary = vocabulary
+        self.state = state
+        self.transitions = transitions
+        self._labels = np.asarray(self.labels, dtype=object)
+        # Per-word emission pieces depend on the weights, so each instance has its own cache
+        self._piece_scores = lru_cache(maxsize=100_000)(self._compute_piece_scores)
+        self._bos = self._score({"BOS": True})
+        self._eos = self._score({"EOS": True})
+
+    @classmethod
+    def from_model(cls, model):
+        """Export the weights of a trained sklearn_crfsuite CRF."""
+        fd, path = tempfile.mkstemp(suffix=".txt")
+        os.close(fd)
+        try:
+            model.tagger_.dump(path)
+            with open(path, encoding="utf-8") as f:
+                sections = _dump_sections(f.read())
+        finally:
+            os.remove(path)
+
+        labels = list(model.tagger_.labels())
+        label_index = {label: i for i, label in enumerate(labels)}
+
+        transitions = np.zeros((len(labels), len(labels)))
+        for from_label, to_label, weight in _DUMP_ENTRY.findall(sections.get("TRANSITIONS", "")):
+            transitions[label_index[from_label], label_index[to_label]] = float(weight)
+
+        entries = _DUMP_ENTRY.findall(sections.get("STATE_FEATURES", ""))
+        vocabulary = {}
+        for attribute, _, _ in entries:
+            vocabulary.setdefault(attribute, len(vocabulary))
+        state = np.zeros((len(vocabulary), len(labels)))
+        for attribute, label, weight in entries:
+            state[vocabulary[attribute], label_index[label]] = float(weight)
+        return cls(labels, vocabulary, state, transitions)
+
+    def _score(self, features):
+        rows = []
+        weights = []
+        for attribute, weight in _attribute_weights(features):
+            row = self.vocabulary.get(attribute)
+            # crfsuite ignores attributes it never saw in training
+            if row is not None:
+                rows.append(row)
+                weights.append(weight)
+        return np.asarray(weights) @ self.state[rows]
+
+    def _compute_piece_scores(self, word):
+        own, as_prev, as_next = word_features(word)
+        return self._score(own), self._score(as_prev), self._score(as_next)
+
+    def word_pieces(self, words):
+        """(words, 3, labels) scores of each word's own, "-1" and "+1" features.
+
+        None of the three depends on the word's neighbours, so they can be
+        scored once per distinct word and reused wherever the word appears.
+        """
+        return np.asarray([self._piece_scores(word) for word in words]).reshape(-1, 3, len(self.labels))
+
+    def emissions(self, batch):
+        """Per-token label scores for every sequence of a TokenBatch, as one (tokens, labels) array."""
+        # Score each distinct word once, then gather the rows for every token
+        pieces = self.word_pieces(batch.words)
+        own = pieces[batch.ids, 0]
+        as_prev = pieces[batch.ids, 1]
+        as_next = pieces[batch.ids, 2]
+        is_first, is_last = batch.is_first, batch.is_last
+
+        # Each token sees its neighbour's "-1"/"+1" piece, or BOS/EOS at the edges
+        emission = own
+        emission[is_first] += self._bos
+        emission[~is_first] += as_prev[np.flatnonzero(~is_first) - 1]
+        emission[is_last] += self._eos
+        emission[~is_last] += as_next[np.flatnonzero(~is_last) + 1]
+        return emission
+
+    def sequence_emissions(self, pieces, words):
+        """emissions() for equal-length sequences given as a (sequences, steps) array of rows of `pieces`."""
+        emission = pieces[words, 0]
+        emission[:, 0] += self._bos
+        emission[:, 1:] += pieces[words[:, :-1], 1]
+        emission[:, -1] += self._eos
+        emission[:, :-1] += pieces[words[:, 1:], 2]
+        return emission
+
+    def decode(self, token_lists):
+        """Viterbi-decode every sequence at once over a padded (sequences, steps, labels) tensor."""
+        return self.decode_batch(TokenBatch(token_lists))
+
+    def decode_batch(self, batch):
+        """decode() for a TokenBatch whose features were computed already."""
+        emission, lengths = self.emissions(batch), batch.lengths
+        n_seqs, n_labels = len(lengths), len(self.labels)
+        n_steps = int(lengths.max()) if n_seqs else 0
+
+        padded = np.zeros((n_seqs, n_steps, n_labels))
+        rows = np.repeat(np.arange(n_seqs), lengths)
+        cols = np.arange(len(emission)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        padded[rows, cols] = emission
+
+        paths = self.best_paths(padded, lengths)
+        return [self._labels[path[:length]].tolist() for path, length in zip(paths, lengths)]
+
+    def best_paths(self, padded, lengths):
+        """Viterbi over padded (sequences, steps, labels) emissions; label indices, (sequences, steps)."""
+        n_seqs, n_steps, n_labels = padded.shape
+        backpointers = np.zeros((n_seqs, n_steps, n_labels), dtype=np.intp)
+        delta = padded[:, 0] if n_steps else np.zeros((n_seqs, n_labels))
+        for t in range(1, n_steps):
+            # candidates[s, i, j]: best path ending in label i at t-1, then moving to j
+            candidates = delta[:, :, None] + self.transitions[None]
+            best_prev = candidates.argmax(axis=1)
+            stepped = np.take_along_axis(candidates, best_prev[:, None, :], axis=1)[:, 0] + padded[:, t]
+            # Sequences that already ended keep their final scores
+            active = t < lengths
+            backpointers[:, t] = best_prev
+            delta = np.where(active[:, None], stepped, delta)
+
+        paths = np.zeros((n_seqs, n_steps), dtype=np.intp)
+        last = delta.argmax(axis=1)
+        for t in range(n_steps - 1, -1, -1):
+            ending = lengths - 1 == t
+            paths[ending, t] = last[ending]
+            if t > 0:
+                inside = lengths - 1 >= t
+                paths[inside, t - 1] = backpointers[inside, t, paths[inside, t]]
+        return paths
+
+
+_crf = None
+_crf_lock = threading.Lock()
+
+
+def get_numpy_crf():
+    """The process-wide NumpyCRF exported from the registered CRF model."""
+    global _crf
+    with _crf_lock:
+        if _crf is None:
+            _crf = NumpyCRF.from_model(get_model("crf"))
+    return _crf
+
+
+def parse_many_numpy(texts, chunk_size=DEFAULT_CHUNK_SIZE):
+    """parse_many() on the NumPy Viterbi decoder instead of crfsuite."""
+    crf = get_numpy_crf()
+    predicted_tags_list = []
+    for start in range(0, len(texts), chunk_size):
+        predicted_tags_list.extend(crf.decode([text.split() for text in texts[start:start + chunk_size]]))
+    return predicted_tags_list